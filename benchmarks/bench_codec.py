@@ -0,0 +1,80 @@
+"""
+Compares the framed binary block codec with the previous pickle wrapped JSON format.
+
+Usage:
+    python -m benchmarks.bench_codec --transactions 10 1000 --rounds 200
+"""
+import argparse
+import json
+import pickle
+import time
+
+from classes import Block
+from wire import MSG_ADD_BLOCK, FrameDecoder, decode_block, encode_block, encode_message
+
+
+def legacy_encode(block_data):
+    return b"2" + pickle.dumps(json.dumps(block_data, sort_keys=True))
+
+
+def legacy_decode(message):
+    return json.loads(pickle.loads(message[1:]))
+
+
+def wire_decode(message):
+    decoder = FrameDecoder()
+    ((_, payload),) = decoder.feed(message)
+    return decode_block(payload)
+
+
+def wire_encode(block_data):
+    return encode_message(MSG_ADD_BLOCK, encode_block(block_data))
+
+
+def measure(encode, decode, block_data, rounds):
+    """
+    Encodes and decodes block data repeatedly.
+
+    Returns:
+        A tuple of (message size in bytes, microseconds per encode, microseconds per decode).
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        message = encode(block_data)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode(message)
+    decode_time = time.perf_counter() - start
+    return len(message), encode_time / rounds * 1e6, decode_time / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transactions", type=int, nargs="+", default=[0, 10, 1000])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'codec':>8} {'txs':>6} {'bytes':>10} {'enc us':>10} {'dec us':>10}")
+    for transactions in args.transactions:
+        block = Block(
+            transactions=[
+                {"sender": f"a{n}", "recipient": f"b{n}", "amount": n}
+                for n in range(transactions)
+            ],
+            timestamp=time.time(),
+            previous_hash="0" * 64,
+        )
+        block.calculate_proof_of_work()
+        for name, encode, decode in (
+            ("legacy", legacy_encode, legacy_decode),
+            ("wire", wire_encode, wire_decode),
+        ):
+            size, encode_us, decode_us = measure(
+                encode, decode, block.to_dict(), args.rounds
+            )
+            print(f"{name:>8} {transactions:>6} {size:>10} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
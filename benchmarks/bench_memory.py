@@ -0,0 +1,96 @@
+"""
+Compares memory used by an in-memory chain of compact blocks with the previous dict based block model.
+
+Memory is measured with tracemalloc as bytes allocated while building the chain, and compared with the
+raw size of the chain, i.e. the total length of the binary encoding of its blocks.
+
+Usage:
+    python -m benchmarks.bench_memory --blocks 100000 --transactions 0 2 10
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from hashlib import sha256
+
+from classes import Block, compute_transaction_id
+from merkle import MerkleTree
+
+
+class LegacyBlock:
+    """The previous block model: fields in a per-instance __dict__, transactions as a list of dictionaries."""
+
+    def __init__(self, transactions, timestamp, previous_hash, nonce=0, hash=None):
+        self.hash = hash
+        self.transactions = transactions
+        self.timestamp = timestamp
+        self.previous_hash = previous_hash
+        self.nonce = nonce
+        self.merkle_root = MerkleTree(
+            [compute_transaction_id(transaction) for transaction in transactions]
+        ).root
+
+
+def build_chain(block_class, blocks, transactions):
+    """
+    Builds a chain of linked blocks without proof of work.
+
+    Returns:
+        A list of blocks.
+    """
+    chain = []
+    previous_hash = "0"
+    for i in range(blocks):
+        block = block_class(
+            transactions=[
+                {"sender": f"a{i}", "recipient": f"b{n}", "amount": n}
+                for n in range(transactions)
+            ],
+            timestamp=time.time(),
+            previous_hash=previous_hash,
+            nonce=i,
+        )
+        block.hash = sha256(f"{previous_hash}{i}".encode()).hexdigest()
+        previous_hash = block.hash
+        chain.append(block)
+    return chain
+
+
+def measure(block_class, blocks, transactions):
+    """
+    Builds a chain and measures memory it holds.
+
+    Returns:
+        A tuple of (the chain, allocated bytes).
+    """
+    gc.collect()
+    tracemalloc.start()
+    chain = build_chain(block_class, blocks, transactions)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chain, allocated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--blocks", type=int, default=100_000)
+    parser.add_argument("--transactions", type=int, nargs="+", default=[0, 2, 10])
+    args = parser.parse_args()
+
+    print(f"{'model':>8} {'txs':>6} {'raw MiB':>10} {'heap MiB':>10} {'B/block':>10} {'overhead':>9}")
+    for transactions in args.transactions:
+        chain, _ = measure(Block, args.blocks, transactions)
+        raw = sum(len(block.to_bytes()) for block in chain)
+        del chain
+        for name, block_class in (("legacy", LegacyBlock), ("compact", Block)):
+            chain, allocated = measure(block_class, args.blocks, transactions)
+            del chain
+            print(
+                f"{name:>8} {transactions:>6} {raw / 2**20:>10.1f} {allocated / 2**20:>10.1f} "
+                f"{allocated / args.blocks:>10.0f} {allocated / raw:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Compares proof of work hash rate of the serial loop and the parallel miner.
+
+Usage:
+    python -m benchmarks.bench_mining --difficulties 256 4096 65536 --workers 2 4 --transactions 1 1000
+"""
+import argparse
+import os
+import time
+
+import mining
+from classes import Block
+
+
+def run_case(difficulty, workers, blocks, transactions):
+    """
+    Mines a number of blocks with given difficulty (expected number of hashes), number of workers and
+    transactions per block.
+
+    Returns:
+        A tuple of (hashes per second, average seconds per block).
+    """
+    hashes = 0
+    elapsed = 0.0
+    for i in range(blocks):
+        block = Block(
+            transactions=[{"bench": i, "n": n} for n in range(transactions)],
+            timestamp=i,
+            previous_hash="0",
+            difficulty=difficulty,
+        )
+        start = time.perf_counter()
+        if workers == 1:
+            block.calculate_proof_of_work()
+        else:
+            block.nonce = mining.find_nonce_parallel(block, workers)
+        elapsed += time.perf_counter() - start
+        hashes += block.nonce + 1
+    return hashes / elapsed, elapsed / blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--difficulties", type=int, nargs="+", default=[256, 4096, 65536])
+    parser.add_argument("--workers", type=int, nargs="+", default=[os.cpu_count()])
+    parser.add_argument("--transactions", type=int, nargs="+", default=[1])
+    parser.add_argument("--blocks", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'difficulty':>10} {'txs':>6} {'workers':>8} {'hashes/s':>12} {'s/block':>10}")
+    for difficulty in args.difficulties:
+        for transactions in args.transactions:
+            for workers in [1] + [w for w in args.workers if w > 1]:
+                rate, per_block = run_case(difficulty, workers, args.blocks, transactions)
+                print(
+                    f"{difficulty:>10} {transactions:>6} {workers:>8} {rate:>12.0f} {per_block:>10.3f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
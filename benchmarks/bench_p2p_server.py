@@ -0,0 +1,121 @@
+"""
+Load test of the asyncio P2P server against the previous thread-per-connection server.
+
+The server runs in a child process which reports its resident memory, so memory per connection is
+measured without the clients. Every client connection sends a number of small framed messages.
+
+Usage:
+    python -m benchmarks.bench_p2p_server --connections 100 1000 --messages 20
+"""
+import argparse
+import multiprocessing
+import socket
+import threading
+import time
+
+from server import P2PServer
+from wire import MSG_ADD_NODE, encode_message, encode_node, read_message
+
+
+def rss_kib():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def start_thread_server(handler):
+    """Starts a server spawning one thread per connection, like start_server used to."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+
+    def serve_connection(conn):
+        with conn:
+            while True:
+                message = read_message(conn)
+                if message is None:
+                    return
+                handler(*message)
+
+    def accept_loop():
+        while True:
+            conn, _ = listener.accept()
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener.getsockname()
+
+
+def run_server(kind, pipe):
+    handled = [0]
+    lock = threading.Lock()
+
+    def handler(msg_type, payload):
+        with lock:
+            handled[0] += 1
+
+    if kind == "asyncio":
+        address = P2PServer(handler, "127.0.0.1").start()
+    else:
+        address = start_thread_server(handler)
+    pipe.send(address)
+    while pipe.recv() == "status":
+        pipe.send((rss_kib(), handled[0]))
+
+
+def run_case(kind, connections, messages):
+    """
+    Returns:
+        A tuple of (messages per second, KiB of server memory per connection).
+    """
+    pipe, child_pipe = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_server, args=(kind, child_pipe))
+    process.start()
+    try:
+        address = pipe.recv()
+        pipe.send("status")
+        base_rss, _ = pipe.recv()
+        clients = [socket.create_connection(address) for _ in range(connections)]
+        time.sleep(0.5)
+        pipe.send("status")
+        connected_rss, _ = pipe.recv()
+
+        frame = encode_message(
+            MSG_ADD_NODE, encode_node({"host": "127.0.0.1", "port": 8000})
+        )
+        start = time.perf_counter()
+        for _ in range(messages):
+            for client in clients:
+                client.sendall(frame)
+        total = connections * messages
+        handled = 0
+        while handled < total:
+            pipe.send("status")
+            _, handled = pipe.recv()
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            client.close()
+        return total / elapsed, (connected_rss - base_rss) / connections
+    finally:
+        pipe.send("stop")
+        process.join(timeout=1)
+        process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'server':>8} {'conns':>7} {'msgs/s':>10} {'KiB/conn':>10}")
+    for connections in args.connections:
+        for kind in ("threads", "asyncio"):
+            rate, memory = run_case(kind, connections, args.messages)
+            print(f"{kind:>8} {connections:>7} {rate:>10.0f} {memory:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
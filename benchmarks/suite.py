@@ -0,0 +1,427 @@
+"""
+Benchmark suite of the node, with results written as JSON so runs can be compared.
+
+Microbenchmarks run in process: block hashing, proof of work, Blockchain.to_dict/from_dict, the P2P
+message codec and block template updates. Macrobenchmarks start local nodes with `flask --app "main:create_app()" run`, like
+integration_tests_script.py, and measure block propagation latency, /chain throughput and sync time of
+a new node against chain length.
+
+Nodes are started with TARGET_BLOCK_INTERVAL=0, so difficulty falls to its minimum and long chains are
+mined quickly; proof of work itself is measured by the microbenchmarks.
+
+Usage:
+    python -m benchmarks.suite micro --output micro.json
+    python -m benchmarks.suite macro --nodes 4 --lengths 100 1000 --output macro.json
+    python -m benchmarks.suite all --output current.json --compare baseline.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+import classes
+from classes import Block, Blockchain
+from wire import FrameDecoder, MSG_ADD_BLOCK, decode_block, encode_block, encode_message
+
+LOCALHOST = "http://127.0.0.1"
+FIRST_NODE_PORT = 8100
+NODE_START_TIMEOUT = 10
+PROPAGATION_TIMEOUT = 10
+POLL_INTERVAL = 0.002
+
+# Metrics for which a higher value is better; for all other metrics (times) lower is better.
+HIGHER_IS_BETTER = ("per_s",)
+
+
+def measure(function, rounds):
+    """
+    Calls a function repeatedly and measures each call.
+
+    Args:
+        function (Callable): The measured function, called without arguments.
+        rounds (int): Number of calls.
+
+    Returns:
+        A dictionary with mean, median and minimum time of a call in microseconds and calls per second.
+    """
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {
+        "rounds": rounds,
+        "mean_us": statistics.mean(times) * 1e6,
+        "median_us": statistics.median(times) * 1e6,
+        "min_us": min(times) * 1e6,
+        "calls_per_s": len(times) / sum(times),
+    }
+
+
+def make_block(transactions, difficulty=classes.INITIAL_DIFFICULTY):
+    return Block(
+        transactions=[
+            {"sender": f"a{n}", "recipient": f"b{n}", "amount": n}
+            for n in range(transactions)
+        ],
+        timestamp=time.time(),
+        previous_hash="0" * 64,
+        difficulty=difficulty,
+    )
+
+
+def mine_chain(length, transactions=1):
+    """Mines a chain of given length (genesis included) in process."""
+    blockchain = Blockchain(mining_workers=1)
+    for height in range(1, length):
+        for n in range(transactions):
+            blockchain.add_new_transaction({"height": height, "n": n})
+        blockchain.mine_block()
+    return blockchain
+
+
+def bench_compute_hash(args):
+    results = {}
+    for transactions in args.transactions:
+        block = make_block(transactions)
+        results[f"txs={transactions}"] = measure(block.compute_hash, args.rounds)
+    return results
+
+
+def bench_proof_of_work(args):
+    results = {}
+    for difficulty in args.difficulties:
+        hashes = 0
+
+        def mine():
+            nonlocal hashes
+            block = make_block(1, difficulty)
+            block.calculate_proof_of_work()
+            hashes += block.nonce + 1
+
+        result = measure(mine, args.pow_rounds)
+        result["hashes_per_s"] = hashes / (result["mean_us"] * result["rounds"] / 1e6)
+        results[f"difficulty={difficulty}"] = result
+    return results
+
+
+def bench_blockchain_dict(args):
+    results = {}
+    for length in args.chain_lengths:
+        blockchain = mine_chain(length)
+        blockchain_dict = blockchain.to_dict()
+        results[f"length={length}"] = {
+            "to_dict": measure(blockchain.to_dict, args.chain_rounds),
+            "from_dict": measure(
+                lambda: Blockchain.from_dict(blockchain_dict), args.chain_rounds
+            ),
+        }
+    return results
+
+
+def bench_codec(args):
+    results = {}
+    for transactions in args.transactions:
+        block = make_block(transactions)
+        block.calculate_proof_of_work()
+        block_data = block.to_dict()
+        encoded = encode_block(block_data)
+        message = encode_message(MSG_ADD_BLOCK, block.to_bytes())
+
+        def decode_message():
+            ((_, payload),) = FrameDecoder().feed(message)
+            return Block.from_bytes(payload)
+
+        results[f"txs={transactions}"] = {
+            "message_bytes": len(message),
+            "encode_block": measure(lambda: encode_block(block_data), args.rounds),
+            "decode_block": measure(lambda: decode_block(encoded), args.rounds),
+            "encode_message": measure(
+                lambda: encode_message(MSG_ADD_BLOCK, Block.from_dict(block_data).to_bytes()),
+                args.rounds,
+            ),
+            "decode_message": measure(decode_message, args.rounds),
+        }
+    return results
+
+
+def bench_block_template(args):
+    results = {}
+    for transactions in args.transactions:
+        blockchain = Blockchain(mining_workers=1)
+        template = blockchain.block_template()
+        blockchain.add_new_transactions([{"n": n} for n in range(transactions)])
+        template.candidate()
+        counter = iter(range(transactions, 2**62))
+        results[f"txs={transactions}"] = {
+            "add_transaction": measure(
+                lambda: blockchain.add_new_transaction({"n": next(counter)}), args.rounds
+            ),
+            "candidate": measure(template.candidate, args.rounds),
+            "get_work": measure(template.get_work, args.rounds),
+        }
+    return results
+
+
+def run_micro(args):
+    # Blocks mined back to back would otherwise make difficulty grow with every block.
+    classes.TARGET_BLOCK_INTERVAL = 0
+    return {
+        "compute_hash": bench_compute_hash(args),
+        "proof_of_work": bench_proof_of_work(args),
+        "blockchain_dict": bench_blockchain_dict(args),
+        "codec": bench_codec(args),
+        "block_template": bench_block_template(args),
+    }
+
+
+class LocalNode:
+    """A node run as a separate Flask process on the local host."""
+
+    def __init__(self, port):
+        self.port = port
+        self.url = f"{LOCALHOST}:{port}"
+        self.session = requests.Session()
+        env = dict(os.environ, TARGET_BLOCK_INTERVAL="0")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "flask", "--app", "main:create_app()", "run", "--port", str(port)],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def wait_ready(self):
+        deadline = time.monotonic() + NODE_START_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                self.session.get(f"{self.url}/nodes", timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.05)
+        raise RuntimeError(f"Node on port {self.port} did not start")
+
+    def mine_block(self):
+        self.session.get(f"{self.url}/mine_block").raise_for_status()
+
+    def height(self):
+        return self.session.get(f"{self.url}/chain", params={"limit": 0}).json()["length"] - 1
+
+    def block_at(self, height):
+        chain = self.session.get(
+            f"{self.url}/chain", params={"from_height": height, "limit": 1}
+        ).json()["chain"]
+        return chain[0] if chain else None
+
+    def register(self, other):
+        response = self.session.post(
+            f"{self.url}/register", json={"node_http_address": other.url}
+        )
+        response.raise_for_status()
+
+    def stop(self):
+        self.process.kill()
+        self.process.wait()
+        self.session.close()
+
+
+def start_nodes(count, first_port):
+    nodes = [LocalNode(first_port + i) for i in range(count)]
+    try:
+        for node in nodes:
+            node.wait_ready()
+    except RuntimeError:
+        stop_nodes(nodes)
+        raise
+    return nodes
+
+
+def stop_nodes(nodes):
+    for node in nodes:
+        node.stop()
+
+
+def bench_propagation(args, port):
+    """Mines blocks on random nodes of a network and waits until all other nodes have them."""
+    nodes = start_nodes(args.nodes, port)
+    try:
+        for node in nodes[1:]:
+            node.register(nodes[0])
+        latencies = []
+        for _ in range(args.propagation_blocks):
+            source = random.choice(nodes)
+            height = source.height() + 1
+            start = time.perf_counter()
+            source.mine_block()
+            block_hash = source.block_at(height)["hash"]
+            for node in nodes:
+                if node is source:
+                    continue
+                deadline = time.monotonic() + PROPAGATION_TIMEOUT
+                while True:
+                    block = node.block_at(height)
+                    if block is not None and block["hash"] == block_hash:
+                        break
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"Block did not reach node on port {node.port}")
+                    time.sleep(POLL_INTERVAL)
+            latencies.append(time.perf_counter() - start)
+        return {
+            "nodes": args.nodes,
+            "blocks": len(latencies),
+            "mean_ms": statistics.mean(latencies) * 1e3,
+            "median_ms": statistics.median(latencies) * 1e3,
+            "max_ms": max(latencies) * 1e3,
+        }
+    finally:
+        stop_nodes(nodes)
+
+
+def bench_chain_and_sync(args, port):
+    """Measures /chain throughput and sync time of a new node for each chain length."""
+    results = {}
+    for length in args.lengths:
+        source, sink = start_nodes(2, port)
+        try:
+            for _ in range(length - 1):
+                source.mine_block()
+
+            throughput = {}
+            for name, params in (
+                ("json", {}),
+                ("json_stream", {"stream": "true"}),
+                ("ndjson", {"format": "ndjson"}),
+            ):
+                received = 0
+                start = time.perf_counter()
+                for _ in range(args.chain_requests):
+                    received += len(source.session.get(f"{source.url}/chain", params=params).content)
+                elapsed = time.perf_counter() - start
+                throughput[name] = {
+                    "requests_per_s": args.chain_requests / elapsed,
+                    "mib_per_s": received / elapsed / 2**20,
+                }
+
+            start = time.perf_counter()
+            sink.register(source)
+            sync_time = time.perf_counter() - start
+            if sink.height() != length - 1:
+                raise RuntimeError(f"Sync of {length} blocks did not complete")
+            results[f"length={length}"] = {
+                "chain": throughput,
+                "sync_s": sync_time,
+                "sync_blocks_per_s": (length - 1) / sync_time,
+            }
+        finally:
+            stop_nodes([source, sink])
+    return results
+
+
+def run_macro(args):
+    return {
+        "propagation": bench_propagation(args, args.port),
+        "chain_and_sync": bench_chain_and_sync(args, args.port + args.nodes),
+    }
+
+
+def flatten(results, prefix=""):
+    """Flattens nested results into a dictionary mapping dotted metric paths to numbers."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline, max_regression):
+    """
+    Compares time and rate metrics of two runs.
+
+    Args:
+        current (dict): Results of this run.
+        baseline (dict): Results of the run compared against.
+        max_regression (float): Allowed relative worsening of a metric, e.g. 0.2 for 20%.
+
+    Returns:
+        A list of (metric, baseline value, current value, relative change) of metrics worse than allowed;
+        a positive change is always a worsening.
+    """
+    current, baseline = flatten(current["results"]), flatten(baseline["results"])
+    regressions = []
+    for metric, old in baseline.items():
+        new = current.get(metric)
+        if new is None or not old or not metric.endswith(("_us", "_ms", "_s")):
+            continue
+        if metric.endswith(HIGHER_IS_BETTER):
+            change = old / new - 1 if new else float("inf")
+        else:
+            change = new / old - 1
+        if change > max_regression:
+            regressions.append((metric, old, new, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("suite", choices=["micro", "macro", "all"])
+    parser.add_argument("--output", help="file the JSON results are written to (default stdout)")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    micro = parser.add_argument_group("microbenchmarks")
+    micro.add_argument("--rounds", type=int, default=1000)
+    micro.add_argument("--transactions", type=int, nargs="+", default=[1, 100, 1000])
+    micro.add_argument("--difficulties", type=int, nargs="+", default=[256, 4096])
+    micro.add_argument("--pow-rounds", type=int, default=20)
+    micro.add_argument("--chain-lengths", type=int, nargs="+", default=[100, 1000])
+    micro.add_argument("--chain-rounds", type=int, default=5)
+    macro = parser.add_argument_group("macrobenchmarks")
+    macro.add_argument("--nodes", type=int, default=4)
+    macro.add_argument("--port", type=int, default=FIRST_NODE_PORT)
+    macro.add_argument("--propagation-blocks", type=int, default=20)
+    macro.add_argument("--lengths", type=int, nargs="+", default=[100, 1000])
+    macro.add_argument("--chain-requests", type=int, default=20)
+    args = parser.parse_args()
+
+    results = {}
+    if args.suite in ("micro", "all"):
+        results["micro"] = run_micro(args)
+    if args.suite in ("macro", "all"):
+        results["macro"] = run_macro(args)
+    report = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "arguments": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.max_regression)
+        for metric, old, new, change in regressions:
+            print(f"Regression {metric}: {old:.3f} -> {new:.3f} ({change:+.0%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
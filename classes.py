@@ -1,59 +1,367 @@
+import heapq
 import json
+import math
+import os
+import threading
 import time
+from collections import OrderedDict
 from hashlib import sha256
 
-PROOF_OF_WORK_DIFFICULTY = 2
+import metrics
+from merkle import MerkleTree
+from signatures import SignatureVerifier
+from state import StateIndex, is_transfer_like, transfer_of
+from wire import encode_transactions, pack_block, unpack_block
+
+HEADER_FIELDS = ("hash", "previous_hash", "merkle_root", "timestamp", "nonce", "difficulty")
+MAX_TARGET = 2**256 - 1
+# Difficulty is the expected number of hashes needed to find a proof of work.
+INITIAL_DIFFICULTY = 256
+MIN_DIFFICULTY = 1
+# Nonces and difficulties are encoded as unsigned 64-bit integers (see wire.pack_block).
+MAX_HEADER_INTEGER = 2**64 - 1
+# Integer timestamps are encoded as signed 64-bit integers (see wire.pack_block).
+TIMESTAMP_INTEGER_RANGE = range(-(2**63), 2**63)
+GENESIS_TIMESTAMP = 0
+TARGET_BLOCK_INTERVAL = float(os.environ.get("TARGET_BLOCK_INTERVAL", 10))
+RETARGET_WINDOW = int(os.environ.get("RETARGET_WINDOW", 20))
+MAX_RETARGET_FACTOR = 4
+# How far past the local clock a block timestamp may be, in seconds.
+MAX_FUTURE_BLOCK_TIME = float(os.environ.get("MAX_FUTURE_BLOCK_TIME", 2 * 60 * 60))
+MINING_WORKERS = int(os.environ.get("MINING_WORKERS", 1))
+MAX_BLOCK_TRANSACTIONS = 1000
+MEMPOOL_MAX_BYTES = 32 * 1024 * 1024
+MAX_TRANSACTION_BYTES = 100_000
+CANCEL_CHECK_INTERVAL = 1024
+GENESIS_PREVIOUS_HASH = "0"
+EMPTY_TRANSACTIONS = b"[]"
+MAX_SIDE_BLOCKS = 1000
+MAX_ORPHAN_BLOCKS = 100
+
+
+def compute_transaction_id(transaction):
+    """
+    Computes the ID of a transaction as the SHA-256 hash of its canonical JSON form.
+
+    Args:
+        transaction (dict): A dictionary containing transaction data.
+
+    Returns:
+        The hex transaction ID.
+    """
+    return sha256(json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+
+
+def validate_transaction(transaction, size=None):
+    """
+    Checks if a transaction is well-formed.
+
+    Args:
+        transaction (dict): A dictionary containing transaction data.
+        size (int): Length of the canonical JSON form of the transaction, if it is already known.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the transaction is not a non-empty JSON object of at most MAX_TRANSACTION_BYTES.
+        ValueError: If the transaction has the fields of a transfer but is not a valid one (see state.transfer_of).
+    """
+    if not isinstance(transaction, dict):
+        raise ValueError("Transaction must be a JSON object")
+    if not transaction:
+        raise ValueError("Transaction is empty")
+    if is_transfer_like(transaction) and transfer_of(transaction) is None:
+        raise ValueError("Invalid transfer: amount must be a finite positive number")
+    if size is None:
+        size = len(json.dumps(transaction, sort_keys=True))
+    if size > MAX_TRANSACTION_BYTES:
+        raise ValueError("Transaction too large")
+
+
+def prepare_transaction(transaction):
+    """
+    Checks if a transaction is well-formed and computes its ID and size from a single serialization.
+
+    Args:
+        transaction (dict): A dictionary containing transaction data.
+
+    Returns:
+        A tuple (transaction ID, size of the canonical JSON form in bytes), as used by Mempool.
+
+    Raises:
+        ValueError: If the transaction is malformed (see validate_transaction).
+    """
+    if not isinstance(transaction, dict):
+        raise ValueError("Transaction must be a JSON object")
+    canonical = json.dumps(transaction, sort_keys=True).encode()
+    validate_transaction(transaction, len(canonical))
+    return sha256(canonical).hexdigest(), len(canonical)
+
+
+def is_valid_nonce(nonce):
+    """Checks that a nonce is an integer which fits the binary block encoding (see wire.pack_block)."""
+    return type(nonce) is int and 0 <= nonce <= MAX_HEADER_INTEGER
+
+
+def hash_header(prefix_state, nonce):
+    """
+    Computes a block hash from a precomputed SHA-256 state of the header prefix and a nonce.
+
+    Args:
+        prefix_state (hashlib._Hash): SHA-256 object which has already consumed the header prefix.
+        nonce (int): The nonce to hash.
+
+    Returns:
+        The raw 32 byte digest of the header.
+    """
+    state = prefix_state.copy()
+    state.update(str(nonce).encode())
+    return state.digest()
+
+
+def target_of(difficulty):
+    """
+    Returns the target of a difficulty: the largest block hash, as a 256-bit number, satisfying it.
+
+    Args:
+        difficulty (int): The difficulty.
+
+    Returns:
+        The target as 32 big-endian bytes, directly comparable with raw digests.
+    """
+    return (MAX_TARGET // difficulty).to_bytes(32, "big")
+
+
+def retarget(recent_blocks):
+    """
+    Computes difficulty of the block following recent blocks.
+
+    The hash rate of the network is estimated as work of the recent blocks divided by the time in which
+    they were mined, and the difficulty is set so that at this rate a block is found every
+    TARGET_BLOCK_INTERVAL seconds. The change from the previous block is limited to MAX_RETARGET_FACTOR.
+
+    Args:
+        recent_blocks (list): Up to RETARGET_WINDOW last blocks before the new one, oldest first, without the
+            genesis block (its timestamp is not a mining time).
+
+    Returns:
+        The difficulty.
+    """
+    if not recent_blocks:
+        return INITIAL_DIFFICULTY
+    previous_difficulty = recent_blocks[-1].difficulty
+    if len(recent_blocks) < 2:
+        return previous_difficulty
+    timespan = max(recent_blocks[-1].timestamp - recent_blocks[0].timestamp, 1e-3)
+    work = sum(block.difficulty for block in recent_blocks[1:])
+    difficulty = int(work * TARGET_BLOCK_INTERVAL / timespan)
+    difficulty = min(difficulty, previous_difficulty * MAX_RETARGET_FACTOR)
+    difficulty = max(difficulty, previous_difficulty // MAX_RETARGET_FACTOR)
+    return max(difficulty, MIN_DIFFICULTY)
+
+
+def check_timestamp(block, recent_blocks, now=None):
+    """
+    Checks that a block timestamp follows the blocks before it and is not too far in the future.
+
+    The timestamp must exceed the median timestamp of the recent blocks, so a miner cannot move it back to
+    lower the difficulty (see retarget), and must not be more than MAX_FUTURE_BLOCK_TIME seconds past the
+    local clock, so it cannot be moved far forward either. Without recent blocks, i.e. for the block after
+    the genesis block or one whose ancestors are not known yet, it must exceed the genesis timestamp,
+    which every later timestamp exceeds as well.
+
+    Args:
+        block (Block): The checked block.
+        recent_blocks (list): Up to RETARGET_WINDOW last blocks before it, as passed to retarget.
+        now (float): The local time (default time.time()).
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the timestamp is not a finite number or an integer the binary encoding holds.
+        ValueError: If the timestamp is not above the median of the recent blocks or the genesis timestamp.
+        ValueError: If the timestamp is too far in the future.
+    """
+    timestamp = block.timestamp
+    if (
+        not isinstance(timestamp, (int, float))
+        or isinstance(timestamp, bool)
+        or not math.isfinite(timestamp)
+        or (isinstance(timestamp, int) and timestamp not in TIMESTAMP_INTEGER_RANGE)
+    ):
+        raise ValueError("Block timestamp invalid")
+    if recent_blocks:
+        earliest = sorted(recent.timestamp for recent in recent_blocks)[len(recent_blocks) // 2]
+    else:
+        earliest = GENESIS_TIMESTAMP
+    if timestamp <= earliest:
+        raise ValueError("Block timestamp too early")
+    if timestamp > (time.time() if now is None else now) + MAX_FUTURE_BLOCK_TIME:
+        raise ValueError("Block timestamp too far in the future")
 
 
 class Block:
     """
     A class representing a block in a blockchain.
 
+    Blocks are kept compact: fields live in __slots__ and transactions are kept as their canonical
+    compact JSON array (the form used by the wire encoding), parsed on first access. The parsed
+    transactions and their IDs are then cached, like the binary encoding of a block with a hash, which
+    is computed once by to_bytes() and reused for network messages and storage.
+
     Attributes:
         hash (str): The hash of the block.
-        transactions (list): A list of transactions included in the block.
+        transactions (tuple): The transactions included in the block; replaced as a whole, never changed in place.
         timestamp (float): The timestamp of when the block was created.
         previous_hash (str): The hash of the previous block in the chain.
         nonce (int): A random number used in the proof-of-work algorithm.
+        merkle_root (str): The root of the Merkle tree built over IDs of the transactions.
+        difficulty (int): Expected number of hashes needed to find the proof of work; the hash as a 256-bit
+            number must not exceed MAX_TARGET // difficulty.
     """
 
-    def __init__(self, transactions, timestamp, previous_hash, nonce=0, hash=None):
+    __slots__ = (
+        "hash",
+        "timestamp",
+        "previous_hash",
+        "nonce",
+        "merkle_root",
+        "difficulty",
+        "_transactions_json",
+        "_transactions",
+        "_transaction_ids",
+        "_encoded",
+    )
+
+    def __init__(
+        self,
+        transactions,
+        timestamp,
+        previous_hash,
+        nonce=0,
+        hash=None,
+        merkle_root=None,
+        difficulty=INITIAL_DIFFICULTY,
+    ):
         self.hash = hash
         self.transactions = transactions
         self.timestamp = timestamp
         self.previous_hash = previous_hash
         self.nonce = nonce
+        self.difficulty = difficulty
+        if merkle_root is None:
+            self._transaction_ids = tuple(
+                compute_transaction_id(transaction) for transaction in transactions
+            )
+            merkle_root = MerkleTree(self._transaction_ids).root
+        self.merkle_root = merkle_root
+
+    @property
+    def transactions(self):
+        if self._transactions is None:
+            self._transactions = tuple(json.loads(self._transactions_json))
+        return self._transactions
+
+    @transactions.setter
+    def transactions(self, transactions):
+        self._transactions_json = (
+            encode_transactions(list(transactions)) if transactions else EMPTY_TRANSACTIONS
+        )
+        self._transactions = None
+        self._transaction_ids = None
+        self._encoded = None
+
+    def transaction_ids(self):
+        """Returns IDs of the block transactions in block order, computed once."""
+        if self._transaction_ids is None:
+            self._transaction_ids = tuple(
+                compute_transaction_id(transaction) for transaction in self.transactions
+            )
+        return self._transaction_ids
+
+    def build_merkle_tree(self):
+        """
+        Builds the Merkle tree over IDs of the block transactions.
+
+        Returns:
+            A MerkleTree instance.
+        """
+        return MerkleTree(self.transaction_ids())
+
+    def header_prefix(self):
+        """
+        Serializes the constant part of the block header (everything except the nonce).
+
+        The header commits to the transactions only through their Merkle root, so its size does not depend
+        on the number of transactions in the block.
+
+        Returns:
+            The header prefix as bytes.
+        """
+        header = [self.previous_hash, self.merkle_root, self.timestamp, self.difficulty]
+        return json.dumps(header).encode() + b":"
 
     def compute_hash(self):
         """
-        Computes the hash of the block using the SHA-256 hashing algorithm.
+        Computes the hash of the block header using the SHA-256 hashing algorithm.
 
         Returns:
             The hash of the block.
         """
-        block_string = json.dumps(self.__dict__, sort_keys=True)
-        return sha256(block_string.encode()).hexdigest()
+        return hash_header(sha256(self.header_prefix()), self.nonce).hex()
 
-    def calculate_proof_of_work(self):
+    def calculate_proof_of_work(self, workers=1, is_cancelled=None):
         """
         Calculates the proof of work for the block by repeatedly computing the hash of the block and
-        incrementing the nonce until a hash with a certain number of leading zeros (as determined by
-        the global constant PROOF_OF_WORK_DIFFICULTY) is found.
+        incrementing the nonce until a hash not exceeding the target of the block difficulty is found.
+
+        The header prefix is hashed once and its SHA-256 state is reused for every nonce, so the cost
+        of one attempt does not depend on the size of the block.
+
+        With more than one worker the nonce space is searched by a pool of processes, which finds
+        the same nonce as the serial search.
+
+        Args:
+            workers (int): Number of processes used for the search (default 1, search in current process).
+            is_cancelled (Callable): Optional function polled during the search; when it returns True the
+                search stops and the block hash stays None.
 
         Returns:
-            None
+            Number of hashes computed.
         """
+        start_nonce = self.nonce
+        if workers > 1:
+            from mining import find_nonce_parallel
+
+            nonce = find_nonce_parallel(self, workers, is_cancelled=is_cancelled)
+            if nonce is None:
+                return self.nonce - start_nonce
+            self.nonce = nonce
+            self.hash = self.compute_hash()
+            return self.nonce - start_nonce + 1
+
+        prefix_state = sha256(self.header_prefix())
+        target = target_of(self.difficulty)
         while True:
-            computed_hash = self.compute_hash()
-            if computed_hash.startswith("0" * PROOF_OF_WORK_DIFFICULTY):
-                self.hash = computed_hash
-                break
+            if (
+                is_cancelled is not None
+                and self.nonce % CANCEL_CHECK_INTERVAL == 0
+                and is_cancelled()
+            ):
+                return self.nonce - start_nonce
+            digest = hash_header(prefix_state, self.nonce)
+            if digest <= target:
+                self.hash = digest.hex()
+                return self.nonce - start_nonce + 1
             self.nonce += 1
 
     def is_proof_valid(self, proof):
         """
-        Checks if a given proof is valid by checking if hash starts with a number of zeros equal to the difficulty,
-        and if hash computed by current node is equal to hash announced by other node in network.
+        Checks if a given proof is valid by checking if hash does not exceed the target of the block difficulty,
+        if Merkle root rebuilt from the transactions matches the one in the header, and if hash computed by current
+        node is equal to hash announced by other node in network.
 
         Args:
             proof (str): The proof(hash) to be checked.
@@ -62,10 +370,208 @@ class Block:
             True if the proof is valid, False otherwise.
         """
         return (
-            proof.startswith("0" * PROOF_OF_WORK_DIFFICULTY)
+            self.is_header_valid(proof)
+            and self.merkle_root == self.build_merkle_tree().root
+        )
+
+    def is_header_valid(self, proof):
+        """
+        Checks if a given proof is valid for the block header alone, without checking the transactions
+        against the Merkle root. Used to validate headers before their block bodies are downloaded.
+
+        Args:
+            proof (str): The proof(hash) to be checked.
+
+        Returns:
+            True if the proof is valid, False otherwise.
+        """
+        if not self.has_encodable_fields():
+            return False
+        try:
+            digest = bytes.fromhex(proof)
+        except (TypeError, ValueError):
+            return False
+        return (
+            len(digest) == 32
+            and digest <= target_of(self.difficulty)
             and proof == self.compute_hash()
         )
 
+    def has_encodable_fields(self):
+        """
+        Checks that the nonce and difficulty are integers in the range of the binary block encoding.
+
+        Hashing formats the nonce as text, so a nonce like "5" or True would give the hash of 5 and then
+        fail to encode; a bool difficulty would equal the integer one but hash differently.
+        """
+        return (
+            is_valid_nonce(self.nonce)
+            and type(self.difficulty) is int
+            and MIN_DIFFICULTY <= self.difficulty <= MAX_HEADER_INTEGER
+        )
+
+    def work(self):
+        """
+        Returns the expected number of hashes needed to find the proof of work of the block.
+
+        Chains are compared by the sum of work of their blocks.
+        """
+        return self.difficulty
+
+    def header_dict(self):
+        """
+        Converts the block header to a dictionary.
+
+        Returns:
+            A dictionary with all block data except transactions.
+        """
+        return {field: getattr(self, field) for field in HEADER_FIELDS}
+
+    @classmethod
+    def genesis(cls):
+        """Creates the genesis block, which is the same on every node."""
+        genesis_block = cls([], GENESIS_TIMESTAMP, GENESIS_PREVIOUS_HASH)
+        genesis_block.hash = genesis_block.compute_hash()
+        return genesis_block
+
+    @classmethod
+    def from_header_dict(cls, header_dict):
+        """
+        Create a new block instance without transactions from a header dictionary.
+
+        Args:
+            header_dict (dict): A dictionary containing block header data.
+
+        Returns:
+            A new instance of the Block class.
+        """
+        return cls(
+            hash=header_dict["hash"],
+            transactions=[],
+            timestamp=header_dict["timestamp"],
+            previous_hash=header_dict["previous_hash"],
+            nonce=header_dict["nonce"],
+            merkle_root=header_dict["merkle_root"],
+            difficulty=header_dict["difficulty"],
+        )
+
+    def to_dict(self):
+        """
+        Converts the block to a dictionary.
+
+        Returns:
+            A dictionary containing block data.
+        """
+        return {
+            "hash": self.hash,
+            "transactions": list(self.transactions),
+            "timestamp": self.timestamp,
+            "previous_hash": self.previous_hash,
+            "nonce": self.nonce,
+            "merkle_root": self.merkle_root,
+            "difficulty": self.difficulty,
+        }
+
+    def to_bytes(self):
+        """
+        Encodes the block in the binary wire form (see wire.encode_block).
+
+        The encoding of a block with a hash is cached, its fields must not change afterwards.
+
+        Returns:
+            The encoded block as bytes.
+        """
+        if self._encoded is not None:
+            return self._encoded
+        encoded = pack_block(
+            self.hash,
+            self.previous_hash,
+            self.merkle_root,
+            self.timestamp,
+            self.nonce,
+            self.difficulty,
+            self._transactions_json,
+        )
+        if self.hash is not None:
+            self._encoded = encoded
+        return encoded
+
+    @classmethod
+    def from_bytes(cls, payload):
+        """
+        Create a new block instance from its binary form, without parsing the transactions.
+
+        Args:
+            payload (bytes): The block encoded with to_bytes or wire.encode_block.
+
+        Returns:
+            A new instance of the Block class.
+
+        Raises:
+            ValueError: If the payload is malformed.
+        """
+        payload = bytes(payload)
+        (
+            hash,
+            previous_hash,
+            merkle_root,
+            timestamp,
+            nonce,
+            difficulty,
+            transactions_json,
+        ) = unpack_block(payload)
+        if not transactions_json.startswith(b"["):
+            raise ValueError("Invalid transactions field")
+        block = cls.__new__(cls)
+        block.hash = hash
+        block.timestamp = timestamp
+        block.previous_hash = previous_hash
+        block.nonce = nonce
+        block.difficulty = difficulty
+        block._transactions_json = (
+            EMPTY_TRANSACTIONS if transactions_json == EMPTY_TRANSACTIONS else transactions_json
+        )
+        block._transactions = None
+        block._transaction_ids = None
+        block._encoded = payload if hash is not None else None
+        block.merkle_root = (
+            block.build_merkle_tree().root if merkle_root is None else merkle_root
+        )
+        return block
+
+    @classmethod
+    def from_transactions_json(
+        cls, transactions_json, timestamp, previous_hash, merkle_root, difficulty
+    ):
+        """
+        Create a new block without a proof of work from transactions already serialized with
+        wire.encode_transactions and the Merkle root over their IDs, without parsing or hashing them.
+
+        Args:
+            transactions_json (bytes): The canonical compact JSON array of the transactions.
+            timestamp (float): The timestamp of the block.
+            previous_hash (str): The hash of the previous block.
+            merkle_root (str): The root of the Merkle tree built over IDs of the transactions.
+            difficulty (int): The difficulty of the block.
+
+        Returns:
+            A new instance of the Block class.
+        """
+        block = cls.__new__(cls)
+        block.hash = None
+        block.timestamp = timestamp
+        block.previous_hash = previous_hash
+        block.nonce = 0
+        block.difficulty = difficulty
+        block.merkle_root = merkle_root
+        block._transactions_json = (
+            EMPTY_TRANSACTIONS if transactions_json == EMPTY_TRANSACTIONS else transactions_json
+        )
+        block._transactions = None
+        block._transaction_ids = None
+        block._encoded = None
+        return block
+
     @classmethod
     def from_dict(cls, block_dict, include_hash=True):
         """
@@ -85,27 +591,388 @@ class Block:
             timestamp=block_dict["timestamp"],
             previous_hash=block_dict["previous_hash"],
             nonce=block_dict["nonce"],
+            merkle_root=block_dict.get("merkle_root"),
+            difficulty=block_dict.get("difficulty", INITIAL_DIFFICULTY),
         )
 
 
+class Mempool:
+    """
+    A class representing a pool of unconfirmed transactions indexed by transaction ID.
+
+    Duplicates are rejected in O(1). Transactions are prioritized by their "fee" field (0 when missing),
+    then by arrival. When total size of transactions exceeds max_bytes, the lowest priority ones are evicted.
+
+    Attributes:
+        max_bytes (int): Maximum total size of transactions (as canonical JSON) kept in the pool.
+        size_bytes (int): Current total size of transactions in the pool.
+    """
+
+    def __init__(self, max_bytes=MEMPOOL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = {}
+        self._eviction_heap = []
+        self._sequence = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, tx_id):
+        return tx_id in self._entries
+
+    def __iter__(self):
+        """Iterates over a snapshot of transactions in order of arrival."""
+        with self._lock:
+            return iter([entry[0] for entry in self._entries.values()])
+
+    @staticmethod
+    def _fee(transaction):
+        fee = transaction.get("fee", 0)
+        return fee if isinstance(fee, (int, float)) else 0
+
+    def add(self, transaction):
+        """
+        Adds a transaction to the pool, evicting lowest priority transactions if the pool is full.
+
+        Args:
+            transaction (dict): A dictionary containing transaction data.
+
+        Returns:
+            The transaction ID.
+
+        Raises:
+            ValueError: If the transaction is already in the pool.
+            ValueError: If the pool is full of transactions with higher priority.
+        """
+        prepared = self._prepare(transaction)
+        with self._lock:
+            return self._add(transaction, *prepared)
+
+    def add_many(self, transactions, prepared=None):
+        """
+        Adds transactions to the pool under a single lock acquisition.
+
+        Args:
+            transactions (list): A list of dictionaries containing transaction data.
+            prepared (list): Optional (transaction ID, size) tuples of the transactions, as returned by
+                prepare_transaction, so they are not serialized again.
+
+        Returns:
+            A list with, for each transaction, a tuple (transaction ID, None) if it was added
+            or (transaction ID or None, error message) if it was rejected.
+        """
+        if prepared is None:
+            prepared = [self._prepare(transaction) for transaction in transactions]
+        results = []
+        with self._lock:
+            for transaction, (tx_id, size) in zip(transactions, prepared):
+                try:
+                    results.append((self._add(transaction, tx_id, size), None))
+                except ValueError as e:
+                    results.append((tx_id, str(e)))
+        return results
+
+    @staticmethod
+    def _prepare(transaction):
+        """Computes transaction ID (as compute_transaction_id does) and size outside of the lock."""
+        canonical = json.dumps(transaction, sort_keys=True).encode()
+        return sha256(canonical).hexdigest(), len(canonical)
+
+    def _add(self, transaction, tx_id, size):
+        if tx_id in self._entries:
+            raise ValueError("Duplicate transaction")
+        fee = self._fee(transaction)
+        sequence = self._sequence + 1
+        # Lower priority transactions are only evicted once the new one is known to fit; the newest of
+        # equally paying transactions is evicted first.
+        evicted = []
+        freed = 0
+        while self.size_bytes + size - freed > self.max_bytes:
+            lowest = self._pop_lowest()
+            if lowest is None or lowest[:2] > (fee, -sequence):
+                for item in evicted:
+                    heapq.heappush(self._eviction_heap, item)
+                raise ValueError("Mempool full")
+            evicted.append(lowest)
+            freed += self._entries[lowest[2]][3]
+        for _, _, evicted_id in evicted:
+            self._discard(evicted_id)
+        self._sequence = sequence
+        self._entries[tx_id] = (transaction, fee, sequence, size)
+        self.size_bytes += size
+        heapq.heappush(self._eviction_heap, (fee, -sequence, tx_id))
+        if len(self._eviction_heap) > 2 * len(self._entries) + 64:
+            self._eviction_heap = [
+                (fee, -sequence, entry_id)
+                for entry_id, (_, fee, sequence, _) in self._entries.items()
+            ]
+            heapq.heapify(self._eviction_heap)
+        return tx_id
+
+    def _pop_lowest(self):
+        """Pops the eviction heap item of the lowest priority transaction in the pool, or returns None."""
+        while self._eviction_heap:
+            item = heapq.heappop(self._eviction_heap)
+            entry = self._entries.get(item[2])
+            if entry is not None and entry[2] == -item[1]:
+                return item
+        return None
+
+    def _discard(self, tx_id):
+        entry = self._entries.pop(tx_id, None)
+        if entry is not None:
+            self.size_bytes -= entry[3]
+        return entry
+
+    def get(self, tx_id):
+        """Returns the unconfirmed transaction with given ID, or None if it is not in the pool."""
+        with self._lock:
+            entry = self._entries.get(tx_id)
+        return None if entry is None else entry[0]
+
+    def select(self, max_count):
+        """
+        Selects highest priority transactions for a new block.
+
+        Args:
+            max_count (int): Maximum number of selected transactions.
+
+        Returns:
+            A list of (transaction ID, transaction) tuples, highest priority first.
+        """
+        with self._lock:
+            best = heapq.nsmallest(
+                max_count,
+                self._entries.items(),
+                key=lambda item: (-item[1][1], item[1][2]),
+            )
+        return [(tx_id, entry[0]) for tx_id, entry in best]
+
+    def remove(self, tx_ids):
+        """
+        Removes transactions from the pool, for example ones included in a block.
+
+        Args:
+            tx_ids (Iterable): IDs of transactions to remove; IDs not in the pool are ignored.
+        """
+        with self._lock:
+            for tx_id in tx_ids:
+                self._discard(tx_id)
+
+
+class StaleSnapshotError(Exception):
+    """Raised when blocks of a ChainSnapshot were overwritten by a reorganization of a persistent chain."""
+
+
+class ChainSnapshot:
+    """
+    An immutable view of the first blocks of an append-only chain.
+
+    Taking a snapshot costs O(1): it only records the chain container and its length at that moment.
+    Blocks appended later are not visible through the snapshot, so readers can iterate it without locks
+    while writers keep appending. A reorganization replaces an in-memory chain list instead of changing
+    it, so snapshots taken before it keep showing the old chain. A persistent chain (storage.StoredChain)
+    is truncated in place instead; the snapshot then raises StaleSnapshotError for blocks that were
+    replaced, rather than returning blocks of the new branch.
+
+    Attributes:
+        length (int): Number of blocks in the snapshot.
+    """
+
+    def __init__(self, blocks, length, heights=None):
+        self._blocks = blocks
+        self.length = length
+        self._heights = heights
+        self._generation = getattr(blocks, "generation", None)
+
+    def _is_replaced(self, height):
+        if self._generation is None:
+            return False
+        truncated = self._blocks.truncated_since(self._generation)
+        return truncated is not None and height >= truncated
+
+    def _get(self, index):
+        if self._is_replaced(index):
+            raise StaleSnapshotError(f"Block at height {index} was replaced by a reorganization")
+        try:
+            return self._blocks[index]
+        finally:
+            # The block may have been read while a truncation was in progress.
+            if self._is_replaced(index):
+                raise StaleSnapshotError(
+                    f"Block at height {index} was replaced by a reorganization"
+                )
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Block index out of range")
+        return self._get(index)
+
+    def __iter__(self):
+        for index in range(self.length):
+            yield self._get(index)
+
+    @property
+    def last_block(self):
+        return self[-1]
+
+    def index_of(self, block_hash):
+        """
+        Finds height of a block in the snapshot by its hash.
+
+        Args:
+            block_hash (str): The hash of the block.
+
+        Returns:
+            Height of the block, or None if it is not in the snapshot.
+        """
+        if self._heights is not None:
+            # Heights are shared by all snapshots and may point to blocks of another branch.
+            height = self._heights.get(block_hash)
+            if (
+                height is not None
+                and height < self.length
+                and self._blocks[height].hash == block_hash
+            ):
+                return height
+            return None
+        index_of = getattr(self._blocks, "index_of", None)
+        if index_of is not None:
+            height = index_of(block_hash)
+            if height is None or height >= self.length or self._is_replaced(height):
+                return None
+            return height
+        for height in range(self.length - 1, -1, -1):
+            if self._blocks[height].hash == block_hash:
+                return height
+        return None
+
+
 class Blockchain:
     """
     A class representing a blockchain.
 
+    The chain is only changed under a writer lock. Readers use snapshot(), which returns the latest
+    published ChainSnapshot without taking any lock.
+
+    Besides the chain the blockchain keeps a block tree: blocks of competing side branches and orphan
+    blocks whose parent is not known yet, both indexed by hash. The chain is always the known branch
+    with the most cumulative work.
+
     Attributes:
-        unconfirmed_transactions (list): A list of unconfirmed transactions.
-        chain (list): A list of blocks in the blockchain.
+        mempool (Mempool): Pool of unconfirmed transactions.
+        chain (list): A list of blocks in the blockchain, or a list-like storage.StoredChain for persistent nodes.
+        mining_workers (int): Number of processes used for proof of work calculation.
     """
 
-    def __init__(self, chain=None, unconfirmed_transactions=None):
-        self.unconfirmed_transactions = (
-            [] if unconfirmed_transactions is None else unconfirmed_transactions
+    def __init__(
+        self,
+        chain=None,
+        unconfirmed_transactions=None,
+        mining_workers=MINING_WORKERS,
+        signature_verifier=None,
+    ):
+        self.mining_workers = mining_workers
+        self.signature_verifier = (
+            SignatureVerifier() if signature_verifier is None else signature_verifier
         )
-        self.chain = chain
-        if self.chain is None:
-            self.chain = []
+        self.mempool = Mempool()
+        for transaction in unconfirmed_transactions or []:
+            self.mempool.add(transaction)
+        self._lock = threading.RLock()
+        self._tip_listeners = []
+        self._template = None
+        self._mining_stats = {
+            "jobs_started": 0,
+            "jobs_stale": 0,
+            "jobs_stopped": 0,
+            "blocks_mined": 0,
+            "hashes": 0,
+            "wasted_hashes": 0,
+        }
+        self._state = None
+        self._side_blocks = OrderedDict()
+        self._orphans = OrderedDict()
+        self._orphans_by_parent = {}
+        self.chain = [] if chain is None else chain
+        # Persistent chains index hashes themselves, in-memory ones get a hash -> height dictionary.
+        self._heights = (
+            None
+            if hasattr(self.chain, "index_of")
+            else {block.hash: height for height, block in enumerate(self.chain)}
+        )
+        self._snapshot = ChainSnapshot(self.chain, len(self.chain), self._heights)
+        if not self.chain:
             self.create_genesis_block()
 
+    def snapshot(self):
+        """Returns an immutable snapshot of the current chain."""
+        return self._snapshot
+
+    def _append(self, block, publish=True):
+        """Appends a block and publishes a new snapshot. Must be called with the writer lock held."""
+        self.chain.append(block)
+        if self._heights is not None:
+            self._heights[block.hash] = len(self.chain) - 1
+        if self._state is not None:
+            self._state.connect_block(block, len(self.chain) - 1)
+        if publish:
+            self._publish()
+
+    def _publish(self):
+        """Publishes a snapshot of the current chain and notifies tip listeners about its last block."""
+        self._snapshot = ChainSnapshot(self.chain, len(self.chain), self._heights)
+        tip = self._snapshot.last_block
+        for listener in list(self._tip_listeners):
+            listener(tip)
+
+    def add_tip_listener(self, listener):
+        """Registers a function called with every block which becomes the new last block."""
+        with self._lock:
+            self._tip_listeners.append(listener)
+
+    def remove_tip_listener(self, listener):
+        """Unregisters a function registered with add_tip_listener."""
+        with self._lock:
+            self._tip_listeners.remove(listener)
+
+    def mining_stats(self):
+        """
+        Returns statistics of mining jobs.
+
+        Returns:
+            A dictionary with counts of started, stale (cancelled by a new block), stopped and successful jobs,
+            computed and wasted hashes, and rates of stale jobs and wasted work.
+        """
+        with self._lock:
+            stats = dict(self._mining_stats)
+        stats["stale_rate"] = (
+            stats["jobs_stale"] / stats["jobs_started"] if stats["jobs_started"] else 0.0
+        )
+        stats["wasted_work_rate"] = (
+            stats["wasted_hashes"] / stats["hashes"] if stats["hashes"] else 0.0
+        )
+        return stats
+
+    def _count_mining_job(self, outcome, hashes):
+        metrics.MINING_HASHES.inc(hashes)
+        metrics.MINING_JOB_NONCES.observe(hashes, outcome=outcome)
+        with self._lock:
+            self._mining_stats["jobs_started"] += 1
+            self._mining_stats[outcome] += 1
+            self._mining_stats["hashes"] += hashes
+            if outcome != "blocks_mined":
+                self._mining_stats["wasted_hashes"] += hashes
+
     def to_dict(self):
         """
         Converts the blockchain to a dictionary.
@@ -114,96 +981,718 @@ class Blockchain:
             A dictionary representation of the blockchain.
         """
         blocks = []
-        for block in self.chain:
-            blocks.append(block.__dict__)
+        for block in self.snapshot():
+            blocks.append(block.to_dict())
         return {
             "unconfirmed_transactions": self.unconfirmed_transactions,
             "chain": blocks,
         }
 
     @classmethod
-    def from_dict(cls, blockchain_dict):
+    def from_dict(cls, blockchain_dict, chain=None, validator=None):
         """
         Creates a new Blockchain instance from a dictionary.
 
+        The chain is validated first, so a chain received from an untrusted peer can be loaded safely.
+        Unconfirmed transactions go through the same checks as transactions added with add_new_transactions,
+        invalid ones are dropped.
+
         Args:
             blockchain_dict (dict): A dictionary containing the properties of the blockchain.
+            chain (list): An empty list-like container to which blocks are added (default a new list).
+            validator (validator.ChainValidator): Validator of the chain (default one with no checkpoints).
 
         Returns:
             A new Blockchain instance.
+
+        Raises:
+            ValueError: If the chain is invalid.
         """
-        blocks = []
-        for block in blockchain_dict["chain"]:
-            blocks.append(Block.from_dict(block))
-        return cls(
-            chain=blocks,
-            unconfirmed_transactions=blockchain_dict["unconfirmed_transactions"],
-        )
+        from validator import ChainValidator
+
+        blocks = [Block.from_dict(block) for block in blockchain_dict["chain"]]
+        if validator is None:
+            with ChainValidator() as default_validator:
+                default_validator.validate(blocks)
+        else:
+            validator.validate(blocks)
+        if chain is not None:
+            for block in blocks:
+                chain.append(block)
+            blocks = chain
+        blockchain = cls(chain=blocks)
+        blockchain.add_new_transactions(blockchain_dict["unconfirmed_transactions"])
+        return blockchain
 
     def create_genesis_block(self):
         """Creates genesis (first) block."""
-        genesis_block = Block([], 0, "0")
-        genesis_block.hash = genesis_block.compute_hash()
-        self.chain.append(genesis_block)
+        with self._lock:
+            self._append(Block.genesis())
 
     @property
     def last_block(self):
-        return self.chain[-1]
+        return self._snapshot.last_block
+
+    @property
+    def unconfirmed_transactions(self):
+        """A list of unconfirmed transactions in order of arrival."""
+        return list(self.mempool)
+
+    def get_height(self, block_hash):
+        """
+        Finds height of a block in the chain by its hash.
+
+        Args:
+            block_hash (str): The hash of the block.
+
+        Returns:
+            Height of the block, or None if it is not in the chain.
+        """
+        return self.snapshot().index_of(block_hash)
+
+    def state(self):
+        """
+        Returns the StateIndex of the chain.
+
+        The index is built from the chain on first use and then kept up to date with every block appended
+        to the chain or removed from it, so nodes which never query it do not pay for it.
+        """
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    state = StateIndex()
+                    for height, block in enumerate(self.snapshot()):
+                        state.connect_block(block, height)
+                    self._state = state
+        return self._state
+
+    def find_transaction(self, tx_id):
+        """
+        Finds a transaction in the chain by its ID, without scanning the chain.
+
+        Args:
+            tx_id (str): The transaction ID.
+
+        Returns:
+            A tuple (block, height, position in block, transaction), or None if the transaction is not in the chain.
+        """
+        location = self.state().location(tx_id)
+        if location is None:
+            return None
+        height, position = location
+        chain = self.snapshot()
+        if height >= len(chain):
+            return None
+        block = chain[height]
+        transactions = block.transactions
+        # The chain may have been reorganized after the lookup.
+        if (
+            position >= len(transactions)
+            or compute_transaction_id(transactions[position]) != tx_id
+        ):
+            return None
+        return block, height, position, transactions[position]
+
+    def get_balance(self, address):
+        """
+        Returns balance of an address in the chain.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            A tuple (balance, height of the last block it includes).
+        """
+        return self.state().balance(address)
+
+    def get_block(self, block_hash):
+        """
+        Finds a block in the chain by its hash.
+
+        Args:
+            block_hash (str): The hash of the block.
+
+        Returns:
+            The Block with given hash, or None if it is not in the chain.
+        """
+        chain = self.snapshot()
+        height = chain.index_of(block_hash)
+        return None if height is None else chain[height]
+
+    def find_block(self, block_hash):
+        """
+        Finds a block in the chain or on a side branch by its hash.
+
+        Args:
+            block_hash (str): The hash of the block.
+
+        Returns:
+            The Block with given hash, or None if it is neither in the chain nor on a side branch.
+        """
+        block = self._side_blocks.get(block_hash)
+        return self.get_block(block_hash) if block is None else block
+
+    def block_locator(self):
+        """
+        Builds a block locator describing the chain to a peer.
+
+        The locator lists hashes of the last ten blocks and then of blocks at exponentially growing distance
+        from the tip, ending with the genesis block, so it has O(log n) entries.
+
+        Returns:
+            A list of block hashes, from the tip backwards.
+        """
+        chain = self.snapshot()
+        locator = []
+        height = len(chain) - 1
+        step = 1
+        while height > 0:
+            locator.append(chain[height].hash)
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        locator.append(chain[0].hash)
+        return locator
+
+    def find_fork_height(self, locator, chain=None):
+        """
+        Finds the highest block of the chain which is also in a peer block locator.
+
+        Args:
+            locator (list): A block locator as returned by block_locator.
+            chain (ChainSnapshot): A snapshot to search in (default the current one).
+
+        Returns:
+            Height of the common block, 0 (genesis) if no block from the locator is known.
+        """
+        if chain is None:
+            chain = self.snapshot()
+        for block_hash in locator:
+            height = chain.index_of(block_hash)
+            if height is not None:
+                return height
+        return 0
+
+    def blocks_after(self, locator, limit):
+        """
+        Returns blocks following the common block with a peer.
+
+        Args:
+            locator (list): A block locator of the peer.
+            limit (int): Maximum number of returned blocks.
+
+        Returns:
+            A list of Blocks in chain order.
+        """
+        chain = self.snapshot()
+        start = self.find_fork_height(locator, chain) + 1
+        return chain[start : start + limit]
+
+    def headers_after(self, locator, limit):
+        """
+        Returns headers of blocks following the common block with a peer.
+
+        Args:
+            locator (list): A block locator of the peer.
+            limit (int): Maximum number of returned headers.
+
+        Returns:
+            A list of block header dictionaries in chain order.
+        """
+        return [block.header_dict() for block in self.blocks_after(locator, limit)]
+
+    def check_headers(self, headers):
+        """
+        Checks if headers form a valid branch growing from a block of the chain.
+
+        The branch does not have to extend the last block: a peer on a competing branch sends headers
+        following the last common block, which may itself be on a side branch.
+
+        Args:
+            headers (list): A list of block header dictionaries in chain order.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the first header does not link to a known block or headers do not link to each other.
+            ValueError: If the proof of work of any header is invalid.
+        """
+        if headers and not self.is_known_block(headers[0]["previous_hash"]):
+            raise ValueError("Previous hash incorrect")
+        previous_hash = headers[0]["previous_hash"] if headers else None
+        for header in headers:
+            if header["previous_hash"] != previous_hash:
+                raise ValueError("Previous hash incorrect")
+            block = Block.from_header_dict(header)
+            if not block.is_header_valid(header["hash"]):
+                raise ValueError("Block proof invalid")
+            previous_hash = header["hash"]
 
     def add_new_transaction(self, transaction):
         """
-        Add a new transaction to the list of unconfirmed transactions.
+        Add a new transaction to the pool of unconfirmed transactions.
 
         Args:
             transaction (dict): A dictionary containing transaction data
 
         Returns:
-            None
+            The transaction ID.
+
+        Raises:
+            ValueError: If the transaction is malformed.
+            ValueError: If the transaction is already in the chain.
+            ValueError: If the transaction signature is missing or invalid.
+            ValueError: If the transaction is already in the pool or the pool is full.
         """
-        self.unconfirmed_transactions.append(transaction)
+        tx_id, _ = prepare_transaction(transaction)
+        if self.state().location(tx_id) is not None:
+            raise ValueError("Transaction already in the chain")
+        error = self.signature_verifier.verify([transaction], [tx_id])[0]
+        if error is not None:
+            raise ValueError(error)
+        self.mempool.add(transaction)
+        if self._drop_confirmed([tx_id]):
+            raise ValueError("Transaction already in the chain")
+        if self._template is not None:
+            self._template.add_transactions([(tx_id, transaction)])
+        return tx_id
 
-    def mine_block(self):
+    def add_new_transactions(self, transactions):
         """
-        Mines a new block adds it to the blockchain.
+        Validates a batch of transactions and adds valid ones to the pool of unconfirmed transactions.
+
+        Signatures of the whole batch are verified together on the worker pool of the signature verifier.
+
+        Args:
+            transactions (list): A list of transactions (parsed JSON values).
 
         Returns:
-            The newly mined block.
+            A list with a dictionary for each transaction: its "tx_id" and "status" ("accepted" or "rejected"),
+            with "error" describing why a rejected transaction was not added.
         """
-        last_block = self.last_block
-        new_block = Block(
-            transactions=self.unconfirmed_transactions,
-            timestamp=time.time(),
-            previous_hash=last_block.hash,
+        results = [None] * len(transactions)
+        # (index, transaction ID, size) of transactions which passed the checks so far; each transaction
+        # is serialized once, for its ID and size.
+        valid = []
+        state = self.state()
+        for index, transaction in enumerate(transactions):
+            try:
+                tx_id, size = prepare_transaction(transaction)
+            except ValueError as e:
+                results[index] = {"tx_id": None, "status": "rejected", "error": str(e)}
+                continue
+            if state.location(tx_id) is not None:
+                results[index] = {
+                    "tx_id": tx_id,
+                    "status": "rejected",
+                    "error": "Transaction already in the chain",
+                }
+            else:
+                valid.append((index, tx_id, size))
+        errors = self.signature_verifier.verify(
+            [transactions[index] for index, _, _ in valid],
+            [tx_id for _, tx_id, _ in valid],
+        )
+        verified = []
+        for (index, tx_id, size), error in zip(valid, errors):
+            if error is None:
+                verified.append((index, tx_id, size))
+            else:
+                results[index] = {"tx_id": tx_id, "status": "rejected", "error": error}
+        added = self.mempool.add_many(
+            [transactions[index] for index, _, _ in verified],
+            [(tx_id, size) for _, tx_id, size in verified],
         )
-        new_block.calculate_proof_of_work()
+        confirmed = self._drop_confirmed([tx_id for tx_id, error in added if error is None])
+        accepted = []
+        for (index, _, _), (tx_id, error) in zip(verified, added):
+            if error is None and tx_id in confirmed:
+                error = "Transaction already in the chain"
+            if error is None:
+                results[index] = {"tx_id": tx_id, "status": "accepted"}
+                accepted.append((tx_id, transactions[index]))
+            else:
+                results[index] = {"tx_id": tx_id, "status": "rejected", "error": error}
+        if self._template is not None:
+            self._template.add_transactions(accepted)
+        return results
 
-        self.chain.append(new_block)
-        self.unconfirmed_transactions = []
+    def _drop_confirmed(self, tx_ids):
+        """
+        Removes transactions which a block confirmed while they were being added from the pool.
+
+        Blocks connect their transactions to the state before removing them from the pool, so a transaction
+        checked against the state before a block connected and added to the pool after the block removed
+        its transactions is found here.
 
-        return new_block
+        Args:
+            tx_ids (list): IDs of transactions just added to the pool.
+
+        Returns:
+            A set of IDs of removed transactions.
+        """
+        state = self.state()
+        confirmed = {tx_id for tx_id in tx_ids if state.location(tx_id) is not None}
+        self.mempool.remove(confirmed)
+        return confirmed
+
+    def block_template(self):
+        """
+        Returns the template of the next block (see template.BlockTemplate), creating it on first use.
+
+        Once created, the template is updated with every transaction added with add_new_transaction
+        or add_new_transactions.
+        """
+        from template import BlockTemplate
+
+        with self._lock:
+            if self._template is None:
+                self._template = BlockTemplate(self, MAX_BLOCK_TRANSACTIONS)
+            return self._template
+
+    def mine_block(self, is_cancelled=None):
+        """
+        Mines a new block adds it to the blockchain.
+
+        The block contains up to MAX_BLOCK_TRANSACTIONS highest priority unconfirmed transactions,
+        which are then removed from the pool. It is taken from the block template, so transactions
+        are not serialized and hashed again for every job.
+
+        Proof of work is calculated without holding any lock, so transactions keep being added and
+        blocks from peers keep being accepted meanwhile. A mining job is cancelled as soon as another
+        block becomes the last block; the job is then restarted on top of it, without transactions
+        which that block already contains.
+
+        Args:
+            is_cancelled (Callable): Optional function polled during mining; when it returns True mining stops.
+
+        Returns:
+            The newly mined block, or None if mining was stopped with is_cancelled.
+        """
+        while True:
+            tip_changed = threading.Event()
+
+            def on_new_tip(block):
+                tip_changed.set()
+
+            self.add_tip_listener(on_new_tip)
+            try:
+                new_block, tx_ids = self.block_template().candidate()
+                started = time.perf_counter()
+                hashes = new_block.calculate_proof_of_work(
+                    workers=self.mining_workers,
+                    is_cancelled=lambda: tip_changed.is_set()
+                    or (is_cancelled is not None and is_cancelled()),
+                )
+                metrics.MINING_SECONDS.inc(time.perf_counter() - started)
+            finally:
+                self.remove_tip_listener(on_new_tip)
+
+            replayed = False
+            with self._lock:
+                if (
+                    new_block.hash is not None
+                    and self.last_block.hash == new_block.previous_hash
+                ):
+                    try:
+                        self._check_new_transactions([new_block], len(self.chain) - 1)
+                    except ValueError as e:
+                        # A transaction confirmed while it was being added to the pool reached the template.
+                        print(f"Dropping mined block: {e}")
+                        replayed = True
+                    else:
+                        self._append(new_block)
+                        self.mempool.remove(tx_ids)
+                        self._count_mining_job("blocks_mined", hashes)
+                        return new_block
+                if replayed or tip_changed.is_set():
+                    self._count_mining_job("jobs_stale", hashes)
+                else:
+                    self._count_mining_job("jobs_stopped", hashes)
+                    return None
+            if replayed:
+                self._drop_confirmed(tx_ids)
+                self.block_template().invalidate()
+
+    def is_known_block(self, block_hash):
+        """Checks if a block is in the chain, on a side branch or in the orphan pool."""
+        with self._lock:
+            return (
+                block_hash in self._side_blocks
+                or block_hash in self._orphans
+                or self.get_height(block_hash) is not None
+            )
 
     def verify_and_add_block(self, block_data):
         """
-        Verifies the validity of a given block by comparing hash from last block in chain
-        with previous hash in new block and checking correctness of proof.
-        Adds verified block to the chain at the end.
+        Verifies the validity of a given block by checking correctness of proof and adds it to the block tree.
+
+        A block extending the last block is appended to the chain and its transactions are removed from
+        the pool of unconfirmed transactions. A block extending another known block is kept on a side
+        branch; when that branch gets more cumulative work than the chain, the node reorganizes to it.
+        A block with unknown parent is kept in the orphan pool until the parent arrives.
 
         Args:
-            block_data (dict): A dictionary containing the data for the block to be verified and added.
+            block_data (dict | Block): A dictionary containing the data for the block to be verified and added,
+                or a Block decoded with Block.from_bytes.
 
         Returns:
-            None
+            "extended", "side", "reorganized" or "orphan", telling what happened to the block (or, when
+            it connected orphans, to the last of them).
 
         Raises:
-            ValueError: If the previous hash of the given block does not match the hash of the last block in the chain.
+            ValueError: If the block is already known.
             ValueError: If the proof of work of the given block is invalid.
+            ValueError: If a transaction of the given block is malformed or its signature is missing or invalid.
         """
-        block = Block.from_dict(block_data, include_hash=False)
-        proof = block_data["hash"]
-        if self.last_block.hash != block.previous_hash:
-            raise ValueError("Previous hash incorrect")
-        if not block.is_proof_valid(proof):
-            raise ValueError("Block proof invalid")
+        started = time.perf_counter()
+        result = "invalid"
+        try:
+            if isinstance(block_data, Block):
+                block = block_data
+            else:
+                block = Block.from_dict(block_data)
+            if self.is_known_block(block.hash):
+                result = "known"
+                raise ValueError("Block already known")
+            if not block.is_proof_valid(block.hash):
+                raise ValueError("Block proof invalid")
+            self.check_transactions(block)
+            result = self.add_block(block)
+            return result
+        finally:
+            metrics.BLOCK_VERIFICATION_SECONDS.observe(
+                time.perf_counter() - started, result=result
+            )
 
-        block.hash = proof
-        self.chain.append(block)
+    def check_transactions(self, block):
+        """
+        Checks that block transactions are well-formed (see validate_transaction) and verifies their signatures;
+        transactions verified before (for example when they entered the mempool) are not verified again.
+
+        Args:
+            block (Block): The block to check.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If a transaction is malformed.
+            ValueError: If a transaction signature is missing or invalid.
+        """
+        transactions = block.transactions
+        for transaction in transactions:
+            validate_transaction(transaction)
+        errors = self.signature_verifier.verify(transactions, block.transaction_ids())
+        for error in errors:
+            if error is not None:
+                raise ValueError(error)
+
+    def add_block(self, block):
+        """
+        Adds a block whose proof of work has already been verified to the block tree.
+
+        Used by verify_and_add_block and for blocks verified in batches by a validator.ChainValidator.
+
+        Args:
+            block (Block): The verified block.
+
+        Returns:
+            The same as verify_and_add_block.
+
+        Raises:
+            ValueError: If the block is already known.
+            ValueError: If the block difficulty does not follow from the blocks before it.
+        """
+        with self._lock:
+            if self.is_known_block(block.hash):
+                raise ValueError("Block already known")
+            status = self._connect_block(block)
+            if status == "orphan":
+                return status
+            parents = [block.hash]
+            while parents:
+                for orphan in self._orphans_by_parent.pop(parents.pop(), []):
+                    del self._orphans[orphan.hash]
+                    try:
+                        status = self._connect_block(orphan)
+                    except ValueError as e:
+                        print(f"Dropping orphan block {orphan.hash}: {e}")
+                        continue
+                    parents.append(orphan.hash)
+            return status
+
+    def _connect_block(self, block):
+        """Adds a block with valid proof to the block tree. Must be called with the writer lock held."""
+        parent = self.find_block(block.previous_hash)
+        if parent is None:
+            # Checked against the blocks before it once the parent arrives.
+            check_timestamp(block, [])
+        else:
+            recent_blocks = self._recent_blocks(parent)
+            if block.difficulty != retarget(recent_blocks):
+                raise ValueError("Block difficulty incorrect")
+            check_timestamp(block, recent_blocks)
+
+        if block.previous_hash == self.last_block.hash:
+            self._check_new_transactions([block], len(self.chain) - 1)
+            self._append(block)
+            self.mempool.remove(block.transaction_ids())
+            return "extended"
+
+        fork_height, branch = self._find_branch(block)
+        if branch is not None:
+            self._check_new_transactions(branch, fork_height)
+        if branch is None:
+            self._orphans[block.hash] = block
+            self._orphans_by_parent.setdefault(block.previous_hash, []).append(block)
+            if len(self._orphans) > MAX_ORPHAN_BLOCKS:
+                _, evicted = self._orphans.popitem(last=False)
+                siblings = self._orphans_by_parent[evicted.previous_hash]
+                siblings.remove(evicted)
+                if not siblings:
+                    del self._orphans_by_parent[evicted.previous_hash]
+            return "orphan"
+
+        self._add_side_block(block)
+        chain = self.snapshot()
+        chain_work = sum(
+            chain[height].work() for height in range(fork_height + 1, len(chain))
+        )
+        if sum(branch_block.work() for branch_block in branch) <= chain_work:
+            return "side"
+        self._reorganize(fork_height, branch)
+        return "reorganized"
+
+    def _check_new_transactions(self, blocks, fork_height):
+        """
+        Checks that transactions of blocks following the chain block at fork_height are not replayed.
+        Must be called with the writer lock held.
+
+        Args:
+            blocks (list): Consecutive blocks following the block at fork_height.
+            fork_height (int): Height of the chain block the blocks follow.
+
+        Raises:
+            ValueError: If a transaction is in the chain up to fork_height or repeats in the blocks.
+        """
+        state = self.state()
+        seen = set()
+        for block in blocks:
+            for tx_id in block.transaction_ids():
+                location = state.location(tx_id)
+                if tx_id in seen or (location is not None and location[0] <= fork_height):
+                    raise ValueError(f"Transaction {tx_id} already in the chain")
+                seen.add(tx_id)
+
+    def mining_tip(self):
+        """
+        Returns the current chain snapshot together with the difficulty of a block following its last block.
+
+        Both are read under the writer lock, which is also held while transactions of new blocks are removed
+        from the mempool, so transactions selected from the mempool afterwards are not in the snapshot.
+        """
+        with self._lock:
+            chain = self.snapshot()
+            return chain, self.next_difficulty(chain.last_block)
+
+    def next_difficulty(self, parent=None):
+        """
+        Computes the required difficulty of a block following a given one (see retarget).
+
+        Args:
+            parent (Block): A block of the chain or of a side branch (default the last block).
+
+        Returns:
+            The difficulty.
+        """
+        with self._lock:
+            return retarget(self._recent_blocks(self.last_block if parent is None else parent))
+
+    def _recent_blocks(self, block):
+        """
+        Returns up to RETARGET_WINDOW blocks ending with a given one, oldest first and without the genesis
+        block, as passed to retarget. Must be called with the writer lock held.
+        """
+        recent_blocks = []
+        while (
+            block is not None
+            and len(recent_blocks) < RETARGET_WINDOW
+            and block.previous_hash != GENESIS_PREVIOUS_HASH
+        ):
+            recent_blocks.append(block)
+            block = self.find_block(block.previous_hash)
+        recent_blocks.reverse()
+        return recent_blocks
+
+    def _find_branch(self, block):
+        """
+        Follows parents of a block through side branches down to the chain.
+
+        Returns:
+            A tuple (height of the fork block in the chain, list of blocks from the fork to the given block),
+            or (None, None) if an ancestor is unknown.
+        """
+        branch = [block]
+        previous_hash = block.previous_hash
+        while True:
+            fork_height = self.get_height(previous_hash)
+            if fork_height is not None:
+                branch.reverse()
+                return fork_height, branch
+            parent = self._side_blocks.get(previous_hash)
+            if parent is None:
+                return None, None
+            branch.append(parent)
+            previous_hash = parent.previous_hash
+
+    def _add_side_block(self, block):
+        self._side_blocks[block.hash] = block
+        if len(self._side_blocks) > MAX_SIDE_BLOCKS:
+            self._side_blocks.popitem(last=False)
+
+    def _reorganize(self, fork_height, branch):
+        """
+        Replaces blocks following the fork block with a branch. Must be called with the writer lock held.
+
+        Transactions of disconnected blocks return to the pool of unconfirmed transactions and transactions
+        of connected blocks leave it, so the pool is updated without rebuilding it from the chain. An in-memory
+        chain list is replaced rather than shortened, so snapshots taken before keep their blocks.
+        """
+        chain = self.snapshot()
+        disconnected = chain[fork_height + 1 :]
+        # Everything which can fail is done before the chain is changed, so a failure leaves it intact.
+        returned = []
+        for block in disconnected:
+            for transaction in block.transactions:
+                try:
+                    validate_transaction(transaction)
+                except ValueError:
+                    continue
+                returned.append(transaction)
+        confirmed = [tx_id for block in branch for tx_id in block.transaction_ids()]
+        for block in branch:
+            # The encoding is cached, so appending the branch to a stored chain cannot fail on it.
+            block.to_bytes()
+        if self._state is not None:
+            for height in range(len(chain) - 1, fork_height, -1):
+                self._state.disconnect_block(chain[height], height)
+        truncate = getattr(self.chain, "truncate", None)
+        if truncate is not None:
+            truncate(fork_height + 1)
+        else:
+            self.chain = self.chain[: fork_height + 1]
+        print(
+            f"Reorganizing chain at height {fork_height}: "
+            f"{len(disconnected)} blocks disconnected, {len(branch)} connected"
+        )
+
+        for block in disconnected:
+            self._add_side_block(block)
+        for block in branch:
+            self._side_blocks.pop(block.hash, None)
+            self._append(block, publish=False)
+        self.mempool.add_many(returned)
+        self.mempool.remove(confirmed)
+        self._publish()
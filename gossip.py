@@ -0,0 +1,195 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from peers import node_key
+from wire import (INV_TRANSACTION, MAX_INVENTORY_ITEMS, MSG_GET_DATA, MSG_INV,
+                  encode_inventory, encode_message)
+
+GOSSIP_FANOUT = int(os.environ.get("GOSSIP_FANOUT", 8))
+SEEN_CACHE_SIZE = 100_000
+GET_DATA_TIMEOUT = 5.0
+
+
+class SeenCache:
+    """
+    A class remembering recently seen inventory items, evicting the least recently seen ones.
+
+    Attributes:
+        max_size (int): Maximum number of remembered items.
+    """
+
+    def __init__(self, max_size=SEEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, item):
+        with self._lock:
+            return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        """
+        Remembers an item.
+
+        Args:
+            item (tuple): An inventory item (kind, hash).
+
+        Returns:
+            True if the item was not seen before.
+        """
+        with self._lock:
+            new = item not in self._items
+            self._items[item] = None
+            self._items.move_to_end(item)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+            return new
+
+
+class GossipRelay:
+    """
+    A class relaying blocks and transactions through the network by gossip.
+
+    A node which accepts a new block or transaction announces its hash in an inventory message (MSG_INV)
+    to a random subset of GOSSIP_FANOUT peers instead of sending the body to every node. A peer asks
+    for bodies it does not have yet with MSG_GET_DATA, validates them and announces them further, so
+    items reach the whole network in a few hops while each node sends only a bounded number of messages.
+
+    Items are kept in a seen cache, so an item arriving again over another path is neither requested
+    nor relayed a second time, which also stops announcements from looping. Requested items are
+    remembered with the peer they were requested from; they are not requested from another peer until
+    GET_DATA_TIMEOUT seconds pass, and are not announced back to that peer.
+
+    Attributes:
+        fanout (int): Number of peers each item is announced to.
+    """
+
+    def __init__(self, broadcaster, fanout=GOSSIP_FANOUT, seen_size=SEEN_CACHE_SIZE):
+        self.fanout = fanout
+        self.seen = SeenCache(seen_size)
+        self._broadcaster = broadcaster
+        self._requested = OrderedDict()
+        self._lock = threading.Lock()
+
+    def choose_peers(self, peers, exclude=()):
+        """Returns a random subset of at most fanout peers, without the excluded ones."""
+        excluded = {node_key(node) for node in exclude}
+        candidates = [node for node in peers if node_key(node) not in excluded]
+        return random.sample(candidates, min(self.fanout, len(candidates)))
+
+    def relay(self, self_node, peers, kind, hashes, exclude=()):
+        """
+        Announces new items to a random subset of peers.
+
+        Args:
+            self_node (dict): Host and port of this node, to which peers send their requests.
+            peers (list): Nodes in network.
+            kind (int): INV_BLOCK or INV_TRANSACTION.
+            hashes (list): Hashes of accepted blocks or IDs of accepted transactions.
+            exclude (Iterable): Nodes which already have the items, e.g. the ones they came from.
+
+        Returns:
+            None
+        """
+        items = [(kind, item_hash) for item_hash in hashes]
+        for item in items:
+            self.seen.add(item)
+        targets = self.choose_peers(peers, exclude)
+        if not items or not targets:
+            return
+        for start in range(0, len(items), MAX_INVENTORY_ITEMS):
+            msg = encode_message(
+                MSG_INV,
+                encode_inventory(self_node, items[start : start + MAX_INVENTORY_ITEMS]),
+            )
+            self._broadcaster.broadcast(targets, msg, "inventory")
+
+    def request_missing(self, self_node, node, items, is_known):
+        """
+        Requests announced items which this node does not have yet from the announcing node.
+
+        Args:
+            self_node (dict): Host and port of this node, to which the items are sent.
+            node (dict): Host and port of the announcing node.
+            items (list): Announced (kind, hash) tuples.
+            is_known (Callable): A function telling if this node already has an item, called with kind and hash.
+
+        Returns:
+            A list of requested items.
+        """
+        now = time.monotonic()
+        wanted = []
+        with self._lock:
+            for item in items:
+                if item in self.seen or is_known(*item):
+                    continue
+                requested = self._requested.get(item)
+                if requested is not None and now - requested[0] < GET_DATA_TIMEOUT:
+                    continue
+                self._requested[item] = (now, node)
+                self._requested.move_to_end(item)
+                wanted.append(item)
+            self._expire_requests(now)
+        if wanted:
+            msg = encode_message(MSG_GET_DATA, encode_inventory(self_node, wanted))
+            self._broadcaster.broadcast([node], msg, "data request")
+        return wanted
+
+    def _expire_requests(self, now):
+        # Requests are ordered by time, so expired ones are at the front.
+        while self._requested:
+            item, (requested_at, _) = next(iter(self._requested.items()))
+            if now - requested_at < GET_DATA_TIMEOUT:
+                return
+            del self._requested[item]
+
+    def confirmed(self, tx_ids):
+        """
+        Records transactions of a block accepted by this node, so their announcements are not requested.
+
+        Args:
+            tx_ids (Iterable): IDs of the transactions of the block.
+
+        Returns:
+            None
+        """
+        for tx_id in tx_ids:
+            self.seen.add((INV_TRANSACTION, tx_id))
+
+    def received(self, kind, item_hash):
+        """
+        Records that an item arrived, so it is not requested again.
+
+        Args:
+            kind (int): INV_BLOCK or INV_TRANSACTION.
+            item_hash (str): Hash of the block or ID of the transaction.
+
+        Returns:
+            The node the item was requested from, or None if it was not requested.
+        """
+        self.seen.add((kind, item_hash))
+        return self.arrived(kind, item_hash)
+
+    def arrived(self, kind, item_hash):
+        """
+        Forgets the request for an item which arrived, without marking it seen.
+
+        Used for items whose hash is claimed by the sender, like blocks: until the item is validated, a
+        forged body must not stop the genuine item from being requested from other peers.
+
+        Args:
+            kind (int): INV_BLOCK or INV_TRANSACTION.
+            item_hash (str): Hash of the block or ID of the transaction.
+
+        Returns:
+            The node the item was requested from, or None if it was not requested.
+        """
+        with self._lock:
+            requested = self._requested.pop((kind, item_hash), None)
+        return None if requested is None else requested[1]
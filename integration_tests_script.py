@@ -32,7 +32,7 @@ def register_node(existing_node_port, new_node_port):
 
 
 def run_flask_instance_command(port):
-    return f"flask --app main.py run --port {port}"
+    return f"flask --app main:create_app() run --port {port}"
 
 
 flask_app = subprocess.Popen(
@@ -1,24 +1,106 @@
-import threading
+import atexit
+import json
+import time
 
-from flask import Flask, abort, jsonify, request
+from flask import (Flask, Response, abort, g, jsonify, request, send_file,
+                   stream_with_context)
 
-from p2p import (announce_new_block, populate_node, register_in_network,
-                 start_server)
+import metrics
+from classes import StaleSnapshotError
+from p2p import (announce_new_block, announce_new_transactions, populate_node,
+                 register_in_network, start_miner, start_node, stop_miner,
+                 stop_node)
+
+MAX_TRANSACTIONS_BATCH = 100_000
 
 app = Flask(__name__)
-server_thread = threading.Thread(target=start_server)
-server_thread.start()
+
+
+def create_app():
+    """
+    Starts the P2P node service and returns the application.
+
+    Importing this module has no side effects; nodes are run with `flask --app "main:create_app()" run`,
+    which starts the P2P service before serving HTTP and stops it on interpreter exit.
+    """
+    start_node()
+    atexit.register(stop_node)
+    return app
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_time(response):
+    """Records handling time of a request; time of streaming the body of a streamed response is not included."""
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=request.url_rule.rule if request.url_rule else "unmatched",
+            status=response.status_code,
+        )
+    return response
 
 
 @app.route("/new_transaction", methods=["GET"])
 def new_transaction():
-    """Adds (dummy) transaction"""
+    """Adds (dummy) transaction and announces it to nodes in network"""
     from p2p import blockchain
 
-    blockchain.add_new_transaction({"test": "test"})
+    try:
+        tx_id = blockchain.add_new_transaction({"test": "test"})
+    except ValueError as e:
+        abort(400, str(e))
+    announce_new_transactions([tx_id])
     return "Transaction added."
 
 
+@app.route("/transactions", methods=["POST"])
+def new_transactions():
+    """
+    Adds a batch of transactions
+
+    The body is either a JSON array of transaction objects or, with Content-Type application/x-ndjson,
+    one transaction object per line. All valid transactions are added to the pool at once and announced
+    to nodes in network, and the response lists the result of each one in request order."""
+    from p2p import blockchain
+
+    if request.mimetype == "application/x-ndjson":
+        transactions = []
+        for line in request.stream:
+            if not line.strip():
+                continue
+            try:
+                transactions.append(json.loads(line))
+            except ValueError:
+                transactions.append(None)
+    else:
+        transactions = request.get_json(silent=True)
+        if not isinstance(transactions, list):
+            abort(400, "Incorrect body: expected JSON array of transactions")
+    if len(transactions) > MAX_TRANSACTIONS_BATCH:
+        abort(413, f"Too many transactions, at most {MAX_TRANSACTIONS_BATCH} per request")
+
+    results = blockchain.add_new_transactions(transactions)
+    accepted_ids = [
+        result["tx_id"] for result in results if result["status"] == "accepted"
+    ]
+    announce_new_transactions(accepted_ids)
+    accepted = len(accepted_ids)
+    return jsonify(
+        {
+            "accepted": accepted,
+            "rejected": len(results) - accepted,
+            "results": results,
+        }
+    )
+
+
 @app.route("/mine_block", methods=["GET"])
 def mine_block():
     """
@@ -32,15 +114,260 @@ def mine_block():
     return "Block was mined."
 
 
+@app.route("/start_mining", methods=["GET"])
+def start_mining():
+    """
+    Starts background mining
+
+    The miner keeps mining blocks while there are unconfirmed transactions and announces them to all nodes
+    in network. Current mining job is abandoned and restarted whenever a block from another node arrives."""
+    start_miner()
+    return "Mining started."
+
+
+@app.route("/stop_mining", methods=["GET"])
+def stop_mining():
+    """Stops background mining"""
+    stop_miner()
+    return "Mining stopped."
+
+
+@app.route("/getwork", methods=["GET"])
+def get_work():
+    """
+    Returns work for an external miner
+
+    The work is the header prefix of the next block candidate, kept precomputed by the block template, and
+    the target. The miner searches for a nonce for which SHA-256 of the header prefix followed by the nonce
+    in decimal ASCII digits, as a 256-bit big-endian number, does not exceed the target, and submits it
+    to /submitwork with the work_id."""
+    from p2p import blockchain
+
+    return jsonify(blockchain.block_template().get_work())
+
+
+@app.route("/submitwork", methods=["POST"])
+def submit_work():
+    """
+    Completes work from /getwork with a nonce
+
+    The body is a JSON object with "work_id" and "nonce". A valid block is added to the blockchain and
+    announced to nodes in network."""
+    from p2p import blockchain
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or "work_id" not in body or "nonce" not in body:
+        abort(400, "Incorrect body: expected JSON object with work_id and nonce")
+    try:
+        block = blockchain.block_template().submit_work(body["work_id"], body["nonce"])
+    except ValueError as e:
+        abort(400, str(e))
+    announce_new_block(block)
+    return jsonify({"hash": block.hash, "height": blockchain.get_height(block.hash)})
+
+
+@app.route("/mining_stats", methods=["GET"])
+def get_mining_stats():
+    """Returns statistics of mining jobs, including rates of stale jobs and wasted hashing work"""
+    from p2p import blockchain, miner
+
+    stats = blockchain.mining_stats()
+    stats["running"] = miner is not None and miner.running
+    return jsonify(stats)
+
+
+def _chain_page_blocks(chain, from_height, to_height):
+    """Yields blocks data of chain in range [from_height, to_height)."""
+    for height in range(from_height, to_height):
+        yield chain[height].to_dict()
+
+
+def _stream_json_chain(length, blocks):
+    """Yields chain response JSON document in chunks, one block per chunk."""
+    yield f'{{"length": {length}, "chain": ['
+    for i, block_data in enumerate(blocks):
+        yield ("," if i else "") + json.dumps(block_data)
+    yield "]}"
+
+
+def _stream_ndjson_chain(blocks):
+    """Yields chain blocks as newline delimited JSON."""
+    for block_data in blocks:
+        yield json.dumps(block_data) + "\n"
+
+
 @app.route("/chain", methods=["GET"])
 def get_chain():
-    """Returns blockchain data"""
+    """
+    Returns blockchain data
+
+    Optional query parameters:
+        from_height: height of the first returned block (default 0).
+        limit: maximum number of returned blocks (default all).
+        format: "json" (default) or "ndjson" (one block per line, streamed).
+        stream: if "true", JSON document is streamed block by block instead of built in memory.
+
+    Response carries an ETag derived from hash of the last block and the query, so a client sending it back
+    in If-None-Match gets 304 Not Modified until a new block arrives. When a reorganization of a persistent
+    chain replaces blocks while they are read, the request fails with 503 (a streamed response is cut off)."""
+    from p2p import blockchain
+
+    from_height = request.args.get("from_height", 0, type=int)
+    limit = request.args.get("limit", None, type=int)
+    output_format = request.args.get("format", "json")
+    stream = request.args.get("stream", "false").lower() == "true"
+    if from_height < 0 or (limit is not None and limit < 0):
+        abort(400, "Incorrect parameters: from_height and limit must be non-negative")
+    if output_format not in ("json", "ndjson"):
+        abort(400, "Incorrect parameter: format")
+
+    chain = blockchain.snapshot()
+    length = len(chain)
+    try:
+        tip_hash = chain[length - 1].hash
+    except StaleSnapshotError:
+        abort(503, "Chain reorganized, retry the request")
+    etag = f"{tip_hash}-{from_height}-{limit}-{output_format}-{stream}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    to_height = length if limit is None else min(length, from_height + limit)
+    blocks = _chain_page_blocks(chain, from_height, to_height)
+    if output_format == "ndjson":
+        response = Response(
+            stream_with_context(_stream_ndjson_chain(blocks)),
+            mimetype="application/x-ndjson",
+        )
+    elif stream:
+        response = Response(
+            stream_with_context(_stream_json_chain(length, blocks)),
+            mimetype="application/json",
+        )
+    else:
+        try:
+            response = jsonify({"length": length, "chain": list(blocks)})
+        except StaleSnapshotError:
+            abort(503, "Chain reorganized, retry the request")
+    response.set_etag(etag)
+    return response
+
+
+@app.route("/merkle_proof", methods=["GET"])
+def get_merkle_proof():
+    """
+    Returns Merkle inclusion proof of a transaction in a block.
+
+    The endpoint expects block_hash and tx_id query parameters. The proof can be checked against
+    the merkle_root of the block header with merkle.verify_proof, without downloading the block."""
+    from p2p import blockchain
+
+    block_hash = request.args.get("block_hash")
+    tx_id = request.args.get("tx_id")
+    if not block_hash or not tx_id:
+        abort(400, "Incorrect parameters: block_hash and tx_id are required")
+    block = blockchain.get_block(block_hash)
+    if block is None:
+        abort(404, "Block not found")
+    tx_ids = block.transaction_ids()
+    if tx_id not in tx_ids:
+        abort(404, "Transaction not found in block")
+    index = tx_ids.index(tx_id)
+    tree = block.build_merkle_tree()
+    return jsonify(
+        {
+            "block_hash": block.hash,
+            "merkle_root": tree.root,
+            "tx_id": tx_id,
+            "index": index,
+            "proof": tree.proof(index),
+        }
+    )
+
+
+@app.route("/transaction", methods=["GET"])
+def get_transaction():
+    """
+    Returns a transaction by its ID, given in tx_id query parameter.
+
+    A confirmed transaction is returned with hash and height of its block, its position in the block and
+    number of confirmations; an unconfirmed one with status "unconfirmed"."""
+    from p2p import blockchain
+
+    tx_id = request.args.get("tx_id")
+    if not tx_id:
+        abort(400, "Incorrect parameter: tx_id is required")
+    found = blockchain.find_transaction(tx_id)
+    if found is not None:
+        block, height, position, transaction = found
+        return jsonify(
+            {
+                "tx_id": tx_id,
+                "status": "confirmed",
+                "block_hash": block.hash,
+                "height": height,
+                "position": position,
+                "confirmations": len(blockchain.snapshot()) - height,
+                "transaction": transaction,
+            }
+        )
+    transaction = blockchain.mempool.get(tx_id)
+    if transaction is None:
+        abort(404, "Transaction not found")
+    return jsonify({"tx_id": tx_id, "status": "unconfirmed", "transaction": transaction})
+
+
+@app.route("/balance", methods=["GET"])
+def get_balance():
+    """
+    Returns balance of an address, given in address query parameter, computed from confirmed transactions."""
     from p2p import blockchain
 
-    chain_data = []
-    for block in blockchain.chain:
-        chain_data.append(block.__dict__)
-    return jsonify({"length": len(chain_data), "chain": chain_data})
+    address = request.args.get("address")
+    if not address:
+        abort(400, "Incorrect parameter: address is required")
+    balance, height = blockchain.get_balance(address)
+    return jsonify({"address": address, "balance": balance, "height": height})
+
+
+@app.route("/headers", methods=["POST"])
+def get_headers():
+    """
+    Returns headers of blocks missing on calling node.
+
+    The endpoint expects a block locator of calling node chain and returns up to limit headers
+    of blocks following the last block common with this node chain."""
+    from p2p import HEADERS_BATCH_SIZE, blockchain
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("locator"), list):
+        abort(400, "Incorrect parameter: locator")
+    limit = body.get("limit", HEADERS_BATCH_SIZE)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+        abort(400, "Incorrect parameter: limit must be a non-negative integer")
+    return jsonify(blockchain.headers_after(body["locator"], min(limit, HEADERS_BATCH_SIZE)))
+
+
+@app.route("/blocks", methods=["POST"])
+def get_blocks():
+    """Returns data of blocks with given hashes, skipping blocks which are not in the chain"""
+    from p2p import BLOCKS_BATCH_SIZE, blockchain
+
+    body = request.get_json(silent=True)
+    hashes = body.get("hashes") if isinstance(body, dict) else None
+    if (
+        not isinstance(hashes, list)
+        or len(hashes) > BLOCKS_BATCH_SIZE
+        or not all(isinstance(block_hash, str) for block_hash in hashes)
+    ):
+        abort(400, "Incorrect parameter: hashes")
+    blocks_data = []
+    for block_hash in hashes:
+        block = blockchain.get_block(block_hash)
+        if block is not None:
+            blocks_data.append(block.to_dict())
+    return jsonify(blocks_data)
 
 
 @app.route("/nodes", methods=["GET"])
@@ -51,11 +378,101 @@ def get_nodes():
     return jsonify(nodes)
 
 
+@app.route("/peer_stats", methods=["GET"])
+def get_peer_stats():
+    """Returns per-peer message delivery statistics (counts, errors and latencies in seconds)"""
+    from p2p import broadcaster
+
+    return jsonify(broadcaster.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Returns metrics of the node (mining, block verification, peers, mempool, chain, HTTP) in Prometheus text format"""
+    from p2p import blockchain
+
+    metrics.CHAIN_HEIGHT.set(len(blockchain.snapshot()) - 1)
+    metrics.MEMPOOL_TRANSACTIONS.set(len(blockchain.mempool))
+    metrics.MEMPOOL_BYTES.set(blockchain.mempool.size_bytes)
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/profile", methods=["GET"])
+def get_profile():
+    """
+    Samples stacks of all threads of the node and returns them as collapsed stacks (flame graph input)
+
+    Served only when the BLOCKCHAIN_PROFILE_ENABLED environment variable is 1, otherwise 404 is returned.
+
+    Optional query parameters:
+        seconds: duration of sampling (default 5, at most 60).
+        interval: seconds between samples (default BLOCKCHAIN_PROFILE_INTERVAL environment variable or 0.005)."""
+    if not metrics.PROFILE_ENABLED:
+        abort(404)
+    seconds = request.args.get("seconds", 5.0, type=float)
+    interval = request.args.get("interval", metrics.PROFILE_INTERVAL, type=float)
+    try:
+        collapsed = metrics.profile(seconds, interval)
+    except ValueError as e:
+        abort(400, str(e))
+    return Response(collapsed, mimetype="text/plain")
+
+
+@app.route("/snapshot", methods=["POST"])
+def produce_snapshot():
+    """
+    Starts producing a compressed snapshot of the chain in the background
+
+    Progress is reported by /snapshot/status; the previous snapshot is served until the new one is complete."""
+    from p2p import blockchain, snapshot_producer
+
+    try:
+        snapshot_producer.start(blockchain.snapshot())
+    except ValueError as e:
+        abort(409, str(e))
+    return jsonify(snapshot_producer.status()), 202
+
+
+@app.route("/snapshot/status", methods=["GET"])
+def get_snapshot_status():
+    """Returns progress of snapshot production and summary of the last complete snapshot"""
+    from p2p import snapshot_producer
+
+    return jsonify(snapshot_producer.status())
+
+
+@app.route("/snapshot", methods=["GET"])
+def get_snapshot():
+    """
+    Streams the last complete chain snapshot
+
+    A new node imports it with `python -m snapshot import --url <node>/snapshot`, verifying chunks as they arrive."""
+    from p2p import snapshot_producer
+
+    if snapshot_producer.manifest() is None:
+        abort(404, "No snapshot, produce one with POST /snapshot")
+    return send_file(
+        snapshot_producer.path, mimetype="application/octet-stream", conditional=True
+    )
+
+
+@app.route("/snapshot/manifest", methods=["GET"])
+def get_snapshot_manifest():
+    """Returns manifest of the last complete snapshot: number of blocks, digest and hash of each chunk"""
+    from p2p import snapshot_producer
+
+    manifest = snapshot_producer.manifest()
+    if manifest is None:
+        abort(404, "No snapshot, produce one with POST /snapshot")
+    return jsonify(manifest)
+
+
 @app.route("/register", methods=["POST"])
 def register():
     """Registers node in network"""
-    node_http_address = request.get_json().get("node_http_address")
-    if not node_http_address:
+    body = request.get_json(silent=True)
+    node_http_address = body.get("node_http_address") if isinstance(body, dict) else None
+    if not node_http_address or not isinstance(node_http_address, str):
         abort(400, "Incorrect parameter: node_http_address")
     register_in_network(node_http_address)
     return "Node was added to network"
@@ -67,8 +484,9 @@ def populate_new_node():
     Propagates new node across network.
 
     The endpoint is called from inside by node which want to register in network,
-    and returns current nodes in network as well as blockchain data to allow
-    synchronization for new node.
+    and returns current nodes in network as well as summary of blockchain (last block
+    and unconfirmed transactions). New node then downloads missing blocks through
+    /headers and /blocks endpoints.
     """
     new_node_host = request.get_json()["host"]
     new_node_port = request.get_json()["port"]
@@ -0,0 +1,151 @@
+from hashlib import sha256
+
+EMPTY_ROOT = "0" * 64
+LEFT = "left"
+RIGHT = "right"
+
+
+def hash_pair(left, right):
+    """
+    Computes the hash of an inner Merkle tree node.
+
+    A one byte prefix separates inner nodes from leaves, so a leaf can never be presented as an inner node.
+
+    Args:
+        left (str): Hex hash of the left child.
+        right (str): Hex hash of the right child.
+
+    Returns:
+        The hex hash of the parent node.
+    """
+    return sha256(b"\x01" + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+class MerkleTree:
+    """
+    A class representing a binary Merkle tree over a list of leaf hashes.
+
+    When a level has an odd number of nodes, the last node is promoted to the next level unchanged.
+
+    Attributes:
+        levels (list): Lists of hex hashes, from the leaves (levels[0]) up to the root.
+    """
+
+    def __init__(self, leaves):
+        self.levels = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            next_level = [
+                hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)
+            ]
+            if len(level) % 2:
+                next_level.append(level[-1])
+            self.levels.append(next_level)
+
+    def append(self, leaf):
+        """Adds a leaf after the last one, rehashing only the nodes above it."""
+        self.levels[0].append(leaf)
+        self._rehash(len(self.levels[0]) - 1)
+
+    def update(self, index, leaf):
+        """
+        Replaces the leaf at a given index, rehashing only the nodes above it.
+
+        Raises:
+            IndexError: If there is no leaf at the given index.
+        """
+        if not 0 <= index < len(self.levels[0]):
+            raise IndexError("Leaf index out of range")
+        self.levels[0][index] = leaf
+        self._rehash(index)
+
+    def pop(self):
+        """
+        Removes the last leaf, rehashing only the nodes above the new last one.
+
+        Returns:
+            The removed leaf.
+
+        Raises:
+            IndexError: If the tree is empty.
+        """
+        leaf = self.levels[0].pop()
+        self._rehash(len(self.levels[0]) - 1)
+        return leaf
+
+    def _rehash(self, index):
+        # Recomputes the path from the leaf at index to the root, trimming each level to the size implied
+        # by the one below, so the tree equals one built from scratch over the same leaves.
+        height = 0
+        while len(self.levels[height]) > 1:
+            level = self.levels[height]
+            if height + 1 == len(self.levels):
+                self.levels.append([])
+            parent_level = self.levels[height + 1]
+            del parent_level[(len(level) + 1) // 2 :]
+            parent = index // 2
+            left = 2 * parent
+            node = (
+                hash_pair(level[left], level[left + 1])
+                if left + 1 < len(level)
+                else level[left]
+            )
+            if parent == len(parent_level):
+                parent_level.append(node)
+            else:
+                parent_level[parent] = node
+            index = parent
+            height += 1
+        del self.levels[height + 1 :]
+
+    @property
+    def root(self):
+        """Returns the root hash of the tree."""
+        if not self.levels[0]:
+            return EMPTY_ROOT
+        return self.levels[-1][0]
+
+    def proof(self, index):
+        """
+        Builds the inclusion proof for the leaf at a given index.
+
+        Args:
+            index (int): Position of the leaf.
+
+        Returns:
+            A list of dictionaries with sibling "hash" and its "position" (left or right), ordered from the leaf up.
+
+        Raises:
+            IndexError: If there is no leaf at the given index.
+        """
+        if not 0 <= index < len(self.levels[0]):
+            raise IndexError("Leaf index out of range")
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                position = LEFT if sibling < index else RIGHT
+                proof.append({"hash": level[sibling], "position": position})
+            index //= 2
+        return proof
+
+
+def verify_proof(leaf, proof, root):
+    """
+    Checks if a leaf is included in a Merkle tree with the given root.
+
+    Args:
+        leaf (str): Hex hash of the leaf.
+        proof (list): An inclusion proof as returned by MerkleTree.proof.
+        root (str): Expected hex root hash.
+
+    Returns:
+        True if the proof is valid, False otherwise.
+    """
+    current = leaf
+    for step in proof:
+        if step["position"] == LEFT:
+            current = hash_pair(step["hash"], current)
+        else:
+            current = hash_pair(current, step["hash"])
+    return current == root
@@ -0,0 +1,331 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+NONCE_BUCKETS = tuple(4**exponent for exponent in range(13))
+# The /profile endpoint samples every thread of the node, so it is only served when enabled explicitly.
+PROFILE_ENABLED = bool(int(os.environ.get("BLOCKCHAIN_PROFILE_ENABLED", 0)))
+PROFILE_INTERVAL = float(os.environ.get("BLOCKCHAIN_PROFILE_INTERVAL", 0.005))
+MAX_PROFILE_SECONDS = 60
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base of metric types: a named family of values, one per combination of label values."""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {} if self.labels else {(): self._initial()}
+        self._lock = threading.Lock()
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric {self.name} takes labels {self.labels}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self, key, value):
+        yield self.name, (), value
+
+    def render(self):
+        """Returns the metric in Prometheus text exposition format."""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+            for key, value in values:
+                for name, extra, sample in self._samples(key, value):
+                    labels = _format_labels(self.labels, key, extra)
+                    lines.append(f"{name}{labels} {_format_value(sample)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A metric which only increases, e.g. a number of computed hashes."""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Increases the counter.
+
+        Args:
+            amount (int | float): The non-negative increase.
+            **labels: Values of all labels of the metric.
+        """
+        if amount < 0:
+            raise ValueError("Counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """A metric which can go up and down, e.g. a number of transactions in the mempool."""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        """
+        Sets the gauge.
+
+        Args:
+            value (int | float): The new value.
+            **labels: Values of all labels of the metric.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    """A metric counting observations, e.g. latencies, in buckets of upper bounds."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels)
+
+    def _initial(self):
+        return [0] * (len(self.buckets) + 1), 0
+
+    def observe(self, value, **labels):
+        """
+        Records an observation.
+
+        Args:
+            value (int | float): The observed value.
+            **labels: Values of all labels of the metric.
+        """
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or self._initial()
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ((), 0))
+            return sum(counts)
+
+    def _samples(self, key, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield f"{self.name}_bucket", (("le", _format_value(bound)),), cumulative
+        yield f"{self.name}_sum", (), total
+        yield f"{self.name}_count", (), cumulative
+
+
+class Registry:
+    """
+    A class keeping the metrics of a node.
+
+    Metrics are created once at import of this module and updated in place by the code they measure;
+    render() serializes all of them for the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """Adds a metric to the registry and returns it."""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Returns all metrics in Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+MINING_HASHES = REGISTRY.register(
+    Counter("blockchain_mining_hashes_total", "Hashes computed searching for proof of work nonces.")
+)
+MINING_SECONDS = REGISTRY.register(
+    Counter("blockchain_mining_seconds_total", "Time spent searching for proof of work nonces.")
+)
+MINING_JOB_NONCES = REGISTRY.register(
+    Histogram(
+        "blockchain_mining_job_nonces",
+        "Nonces checked by a mining job, by outcome of the job.",
+        ("outcome",),
+        NONCE_BUCKETS,
+    )
+)
+BLOCK_VERIFICATION_SECONDS = REGISTRY.register(
+    Histogram(
+        "blockchain_block_verification_seconds",
+        "Time to verify a received block and add it to the block tree, by result.",
+        ("result",),
+    )
+)
+PEER_SEND_SECONDS = REGISTRY.register(
+    Histogram(
+        "blockchain_peer_send_seconds",
+        "Time from queueing a message for a peer to completing its send.",
+        ("peer",),
+    )
+)
+PEER_SEND_ERRORS = REGISTRY.register(
+    Counter(
+        "blockchain_peer_send_errors_total",
+        "Messages which could not be delivered to a peer, by error.",
+        ("peer", "error"),
+    )
+)
+PEER_RECEIVE_SECONDS = REGISTRY.register(
+    Histogram(
+        "blockchain_peer_receive_seconds",
+        "Time from receiving a message from a peer to finishing its handling, by message type.",
+        ("peer", "type"),
+    )
+)
+PEER_RECEIVE_ERRORS = REGISTRY.register(
+    Counter(
+        "blockchain_peer_receive_errors_total",
+        "Connections from a peer closed because of a network or framing error.",
+        ("peer", "error"),
+    )
+)
+MEMPOOL_TRANSACTIONS = REGISTRY.register(
+    Gauge("blockchain_mempool_transactions", "Unconfirmed transactions in the mempool.")
+)
+MEMPOOL_BYTES = REGISTRY.register(
+    Gauge("blockchain_mempool_bytes", "Total size of unconfirmed transactions in the mempool.")
+)
+CHAIN_HEIGHT = REGISTRY.register(
+    Gauge("blockchain_chain_height", "Height of the last block of the chain.")
+)
+HTTP_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "blockchain_http_request_seconds",
+        "Time to handle an HTTP request, by method, route and status code.",
+        ("method", "route", "status"),
+    )
+)
+
+
+class SamplingProfiler:
+    """
+    A class sampling stacks of all threads of the process at a fixed interval.
+
+    Samples are aggregated as collapsed stacks ("outer;inner count" lines), the input format of flame graph
+    tools such as flamegraph.pl or speedscope. Sampling shows whether threads spend their time hashing,
+    waiting for locks or waiting for the network.
+
+    Attributes:
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self._stacks = StackCounter()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            stacks.append(";".join(reversed(stack)))
+        with self._lock:
+            self._stacks.update(stacks)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        """Starts sampling in a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling and waits for the sampling thread to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def collapsed(self):
+        """Returns the samples as collapsed stacks, most frequent first."""
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+def profile(seconds, interval=PROFILE_INTERVAL):
+    """
+    Samples stacks of all threads for a period of time.
+
+    Args:
+        seconds (float): Duration of sampling, at most MAX_PROFILE_SECONDS.
+        interval (float): Seconds between samples.
+
+    Returns:
+        The samples as collapsed stacks (see SamplingProfiler).
+
+    Raises:
+        ValueError: If the duration or interval is out of range.
+    """
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or interval <= 0:
+        raise ValueError("Incorrect profiling duration or interval")
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+    time.sleep(seconds)
+    profiler.stop()
+    return profiler.collapsed()
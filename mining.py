@@ -0,0 +1,234 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from hashlib import sha256
+
+from classes import hash_header, target_of
+
+NONCE_CHUNK_SIZE = 20_000
+STOP_CHECK_INTERVAL = 1024
+CANCEL_POLL_INTERVAL = 0.05
+MINER_IDLE_INTERVAL = 0.1
+
+_stop_event = None
+
+
+def _init_worker(stop_event):
+    """Stores the shared stop event in the worker process."""
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _search_chunk(header_prefix, difficulty, start, stop):
+    """
+    Searches nonces in range [start, stop) for a hash satisfying the difficulty.
+
+    Args:
+        header_prefix (bytes): Serialized block header without the nonce.
+        difficulty (int): Difficulty of the block (see classes.target_of).
+        start (int): First nonce to check.
+        stop (int): Nonce at which search stops (exclusive).
+
+    Returns:
+        The lowest valid nonce in the range, or None if there is none or the search was stopped.
+    """
+    prefix_state = sha256(header_prefix)
+    target = target_of(difficulty)
+    for nonce in range(start, stop):
+        if nonce % STOP_CHECK_INTERVAL == 0 and _stop_event.is_set():
+            return None
+        if hash_header(prefix_state, nonce) <= target:
+            return nonce
+    return None
+
+
+class NonceSearcher:
+    """
+    A class searching for proof of work nonces with a pool of processes.
+
+    The process pool is started on first use and kept until close(), so mining one block after another
+    does not start new processes for every block. Searches are run one at a time; workers share a stop
+    event which ends the chunks still being searched once a search is over.
+
+    Attributes:
+        workers (int): Number of worker processes.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._stop_event = None
+        self._lock = threading.Lock()
+
+    def find_nonce(self, block, difficulty=None, chunk_size=NONCE_CHUNK_SIZE, is_cancelled=None):
+        """
+        Searches for the proof of work nonce of a block.
+
+        The nonce space starting at block.nonce is split into chunks of chunk_size nonces which are handed out
+        to workers in order. Chunks results are consumed in the same order, so the returned nonce is the lowest
+        valid one, exactly as found by the serial search. Once it is known, all workers are stopped.
+
+        Args:
+            block (Block): A Block object for which the nonce is searched.
+            difficulty (int): Difficulty of the search (default the block difficulty).
+            chunk_size (int): Number of nonces checked by a worker in one task.
+            is_cancelled (Callable): Optional function polled while waiting for workers; when it returns True
+                the search is stopped.
+
+        Returns:
+            The lowest valid nonce not smaller than block.nonce, or None if the search was cancelled. In that
+            case block.nonce is moved to the first nonce which was not fully checked.
+        """
+        if difficulty is None:
+            difficulty = block.difficulty
+        header_prefix = block.header_prefix()
+        with self._lock:
+            if self._executor is None:
+                self._stop_event = multiprocessing.Event()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self._stop_event,),
+                )
+            pending = deque()
+            try:
+                next_start = block.nonce
+                while True:
+                    while len(pending) < self.workers * 2:
+                        pending.append(
+                            self._executor.submit(
+                                _search_chunk,
+                                header_prefix,
+                                difficulty,
+                                next_start,
+                                next_start + chunk_size,
+                            )
+                        )
+                        next_start += chunk_size
+                    future = pending[0]
+                    while True:
+                        try:
+                            nonce = future.result(timeout=CANCEL_POLL_INTERVAL)
+                            break
+                        except FutureTimeoutError:
+                            if is_cancelled is not None and is_cancelled():
+                                return None
+                    pending.popleft()
+                    if nonce is not None:
+                        return nonce
+                    block.nonce += chunk_size
+            finally:
+                # Chunks of this search must end before the stop event is cleared for the next one.
+                self._stop_event.set()
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                self._stop_event.clear()
+
+    def close(self):
+        """Stops the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+                self._stop_event = None
+
+
+_searchers = {}
+_searchers_lock = threading.Lock()
+
+
+def find_nonce_parallel(
+    block, workers, difficulty=None, chunk_size=NONCE_CHUNK_SIZE, is_cancelled=None
+):
+    """
+    Searches for the proof of work nonce of a block with the shared NonceSearcher of given number of workers.
+
+    Args:
+        block (Block): A Block object for which the nonce is searched.
+        workers (int): Number of worker processes.
+        difficulty (int): Difficulty of the search (default the block difficulty).
+        chunk_size (int): Number of nonces checked by a worker in one task.
+        is_cancelled (Callable): Optional function polled while waiting for workers; when it returns True
+            the search is stopped.
+
+    Returns:
+        The same as NonceSearcher.find_nonce.
+    """
+    with _searchers_lock:
+        searcher = _searchers.get(workers)
+        if searcher is None:
+            searcher = _searchers[workers] = NonceSearcher(workers)
+    return searcher.find_nonce(block, difficulty, chunk_size, is_cancelled)
+
+
+def close_searchers():
+    """Stops worker processes of all shared nonce searchers."""
+    with _searchers_lock:
+        searchers = list(_searchers.values())
+        _searchers.clear()
+    for searcher in searchers:
+        searcher.close()
+
+
+class MinerService:
+    """
+    A class representing a background miner.
+
+    The miner mines blocks in a thread as long as there are unconfirmed transactions and passes each mined
+    block to on_block (for example to announce it). Each mining job is cancelled as soon as a new block arrives
+    from a peer and is restarted on the new last block (see Blockchain.mine_block).
+
+    Attributes:
+        blockchain (Blockchain): The blockchain blocks are mined for.
+        on_block (Callable): A function called with every mined block.
+    """
+
+    def __init__(self, blockchain, on_block):
+        self.blockchain = blockchain
+        self.on_block = on_block
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not len(self.blockchain.mempool):
+                self._stop_event.wait(MINER_IDLE_INTERVAL)
+                continue
+            block = self.blockchain.mine_block(is_cancelled=self._stop_event.is_set)
+            if block is not None:
+                self.on_block(block)
+
+    def start(self):
+        """Starts mining in a background thread, does nothing if the miner is already running."""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Cancels the current mining job and waits for the mining thread to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """
+        Returns mining statistics.
+
+        Returns:
+            A dictionary with counts of started, stale (cancelled because of a new block) and successful jobs,
+            computed and wasted hashes, and rates of stale jobs and wasted work.
+        """
+        stats = self.blockchain.mining_stats()
+        stats["running"] = self.running
+        return stats
@@ -1,21 +1,74 @@
 import json
-import pickle
-import socket
-import threading
+import os
+import random
+import time
 
 import requests
 from flask import abort
 
-from classes import Blockchain
+from classes import Block, Blockchain
+from gossip import GossipRelay
+from mining import MinerService, close_searchers
+from peers import Broadcaster, PeerManager
+from server import P2PServer
+from snapshot import SNAPSHOT_FILE, SnapshotProducer
+from storage import FSYNC_INTERVAL, open_chain
+from validator import ChainValidator
+from wire import (INV_BLOCK, INV_TRANSACTION, MSG_ADD_BLOCK, MSG_ADD_NODE,
+                  MSG_ADD_TRANSACTIONS, MSG_GET_BLOCKS, MSG_GET_DATA, MSG_INV,
+                  decode_get_blocks, decode_inventory, decode_node,
+                  decode_transactions, encode_get_blocks, encode_message,
+                  encode_node, encode_transactions)
 
-ADD_NODE_PREFIX = b"1"
-ADD_BLOCK_PREFIX = b"2"
 LOCALHOST = "127.0.0.1"
+HEADERS_BATCH_SIZE = 2000
+BLOCKS_BATCH_SIZE = 100
+GET_BLOCKS_LIMIT = 500
+BLOCKS_REQUEST_INTERVAL = 1.0
+INBOUND_WORKERS = 8
+BROADCAST_WORKERS = 16
+BLOCKCHAIN_DATA_DIR = os.environ.get("BLOCKCHAIN_DATA_DIR")
+BLOCKCHAIN_FSYNC_POLICY = os.environ.get("BLOCKCHAIN_FSYNC_POLICY", FSYNC_INTERVAL)
+# Absolute, because Flask's send_file resolves relative paths against the application root, not the
+# working directory the snapshot is written to.
+BLOCKCHAIN_SNAPSHOT_DIR = os.path.abspath(
+    os.environ.get(
+        "BLOCKCHAIN_SNAPSHOT_DIR",
+        os.path.join(BLOCKCHAIN_DATA_DIR, "snapshots") if BLOCKCHAIN_DATA_DIR else "snapshots",
+    )
+)
+# Trusted checkpoints as a JSON object mapping heights to block hashes, e.g. {"1000": "00ab..."}.
+CHECKPOINTS = {
+    int(height): block_hash
+    for height, block_hash in json.loads(
+        os.environ.get("BLOCKCHAIN_CHECKPOINTS", "{}")
+    ).items()
+}
+
+
+def open_local_chain():
+    """
+    Opens the persistent chain of this node.
+
+    Returns:
+        A StoredChain kept in BLOCKCHAIN_DATA_DIR, or None if the variable is not set and chain lives only in memory.
+    """
+    if not BLOCKCHAIN_DATA_DIR:
+        return None
+    return open_chain(BLOCKCHAIN_DATA_DIR, BLOCKCHAIN_FSYNC_POLICY)
+
 
 host = None
 port = None
+server = None
+miner = None
 nodes = []
-blockchain = Blockchain()
+last_blocks_request = 0.0
+blockchain = Blockchain(chain=open_local_chain())
+peer_manager = PeerManager()
+broadcaster = Broadcaster(peer_manager, BROADCAST_WORKERS)
+gossip = GossipRelay(broadcaster)
+snapshot_producer = SnapshotProducer(os.path.join(BLOCKCHAIN_SNAPSHOT_DIR, SNAPSHOT_FILE))
 
 
 def register_in_network(node_http_address):
@@ -34,21 +87,120 @@ def register_in_network(node_http_address):
     url = f"{node_http_address}/populate_new_node"
     headers = {"Content-Type": "application/json"}
     data = json.dumps({"host": host, "port": port})
-    response = requests.post(url, data=data, headers=headers)
+    try:
+        response = requests.post(url, data=data, headers=headers)
+    except requests.RequestException as e:
+        abort(502, f"Registration failed: {e}")
     if response.status_code != 200:
         abort(400, "Something went wrong during registration")
 
     global nodes
-    nodes, blockchain_data = json.loads(response.content)
-    global blockchain
-    blockchain = Blockchain.from_dict(blockchain_data)
+    # The other node is not trusted: malformed responses and invalid blocks are reported as a bad gateway.
+    try:
+        nodes, chain_summary = json.loads(response.content)
+        transactions = chain_summary["unconfirmed_transactions"]
+        sync_blockchain(blockchain, node_http_address)
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        abort(502, f"Registration failed: {type(e).__name__}: {e}")
+    for transaction in transactions:
+        try:
+            blockchain.add_new_transaction(transaction)
+        except ValueError as e:
+            print(f"Skipping unconfirmed transaction: {e}")
+
+
+def sync_blockchain(local_blockchain, node_http_address, progress=None):
+    """
+    Synchronises blockchain with another node, downloading only blocks missing locally.
+
+    The function sends a block locator of local chain and receives headers of blocks following the
+    last common block. Headers are validated first, including trusted checkpoints, then block bodies
+    are downloaded in batches, their proofs are verified in parallel by a ChainValidator and they are
+    added to the block tree, so a node on a competing branch reorganizes to the peer chain once it has
+    more work. Hashes of blocks up to a checkpoint confirmed by the headers are not compared with the
+    difficulty target, but their bodies are still checked against the headers.
+
+    Args:
+        local_blockchain (Blockchain): A Blockchain object to be synchronised.
+        node_http_address (string): A string representing the HTTP address of a node in the network.
+        progress (Callable): Optional function called with numbers of verified and all blocks of each batch.
+
+    Returns:
+        Number of blocks added to the block tree.
+
+    Raises:
+        ValueError: If headers or blocks received from the node are invalid.
+    """
+    added = 0
+    locator = local_blockchain.block_locator()
+    height = None
+    with ChainValidator(checkpoints=CHECKPOINTS, progress=progress) as validator:
+        while True:
+            response = requests.post(
+                f"{node_http_address}/headers",
+                json={"locator": locator, "limit": HEADERS_BATCH_SIZE},
+            )
+            if response.status_code != 200:
+                raise ValueError("Headers request failed")
+            block_headers = response.json()
+            if not block_headers:
+                return added
+            local_blockchain.check_headers(block_headers)
+            if height is None:
+                fork_height = local_blockchain.get_height(block_headers[0]["previous_hash"])
+                height = None if fork_height is None else fork_height + 1
+            trusted_height = validator.check_links(
+                [Block.from_header_dict(header) for header in block_headers],
+                height,
+                block_headers[0]["previous_hash"],
+            )
+            heights = {
+                header["hash"]: None if height is None else height + offset
+                for offset, header in enumerate(block_headers)
+            }
+
+            missing_headers = [
+                header
+                for header in block_headers
+                if not local_blockchain.is_known_block(header["hash"])
+            ]
+            for start in range(0, len(missing_headers), BLOCKS_BATCH_SIZE):
+                batch = missing_headers[start : start + BLOCKS_BATCH_SIZE]
+                response = requests.post(
+                    f"{node_http_address}/blocks",
+                    json={"hashes": [header["hash"] for header in batch]},
+                )
+                if response.status_code != 200:
+                    raise ValueError("Blocks request failed")
+                blocks_data = response.json()
+                if len(blocks_data) != len(batch):
+                    raise ValueError("Missing blocks in response")
+                blocks = []
+                for header, block_data in zip(batch, blocks_data):
+                    block = Block.from_dict(block_data)
+                    if block.header_dict() != header:
+                        raise ValueError("Block does not match header")
+                    blocks.append(block)
+                validator.check_proofs(
+                    blocks, [heights[block.hash] for block in blocks], trusted_height
+                )
+                for block in blocks:
+                    local_blockchain.add_block(block)
+                    added += 1
+
+            if len(block_headers) < HEADERS_BATCH_SIZE:
+                return added
+            if height is not None:
+                height += len(block_headers)
+            # The peer branch may not be the local chain yet, so continue from its last received block.
+            locator = [block_headers[-1]["hash"]] + local_blockchain.block_locator()
 
 
 def populate_node(new_node_host, new_node_port):
     """
     Contains logic for new node propagation.
 
-    The function sends new node host and port using socket for communication with other nodes in network.
+    The function queues new node host and port for concurrent delivery to other nodes in network.
 
     Args:
         new_node_host (string): A string representing the hostname of the new node to be populated.
@@ -57,32 +209,34 @@ def populate_node(new_node_host, new_node_port):
     Returns:
         A tuple containing two items:
             1. A list of dictionaries representing the current network nodes.
-            2. A dictionary representing the current state of the blockchain.
+            2. A dictionary with height and hash of the last block and unconfirmed transactions; blocks
+               themselves are synchronised separately with sync_blockchain.
     """
-    serialized_node = pickle.dumps(
-        json.dumps({"host": new_node_host, "port": new_node_port})
+    msg = encode_message(
+        MSG_ADD_NODE, encode_node({"host": new_node_host, "port": new_node_port})
     )
-    msg = ADD_NODE_PREFIX + serialized_node
-    for node in nodes:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((node["host"], node["port"]))
-                s.sendall(msg)
-        except socket.error as e:
-            print(f"Error while populating new node to node {node}: {e}")
+    broadcaster.broadcast(nodes, msg, "new node")
 
     current_nodes = nodes.copy()
     current_nodes.append({"host": host, "port": port})
     nodes.append({"host": new_node_host, "port": new_node_port})
 
-    return current_nodes, blockchain.to_dict()
+    chain = blockchain.snapshot()
+    chain_summary = {
+        "height": len(chain) - 1,
+        "last_block_hash": chain.last_block.hash,
+        "unconfirmed_transactions": blockchain.unconfirmed_transactions,
+    }
+    return current_nodes, chain_summary
 
 
 def announce_new_block(block):
     """
     Contains logic for new block propagation.
 
-    The function sends new block data using socket for communicating with other nodes in network.
+    The function announces hash of the block to a random subset of nodes in network (see
+    gossip.GossipRelay) and returns without waiting for the delivery. Nodes which do not have the
+    block yet download it and announce it further.
 
     Args:
         block (Block): A Block object representing the new block to be announced.
@@ -90,68 +244,260 @@ def announce_new_block(block):
     Returns:
         None
     """
-    serialized_block_data = pickle.dumps(json.dumps(block.__dict__, sort_keys=True))
-    msg = ADD_BLOCK_PREFIX + serialized_block_data
-    for node in nodes:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((node["host"], node["port"]))
-                s.sendall(msg)
-        except socket.error as e:
-            print(f"Error while announcing block to node {node}: {e}")
+    gossip.confirmed(block.transaction_ids())
+    gossip.relay({"host": host, "port": port}, nodes, INV_BLOCK, [block.hash])
+
+
+def announce_new_transactions(tx_ids):
+    """
+    Announces IDs of transactions added to the pool of unconfirmed transactions to a random subset of
+    nodes in network, like announce_new_block.
+
+    Args:
+        tx_ids (list): IDs of the new transactions.
+
+    Returns:
+        None
+    """
+    gossip.relay({"host": host, "port": port}, nodes, INV_TRANSACTION, tx_ids)
+
+
+def is_known_item(kind, item_hash):
+    """
+    Checks if this node already has an announced block or transaction.
+
+    It is called with the gossip lock held, so only cheap lookups are made: confirmed transactions of blocks
+    this node accepted are in the seen cache (see gossip.GossipRelay.confirmed), and older ones are
+    requested and then rejected by add_new_transactions.
+    """
+    if kind == INV_BLOCK:
+        return blockchain.is_known_block(item_hash)
+    if kind == INV_TRANSACTION:
+        return item_hash in blockchain.mempool
+    raise ValueError("Invalid inventory item kind.")
+
+
+def send_items(node, items):
+    """
+    Sends requested blocks and transactions to a node; items this node does not have are skipped.
+
+    Args:
+        node (dict): A dictionary with host and port of the requesting node.
+        items (list): Requested (kind, hash) tuples.
+
+    Returns:
+        None
+    """
+    transactions = []
+    for kind, item_hash in items:
+        if kind == INV_BLOCK:
+            block = blockchain.find_block(item_hash)
+            if block is not None:
+                msg = encode_message(MSG_ADD_BLOCK, block.to_bytes())
+                broadcaster.broadcast([node], msg, "block")
+        elif kind == INV_TRANSACTION:
+            transaction = blockchain.mempool.get(item_hash)
+            if transaction is not None:
+                transactions.append(transaction)
+    if transactions:
+        msg = encode_message(MSG_ADD_TRANSACTIONS, encode_transactions(transactions))
+        broadcaster.broadcast([node], msg, "transactions")
+
+
+def add_block_and_relay(block):
+    """
+    Adds a block received from another node and announces it further if it was accepted.
+
+    Args:
+        block (Block): The received block.
 
+    Returns:
+        None
+
+    Raises:
+        ValueError: If the block is already known or invalid.
+    """
+    # The hash is the one claimed by the sender, so the block is marked seen only once it is accepted.
+    source = gossip.arrived(INV_BLOCK, block.hash)
+    status = blockchain.verify_and_add_block(block)
+    gossip.seen.add((INV_BLOCK, block.hash))
+    gossip.confirmed(block.transaction_ids())
+    if status == "orphan":
+        request_missing_blocks()
+    else:
+        gossip.relay(
+            {"host": host, "port": port},
+            nodes,
+            INV_BLOCK,
+            [block.hash],
+            exclude=[] if source is None else [source],
+        )
+
+
+def add_transactions_and_relay(transactions):
+    """
+    Adds transactions received from another node and announces the accepted ones further.
+
+    Args:
+        transactions (list): The received transactions.
+
+    Returns:
+        None
+    """
+    sources = []
+    accepted = []
+    for result in blockchain.add_new_transactions(transactions):
+        if result["tx_id"] is None:
+            continue
+        source = gossip.received(INV_TRANSACTION, result["tx_id"])
+        if source is not None and source not in sources:
+            sources.append(source)
+        if result["status"] == "accepted":
+            accepted.append(result["tx_id"])
+    gossip.relay(
+        {"host": host, "port": port}, nodes, INV_TRANSACTION, accepted, exclude=sources
+    )
+
+
+def request_missing_blocks():
+    """
+    Asks a random node in network for blocks following the local chain.
+
+    Used when an orphan block arrives: the node sends the blocks missing between the local chain and
+    the orphan, so the node catches up without a full resynchronisation. Requests are sent at most once
+    per BLOCKS_REQUEST_INTERVAL seconds.
+
+    Returns:
+        None
+    """
+    global last_blocks_request
+    now = time.monotonic()
+    if not nodes or now - last_blocks_request < BLOCKS_REQUEST_INTERVAL:
+        return
+    last_blocks_request = now
+    msg = encode_message(
+        MSG_GET_BLOCKS,
+        encode_get_blocks({"host": host, "port": port}, blockchain.block_locator()),
+    )
+    broadcaster.broadcast([random.choice(nodes)], msg, "blocks request")
+
+
+def send_blocks(node, locator):
+    """
+    Sends blocks following a block locator to a node.
+
+    Args:
+        node (dict): A dictionary with host and port of the requesting node.
+        locator (list): A block locator of the requesting node.
 
-def connection_handler(conn):
+    Returns:
+        None
     """
-    Handles incoming connections from socket.
+    for block in blockchain.blocks_after(locator, GET_BLOCKS_LIMIT):
+        msg = encode_message(MSG_ADD_BLOCK, block.to_bytes())
+        broadcaster.broadcast([node], msg, "block")
 
-    The function checks prefix of message and based on it handles properly adding new node or new block actions.
+
+def handle_message(msg_type, payload):
+    """
+    Handles a message received from another node.
+
+    The function checks type of message and based on it handles properly adding new node, new block,
+    blocks request, inventory announcement, data request or new transactions actions.
 
     Args:
-        conn (socket): A socket object representing a connection.
+        msg_type (int): Type of the message.
+        payload (bytes): Encoded message body.
 
     Returns:
     None
     """
     try:
-        data = conn.recv(1024)
-        if not data:
-            raise ValueError("Empty data received from connection.")
-        prefix = data[:1]
-        body = data[1:]
-
-        if prefix == ADD_NODE_PREFIX:
-            new_node = json.loads(pickle.loads(body))
-            nodes.append({"host": new_node["host"], "port": new_node["port"]})
-        elif prefix == ADD_BLOCK_PREFIX:
-            block_data = json.loads(pickle.loads(body))
-            blockchain.verify_and_add_block(block_data)
+        if msg_type == MSG_ADD_NODE:
+            nodes.append(decode_node(payload))
+        elif msg_type == MSG_ADD_BLOCK:
+            add_block_and_relay(Block.from_bytes(payload))
+        elif msg_type == MSG_GET_BLOCKS:
+            send_blocks(*decode_get_blocks(payload))
+        elif msg_type == MSG_INV:
+            node, items = decode_inventory(payload)
+            gossip.request_missing(
+                {"host": host, "port": port}, node, items, is_known_item
+            )
+        elif msg_type == MSG_GET_DATA:
+            send_items(*decode_inventory(payload))
+        elif msg_type == MSG_ADD_TRANSACTIONS:
+            add_transactions_and_relay(decode_transactions(payload))
         else:
-            raise ValueError("Invalid prefix.")
+            raise ValueError("Invalid message type.")
 
-    except ValueError as e:
-        print(f"Error while handling socket connection: {e}")
-    finally:
-        conn.close()
+    except Exception as e:
+        # Malformed or unencodable peer data may raise more than ValueError (struct.error, KeyError,
+        # StaleSnapshotError...); the message is dropped, not the connection.
+        print(f"Error while handling message: {type(e).__name__}: {e}")
 
 
-def start_server():
-    """Creates a  socket and listens for incoming connections.
+def start_node():
+    """
+    Starts the P2P node service.
 
-    The function binds the socket to a random port on the local host and listens for incoming connections. Once a
-    connection is established, the function spawns a new thread to handle the connection.
+    The function starts the asyncio server on a random port of the local host and stores its address
+    as the address of this node in network.
 
     Returns:
         None
     """
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind((LOCALHOST, 0))
-        global host
-        global port
-        host, port = s.getsockname()
-        s.listen()
+    global server
+    global host
+    global port
+    if server is not None:
+        return
+    server = P2PServer(handle_message, LOCALHOST, workers=INBOUND_WORKERS)
+    host, port = server.start()
 
-        while True:
-            conn, addr = s.accept()
-            thread = threading.Thread(target=connection_handler, args=(conn,))
-            thread.start()
+
+def start_miner():
+    """
+    Starts the background miner of this node.
+
+    Mined blocks are announced to other nodes in network.
+
+    Returns:
+        None
+    """
+    global miner
+    if miner is None or miner.blockchain is not blockchain:
+        if miner is not None:
+            miner.stop()
+        miner = MinerService(blockchain, announce_new_block)
+    miner.start()
+
+
+def stop_miner():
+    """Stops the background miner of this node, if it is running."""
+    if miner is not None:
+        miner.stop()
+
+
+def stop_node():
+    """
+    Stops the P2P node service.
+
+    The function stops the miner and the server, closes connections to peers, stops message delivery
+    threads, mining and signature verification worker processes and flushes persistent chain storage.
+
+    Returns:
+        None
+    """
+    global server
+    stop_miner()
+    if server is not None:
+        server.stop()
+        server = None
+    peer_manager.close_all()
+    broadcaster.close()
+    close_searchers()
+    blockchain.signature_verifier.close()
+    close_chain = getattr(blockchain.chain, "close", None)
+    if close_chain is not None:
+        close_chain()
@@ -0,0 +1,290 @@
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+CONNECT_TIMEOUT = 3.0
+SEND_TIMEOUT = 5.0
+DELIVERY_TIMEOUT = 10.0
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+def node_key(node):
+    """Returns hashable identity (host, port) of a node record."""
+    return node["host"], int(node["port"])
+
+
+class PeerConnection:
+    """
+    A class representing a long-lived outgoing connection to one peer.
+
+    The connection is opened lazily and reused for all messages sent to the peer. Messages are framed,
+    so messages of different types share one connection. After a failure the peer is not contacted
+    again until an exponentially growing backoff delay passes.
+
+    Attributes:
+        node (dict): A dictionary with host and port of the peer.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self._sock = None
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def _connect(self):
+        if time.monotonic() < self._retry_at:
+            raise ConnectionError("Peer unavailable, waiting before reconnecting")
+        self._sock = socket.create_connection(
+            node_key(self.node), timeout=CONNECT_TIMEOUT
+        )
+        self._sock.settimeout(SEND_TIMEOUT)
+
+    def _fail(self):
+        self._close_socket()
+        self._failures += 1
+        self._retry_at = time.monotonic() + min(
+            BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._failures - 1)
+        )
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def send(self, msg):
+        """
+        Sends a framed message to the peer, connecting first if needed.
+
+        A send failing on a reused connection (closed by peer in the meantime) is retried once on a new one.
+
+        Args:
+            msg (bytes): A framed message.
+
+        Returns:
+            None
+
+        Raises:
+            OSError: If the message could not be sent.
+        """
+        with self._lock:
+            reused = self._sock is not None
+            try:
+                if self._sock is None:
+                    self._connect()
+                try:
+                    self._sock.sendall(msg)
+                except OSError:
+                    if not reused:
+                        raise
+                    self._close_socket()
+                    self._connect()
+                    self._sock.sendall(msg)
+            except OSError:
+                self._fail()
+                raise
+            self._failures = 0
+
+    def close(self):
+        """Closes the connection."""
+        with self._lock:
+            self._close_socket()
+
+
+class PeerManager:
+    """
+    A class keeping one PeerConnection per peer.
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def connection(self, node):
+        """Returns connection to a peer, creating it on first use."""
+        key = node_key(node)
+        with self._lock:
+            connection = self._connections.get(key)
+            if connection is None:
+                connection = self._connections[key] = PeerConnection(node)
+            return connection
+
+    def send(self, node, msg):
+        """
+        Sends a framed message to a peer.
+
+        Args:
+            node (dict): A dictionary with host and port of the peer.
+            msg (bytes): A framed message.
+
+        Raises:
+            OSError: If the message could not be sent.
+        """
+        self.connection(node).send(msg)
+
+    def close_all(self):
+        """Closes all peer connections."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for connection in connections:
+            connection.close()
+
+
+class OrderedDispatcher:
+    """
+    Runs handlers of messages on a bounded worker pool, keeping the order of messages with the same key.
+
+    Each key (a connection or a peer) has its own queue; at most one pool task drains a given queue
+    at a time, so messages from or to one peer (for example consecutive blocks) are handled sequentially
+    while messages of different peers are handled in parallel.
+    """
+
+    def __init__(self, executor, handler):
+        self._executor = executor
+        self._handler = handler
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def dispatch(self, connection_id, message):
+        """
+        Queues a message for handling.
+
+        Args:
+            connection_id (Hashable): Identity of the connection or peer the message belongs to.
+            message (tuple): Arguments passed to the handler.
+        """
+        with self._lock:
+            queue = self._queues.get(connection_id)
+            if queue is not None:
+                queue.append(message)
+                return
+            self._queues[connection_id] = deque([message])
+        self._executor.submit(self._drain, connection_id)
+
+    def _drain(self, connection_id):
+        while True:
+            with self._lock:
+                queue = self._queues[connection_id]
+                if not queue:
+                    del self._queues[connection_id]
+                    return
+                message = queue.popleft()
+            try:
+                self._handler(*message)
+            except Exception as e:
+                print(f"Error while handling message: {e}")
+
+
+class Broadcaster:
+    """
+    Sends messages to many peers concurrently, without blocking the caller.
+
+    Messages are queued per peer and delivered on a worker pool, so a slow or dead peer delays only
+    its own messages. A message still waiting after DELIVERY_TIMEOUT seconds is dropped. Delivery
+    latency (from queueing to completed send) and errors are recorded per peer.
+
+    The worker pool is started on first use and kept until close().
+
+    Attributes:
+        workers (int): Number of threads delivering messages.
+    """
+
+    def __init__(self, peer_manager, workers):
+        self.workers = workers
+        self._peer_manager = peer_manager
+        self._executor = None
+        self._dispatcher = None
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _get_dispatcher(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                self._dispatcher = OrderedDispatcher(self._executor, self._deliver)
+            return self._dispatcher
+
+    def broadcast(self, nodes, msg, description="message"):
+        """
+        Queues a framed message for delivery to each of the nodes and returns immediately.
+
+        Args:
+            nodes (list): A list of dictionaries with host and port of peers.
+            msg (bytes): A framed message.
+            description (str): What is sent, used in error logs.
+        """
+        queued_at = time.monotonic()
+        dispatcher = self._get_dispatcher()
+        for node in nodes:
+            dispatcher.dispatch(node_key(node), (node, msg, description, queued_at))
+
+    def close(self):
+        """Stops the worker threads; messages not delivered yet are dropped."""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            self._dispatcher = None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _deliver(self, node, msg, description, queued_at):
+        if time.monotonic() - queued_at > DELIVERY_TIMEOUT:
+            self._record(node, None, "expired")
+            print(f"Dropping {description} to node {node}: delivery timeout")
+            return
+        try:
+            self._peer_manager.send(node, msg)
+        except OSError as e:
+            self._record(node, None, type(e).__name__)
+            print(f"Error while sending {description} to node {node}: {e}")
+            return
+        self._record(node, time.monotonic() - queued_at, None)
+
+    def _record(self, node, latency, error):
+        host, port = node_key(node)
+        if error is not None:
+            metrics.PEER_SEND_ERRORS.inc(peer=f"{host}:{port}", error=error)
+        else:
+            metrics.PEER_SEND_SECONDS.observe(latency, peer=f"{host}:{port}")
+        with self._stats_lock:
+            stats = self._stats.setdefault(
+                f"{host}:{port}",
+                {
+                    "sent": 0,
+                    "errors": 0,
+                    "last_error": None,
+                    "last_latency": None,
+                    "average_latency": None,
+                    "max_latency": None,
+                    "_total_latency": 0.0,
+                },
+            )
+            if error is not None:
+                stats["errors"] += 1
+                stats["last_error"] = error
+                return
+            stats["sent"] += 1
+            stats["_total_latency"] += latency
+            stats["last_latency"] = latency
+            stats["average_latency"] = stats["_total_latency"] / stats["sent"]
+            stats["max_latency"] = max(stats["max_latency"] or 0.0, latency)
+
+    def stats(self):
+        """
+        Returns delivery statistics of each peer.
+
+        Returns:
+            A dictionary mapping "host:port" to counts of sent messages and errors and latencies in seconds.
+        """
+        with self._stats_lock:
+            return {
+                peer: {k: v for k, v in stats.items() if not k.startswith("_")}
+                for peer, stats in self._stats.items()
+            }
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from wire import MESSAGE_NAMES, FrameDecoder
+
+RECV_BUFFER_SIZE = 65536
+
+
+class P2PServer:
+    """
+    A class representing the P2P node service: an asyncio server handling all peer connections on one event loop.
+
+    The event loop runs in a background thread started by start() and stopped by stop(). Each connection
+    carries any number of framed messages; messages received together are passed to the handler as one batch
+    on a bounded thread pool, one batch at a time per connection, so messages from one peer are handled in order.
+
+    Attributes:
+        host (str): Host the server listens on.
+        port (int): Port the server listens on (0 until started when a random port was requested).
+    """
+
+    def __init__(self, handler, host, port=0, workers=8):
+        self.host = host
+        self.port = port
+        self._handler = handler
+        self._workers = workers
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._executor = None
+        self._connections = set()
+        self._started = threading.Event()
+        self._start_error = None
+
+    def _handle_batch(self, peer, received_at, messages):
+        for msg_type, payload in messages:
+            # One bad message must not drop the connection and the rest of the batch.
+            try:
+                self._handler(msg_type, payload)
+            except Exception as e:
+                print(f"Error while handling message: {e}")
+            metrics.PEER_RECEIVE_SECONDS.observe(
+                time.perf_counter() - received_at,
+                peer=peer,
+                type=MESSAGE_NAMES.get(msg_type, msg_type),
+            )
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        decoder = FrameDecoder()
+        # Peers connect from ephemeral ports, so they are told apart by host only.
+        peer = (writer.get_extra_info("peername") or ("unknown",))[0]
+        try:
+            while True:
+                data = await reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    if decoder.pending:
+                        raise ValueError("Connection closed in the middle of a frame")
+                    break
+                received_at = time.perf_counter()
+                messages = decoder.feed(data)
+                if messages:
+                    await self._loop.run_in_executor(
+                        self._executor, self._handle_batch, peer, received_at, messages
+                    )
+        except (OSError, ValueError) as e:
+            metrics.PEER_RECEIVE_ERRORS.inc(peer=peer, error=type(e).__name__)
+            print(f"Error while handling socket connection: {e}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve())
+        except OSError as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    def start(self):
+        """
+        Starts the server in a background thread and waits until it listens.
+
+        Returns:
+            A tuple (host, port) the server listens on.
+
+        Raises:
+            OSError: If the server socket could not be bound.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+        return self.host, self.port
+
+    async def _shutdown(self):
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def stop(self):
+        """Stops accepting connections, closes open ones and waits for running handlers to finish."""
+        if self._thread is None:
+            return
+        if self._server is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        self._thread = None
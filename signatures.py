@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+from state import is_transfer_like
+
+SIGNATURE_FIELD = "signature"
+SIGNATURE_WORKERS = int(os.environ.get("SIGNATURE_WORKERS", os.cpu_count() or 1))
+SIGNATURE_BATCH_SIZE = 256
+VERIFIED_CACHE_SIZE = 200_000
+
+
+def signing_payload(transaction):
+    """
+    Serializes the signed part of a transaction: all its fields except the signature, in canonical JSON form.
+
+    Args:
+        transaction (dict): A dictionary containing transaction data.
+
+    Returns:
+        The payload as bytes.
+    """
+    unsigned = {k: v for k, v in transaction.items() if k != SIGNATURE_FIELD}
+    return json.dumps(unsigned, sort_keys=True, separators=(",", ":")).encode()
+
+
+def sign_transaction(transaction, private_key):
+    """
+    Signs a transaction with an Ed25519 key.
+
+    Args:
+        transaction (dict): A dictionary containing transaction data. Its sender, if any, must be the hex public key.
+        private_key (Ed25519PrivateKey): The private key of the sender.
+
+    Returns:
+        A copy of the transaction with sender set to the hex public key and the hex signature added.
+    """
+    public_key = private_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    signed = dict(transaction, sender=public_key.hex())
+    signed.pop(SIGNATURE_FIELD, None)
+    signed[SIGNATURE_FIELD] = private_key.sign(signing_payload(signed)).hex()
+    return signed
+
+
+def requires_signature(transaction):
+    """
+    Checks if a transaction has to be signed.
+
+    Transfers of value (see state.transfer_of) must be signed by their sender, whose address is the hex
+    Ed25519 public key. This covers every transaction with the fields of a transfer, including ones with
+    an invalid amount, so no such transaction passes as unsigned data. Other transactions only carry data
+    and may be unsigned, but a signature they carry is checked too.
+    """
+    return isinstance(transaction, dict) and (
+        SIGNATURE_FIELD in transaction or is_transfer_like(transaction)
+    )
+
+
+def verify_signature(transaction):
+    """
+    Verifies the signature of a transaction.
+
+    Args:
+        transaction (dict): A dictionary containing transaction data.
+
+    Returns:
+        None if the signature is valid, otherwise a string describing the problem.
+    """
+    sender = transaction.get("sender")
+    signature = transaction.get(SIGNATURE_FIELD)
+    if not isinstance(signature, str):
+        return "Missing transaction signature"
+    try:
+        public_key = Ed25519PublicKey.from_public_bytes(bytes.fromhex(sender))
+        public_key.verify(bytes.fromhex(signature), signing_payload(transaction))
+    except (TypeError, ValueError):
+        return "Malformed sender or signature"
+    except InvalidSignature:
+        return "Invalid transaction signature"
+    return None
+
+
+def _verify_batch(transactions):
+    """Verifies signatures of a batch of transactions in a worker process."""
+    return [verify_signature(transaction) for transaction in transactions]
+
+
+class SignatureVerifier:
+    """
+    A class verifying transaction signatures in batches on a pool of processes.
+
+    IDs of transactions with valid signatures are remembered in a bounded cache, so a transaction verified
+    when it entered the mempool is not verified again when it arrives in a block. A transaction ID covers
+    the signature, so a cached ID cannot stand for a transaction with a different signature.
+
+    Attributes:
+        workers (int): Number of processes; with 1, or a single batch, signatures are verified in the calling thread.
+        batch_size (int): Maximum number of transactions verified by a worker in one task.
+    """
+
+    def __init__(
+        self,
+        workers=SIGNATURE_WORKERS,
+        batch_size=SIGNATURE_BATCH_SIZE,
+        cache_size=VERIFIED_CACHE_SIZE,
+    ):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._cache_size = cache_size
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def is_verified(self, tx_id):
+        """Checks if a transaction with given ID has already been verified."""
+        with self._lock:
+            return tx_id in self._verified
+
+    def _remember(self, tx_ids):
+        with self._lock:
+            for tx_id in tx_ids:
+                self._verified[tx_id] = None
+                self._verified.move_to_end(tx_id)
+            while len(self._verified) > self._cache_size:
+                self._verified.popitem(last=False)
+
+    def verify(self, transactions, tx_ids):
+        """
+        Verifies signatures of transactions.
+
+        Args:
+            transactions (list): A list of transactions.
+            tx_ids (list): IDs of the transactions.
+
+        Returns:
+            A list with None for each transaction with valid signature (or not requiring one) and a string
+            describing the problem for each other one.
+        """
+        errors = [None] * len(transactions)
+        pending = [
+            index
+            for index, transaction in enumerate(transactions)
+            if requires_signature(transaction) and not self.is_verified(tx_ids[index])
+        ]
+        if not pending:
+            return errors
+        size = max(1, min(self.batch_size, -(-len(pending) // self.workers)))
+        batches = [pending[start : start + size] for start in range(0, len(pending), size)]
+        if self.workers <= 1 or len(batches) <= 1:
+            results = (
+                _verify_batch([transactions[index] for index in batch]) for batch in batches
+            )
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            results = self._executor.map(
+                _verify_batch,
+                [[transactions[index] for index in batch] for batch in batches],
+            )
+
+        verified = []
+        for batch, batch_errors in zip(batches, results):
+            for index, error in zip(batch, batch_errors):
+                errors[index] = error
+                if error is None:
+                    verified.append(tx_ids[index])
+        self._remember(verified)
+        return errors
+
+    def close(self):
+        """Stops the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,476 @@
+"""
+Compressed chain snapshots for bootstrapping new nodes.
+
+Usage:
+    python -m snapshot export --data-dir DIR --output chain.snapshot
+    python -m snapshot import --url http://127.0.0.1:5000/snapshot --data-dir DIR
+    python -m snapshot import --file chain.snapshot --manifest chain.snapshot.json --data-dir DIR
+"""
+import argparse
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from hashlib import sha256
+
+import requests
+
+from classes import RETARGET_WINDOW, Block, Blockchain
+from validator import ChainValidator
+
+SNAPSHOT_MAGIC = b"BCSNAP\x00\x01"
+SNAPSHOT_FILE = "chain.snapshot"
+MANIFEST_SUFFIX = ".json"
+# Snapshot files are written into version directories named with VERSION_INFIX, and the link with
+# CURRENT_SUFFIX points to the one readers use (see export_snapshot_file).
+VERSION_INFIX = ".v"
+CURRENT_SUFFIX = ".current"
+SNAPSHOT_CHUNK_BLOCKS = 1000
+SNAPSHOT_CHUNK_BYTES = 8 * 1024 * 1024
+SNAPSHOT_COMPRESSION_LEVEL = 6
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+# Chunk header: compressed length, number of blocks, height of the first block, SHA-256 of compressed data.
+# The stream ends with a header of zero length and zero blocks carrying the number of blocks and the
+# SHA-256 of all chunk hashes, so a truncated stream is detected.
+CHUNK_HEADER = struct.Struct("!IIQ32s")
+_RECORD_LENGTH = struct.Struct("!I")
+
+
+def _compress_chunk(records, start_height, count, level):
+    compressed = zlib.compress(b"".join(records), level)
+    digest = sha256(compressed).digest()
+    header = CHUNK_HEADER.pack(len(compressed), count, start_height, digest)
+    return header + compressed, digest
+
+
+def write_snapshot(
+    chain,
+    output,
+    chunk_blocks=SNAPSHOT_CHUNK_BLOCKS,
+    level=SNAPSHOT_COMPRESSION_LEVEL,
+    progress=None,
+):
+    """
+    Writes blocks of a chain as a snapshot stream.
+
+    Blocks are written in their binary wire form (see Block.to_bytes), in zlib compressed chunks of up to
+    chunk_blocks blocks or SNAPSHOT_CHUNK_BYTES bytes, each preceded by a header with its SHA-256 hash.
+    Only one chunk is held in memory at a time.
+
+    Args:
+        chain (Sequence): Blocks of the chain, e.g. a ChainSnapshot of a running node.
+        output (BinaryIO): A writable binary file object.
+        chunk_blocks (int): Maximum number of blocks in a chunk.
+        level (int): zlib compression level.
+        progress (Callable): Optional function called with the number of written blocks after each chunk.
+
+    Returns:
+        A manifest: a dictionary with the number of blocks, hash of the last block, snapshot digest and
+        height, number of blocks, size and hash of each chunk.
+    """
+    output.write(SNAPSHOT_MAGIC)
+    digests = sha256()
+    chunks = []
+    records = []
+    start_height = 0
+    size = 0
+
+    def flush(end_height):
+        data, digest = _compress_chunk(records, start_height, end_height - start_height, level)
+        output.write(data)
+        digests.update(digest)
+        chunks.append(
+            {
+                "start_height": start_height,
+                "blocks": end_height - start_height,
+                "bytes": len(data) - CHUNK_HEADER.size,
+                "sha256": digest.hex(),
+            }
+        )
+        if progress is not None:
+            progress(end_height)
+
+    length = len(chain)
+    for height in range(length):
+        data = chain[height].to_bytes()
+        records.append(_RECORD_LENGTH.pack(len(data)))
+        records.append(data)
+        size += _RECORD_LENGTH.size + len(data)
+        if height + 1 - start_height >= chunk_blocks or size >= SNAPSHOT_CHUNK_BYTES:
+            flush(height + 1)
+            records, start_height, size = [], height + 1, 0
+    if records:
+        flush(length)
+    output.write(CHUNK_HEADER.pack(0, 0, length, digests.digest()))
+    return {
+        "blocks": length,
+        "tip_hash": chain[length - 1].hash if length else None,
+        "digest": digests.hexdigest(),
+        "chunks": chunks,
+    }
+
+
+def _read_exact(stream, size):
+    parts = []
+    while size:
+        data = stream.read(min(size, READ_SIZE))
+        if not data:
+            raise ValueError("Snapshot truncated")
+        parts.append(data)
+        size -= len(data)
+    return b"".join(parts)
+
+
+def _decode_chunk(compressed, count, start_height):
+    decompressor = zlib.decompressobj()
+    try:
+        raw = decompressor.decompress(compressed, MAX_CHUNK_SIZE)
+    except zlib.error as e:
+        raise ValueError(f"Snapshot chunk corrupted at height {start_height}: {e}")
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError(f"Snapshot chunk too large or incomplete at height {start_height}")
+    blocks = []
+    offset = 0
+    while offset < len(raw):
+        if offset + _RECORD_LENGTH.size > len(raw):
+            raise ValueError(f"Snapshot chunk malformed at height {start_height}")
+        (length,) = _RECORD_LENGTH.unpack_from(raw, offset)
+        offset += _RECORD_LENGTH.size
+        if offset + length > len(raw):
+            raise ValueError(f"Snapshot chunk malformed at height {start_height}")
+        blocks.append(Block.from_bytes(raw[offset : offset + length]))
+        offset += length
+    if len(blocks) != count:
+        raise ValueError(f"Snapshot chunk block count mismatch at height {start_height}")
+    return blocks
+
+
+def read_snapshot(stream, manifest=None):
+    """
+    Reads a snapshot stream chunk by chunk, verifying each chunk before decoding it.
+
+    Args:
+        stream (BinaryIO): A readable binary file object, e.g. an open file or a raw HTTP response.
+        manifest (dict): Optional trusted manifest (see write_snapshot); chunk hashes must then match it.
+
+    Yields:
+        Tuples (height of the first block, list of Blocks), one per chunk.
+
+    Raises:
+        ValueError: If the stream is not a snapshot, is truncated or corrupted, or does not match the manifest.
+    """
+    if _read_exact(stream, len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+        raise ValueError("Not a chain snapshot or unsupported snapshot version")
+    expected_chunks = None if manifest is None else manifest["chunks"]
+    digests = sha256()
+    height = 0
+    index = 0
+    while True:
+        length, count, start_height, digest = CHUNK_HEADER.unpack(
+            _read_exact(stream, CHUNK_HEADER.size)
+        )
+        if length == 0 and count == 0:
+            if start_height != height or digest != digests.digest():
+                raise ValueError("Snapshot digest mismatch")
+            if expected_chunks is not None and index != len(expected_chunks):
+                raise ValueError("Snapshot has fewer chunks than its manifest")
+            return
+        if start_height != height or not count or length > MAX_CHUNK_SIZE:
+            raise ValueError(f"Snapshot chunk header invalid at height {height}")
+        compressed = _read_exact(stream, length)
+        if sha256(compressed).digest() != digest:
+            raise ValueError(f"Snapshot chunk hash mismatch at height {start_height}")
+        if expected_chunks is not None:
+            if index >= len(expected_chunks) or expected_chunks[index]["sha256"] != digest.hex():
+                raise ValueError(f"Snapshot chunk does not match manifest at height {start_height}")
+        digests.update(digest)
+        yield start_height, _decode_chunk(compressed, count, start_height)
+        height += count
+        index += 1
+
+
+def import_snapshot(stream, chain=None, validator=None, manifest=None, progress=None):
+    """
+    Builds a blockchain from a snapshot stream with bounded memory.
+
+    Chunks are verified against their hashes (and the manifest, if given) as they arrive, their blocks are
+    validated like a chain received from a peer (links, checkpoints, difficulty, proofs of work and
+    signatures) and appended to the chain right away, so only one chunk is held in memory.
+
+    Args:
+        stream (BinaryIO): A readable binary file object with the snapshot.
+        chain (list): An empty list-like container to which blocks are added, e.g. a StoredChain (default a new list).
+        validator (validator.ChainValidator): Validator of the blocks (default one with no checkpoints).
+        manifest (dict): Optional trusted manifest of the snapshot.
+        progress (Callable): Optional function called with the number of imported blocks after each chunk.
+
+    Returns:
+        A new Blockchain instance.
+
+    Raises:
+        ValueError: If the snapshot is invalid or the chain is not empty.
+    """
+    chain = [] if chain is None else chain
+    if len(chain):
+        raise ValueError("Snapshot can only be imported into an empty chain")
+    own_validator = validator is None
+    if own_validator:
+        validator = ChainValidator()
+    recent_blocks = deque(maxlen=RETARGET_WINDOW)
+    previous_hash = None
+    try:
+        for start_height, blocks in read_snapshot(stream, manifest):
+            validator.validate(blocks, start_height, previous_hash, list(recent_blocks))
+            for block in blocks:
+                chain.append(block)
+            # The genesis block is not part of the retarget window (see Blockchain.next_difficulty).
+            recent_blocks.extend(blocks[1:] if start_height == 0 else blocks)
+            previous_hash = blocks[-1].hash
+            if progress is not None:
+                progress(len(chain))
+    finally:
+        if own_validator:
+            validator.close()
+    if not len(chain):
+        raise ValueError("Snapshot has no blocks")
+    return Blockchain(chain=chain)
+
+
+def manifest_path(snapshot_path):
+    """Returns path of the manifest written next to a snapshot file."""
+    return snapshot_path + MANIFEST_SUFFIX
+
+
+def _replace_link(target, link):
+    """Points a symbolic link to target, replacing whatever is at link with a single rename."""
+    temporary = f"{link}.{os.getpid()}.tmp"
+    if os.path.lexists(temporary):
+        os.remove(temporary)
+    os.symlink(target, temporary)
+    os.replace(temporary, link)
+
+
+def export_snapshot_file(chain, path, chunk_blocks=SNAPSHOT_CHUNK_BLOCKS, progress=None):
+    """
+    Writes a snapshot file and its manifest atomically: readers see either the previous files or the new ones.
+
+    Both files are written into a new version directory next to path, and one rename of the link
+    path + CURRENT_SUFFIX switches to it. path and manifest_path(path) are links through that one, so
+    they always belong to the same snapshot. The previous version directory is removed afterwards;
+    readers which already opened its files keep reading them.
+
+    Args:
+        chain (Sequence): Blocks of the chain.
+        path (str): Path of the snapshot file; the manifest is written to manifest_path(path).
+        chunk_blocks (int): Maximum number of blocks in a chunk.
+        progress (Callable): Optional function called with the number of written blocks after each chunk.
+
+    Returns:
+        The manifest, with the creation time added.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    name = os.path.basename(path)
+    manifest_name = os.path.basename(manifest_path(path))
+    version = tempfile.mkdtemp(prefix=name + VERSION_INFIX, dir=directory or ".")
+    try:
+        with open(os.path.join(version, name), "wb") as output:
+            manifest = write_snapshot(chain, output, chunk_blocks, progress=progress)
+            output.flush()
+            os.fsync(output.fileno())
+        manifest["created"] = time.time()
+        with open(os.path.join(version, manifest_name), "w") as output:
+            json.dump(manifest, output)
+            output.flush()
+            os.fsync(output.fileno())
+    except BaseException:
+        shutil.rmtree(version, ignore_errors=True)
+        raise
+
+    current = path + CURRENT_SUFFIX
+    previous = os.readlink(current) if os.path.islink(current) else None
+    # Links are relative, so the snapshot directory can be moved.
+    _replace_link(os.path.basename(version), current)
+    for link, file_name in ((path, name), (manifest_path(path), manifest_name)):
+        target = os.path.join(os.path.basename(current), file_name)
+        if not os.path.islink(link) or os.readlink(link) != target:
+            _replace_link(target, link)
+    if previous is not None and previous != os.path.basename(version):
+        shutil.rmtree(os.path.join(directory, previous), ignore_errors=True)
+    return manifest
+
+
+class SnapshotProducer:
+    """
+    A class producing snapshots of the chain of a running node in a background thread.
+
+    The snapshot is written from an immutable ChainSnapshot, so the node keeps accepting blocks meanwhile.
+    The last complete snapshot stays available until a new one replaces it.
+
+    Attributes:
+        path (str): Path of the snapshot file.
+    """
+
+    def __init__(self, path, chunk_blocks=SNAPSHOT_CHUNK_BLOCKS):
+        self.path = path
+        self.chunk_blocks = chunk_blocks
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = {"running": False, "blocks_written": 0, "blocks": 0, "error": None}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, chain):
+        """
+        Starts writing a snapshot of a chain in the background.
+
+        Args:
+            chain (ChainSnapshot): The chain snapshot to write.
+
+        Raises:
+            ValueError: If a snapshot is already being produced.
+        """
+        with self._lock:
+            if self.running:
+                raise ValueError("Snapshot already in progress")
+            self._status = {
+                "running": True,
+                "blocks_written": 0,
+                "blocks": len(chain),
+                "error": None,
+            }
+            self._thread = threading.Thread(target=self._run, args=(chain,), daemon=True)
+            self._thread.start()
+
+    def _progress(self, blocks_written):
+        with self._lock:
+            self._status["blocks_written"] = blocks_written
+
+    def _run(self, chain):
+        error = None
+        try:
+            export_snapshot_file(chain, self.path, self.chunk_blocks, self._progress)
+        except Exception as e:
+            # Any failure has to end up in the status, or the snapshot would look running forever.
+            error = f"{type(e).__name__}: {e}"
+            print(f"Error while producing snapshot: {error}")
+        with self._lock:
+            self._status["running"] = False
+            self._status["error"] = error
+
+    def join(self):
+        """Waits until the snapshot being produced is complete."""
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def manifest(self):
+        """Returns the manifest of the last complete snapshot, or None if there is none."""
+        try:
+            with open(manifest_path(self.path)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return None
+
+    def status(self):
+        """
+        Returns the state of snapshot production.
+
+        Returns:
+            A dictionary telling whether a snapshot is being produced, how many of its blocks are written,
+            the error of the last attempt, if any, and the number of blocks, last block hash, digest and
+            creation time of the last complete snapshot.
+        """
+        with self._lock:
+            status = dict(self._status)
+        manifest = self.manifest()
+        status["last_snapshot"] = (
+            None
+            if manifest is None
+            else {key: manifest[key] for key in ("blocks", "tip_hash", "digest", "created")}
+        )
+        return status
+
+
+def _open_source(location):
+    """Opens a snapshot or manifest from a file path or an HTTP URL as a binary stream."""
+    if location.startswith(("http://", "https://")):
+        response = requests.get(location, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return response.raw
+    return open(location, "rb")
+
+
+def main():
+    from storage import open_chain
+
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write a snapshot of a stored chain")
+    export_parser.add_argument("--data-dir", required=True)
+    export_parser.add_argument("--output", required=True)
+    export_parser.add_argument("--chunk-blocks", type=int, default=SNAPSHOT_CHUNK_BLOCKS)
+    import_parser = commands.add_parser("import", help="build a stored chain from a snapshot")
+    source = import_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file")
+    source.add_argument("--url")
+    import_parser.add_argument("--manifest", help="trusted manifest, a file path or URL")
+    import_parser.add_argument("--data-dir", required=True)
+    import_parser.add_argument("--reset", action="store_true", help="drop blocks already stored")
+    import_parser.add_argument(
+        "--checkpoints",
+        default=os.environ.get("BLOCKCHAIN_CHECKPOINTS", "{}"),
+        help='JSON object mapping heights to trusted block hashes, e.g. {"1000": "00ab..."}',
+    )
+    args = parser.parse_args()
+
+    chain = open_chain(args.data_dir, reset=getattr(args, "reset", False))
+    started = time.perf_counter()
+    try:
+        if args.command == "export":
+            manifest = export_snapshot_file(
+                chain,
+                args.output,
+                args.chunk_blocks,
+                progress=lambda blocks: print(f"Exported {blocks} blocks"),
+            )
+            print(f"Snapshot digest {manifest['digest']}")
+        else:
+            manifest = None
+            if args.manifest:
+                with _open_source(args.manifest) as manifest_file:
+                    manifest = json.loads(manifest_file.read())
+            checkpoints = {
+                int(height): block_hash
+                for height, block_hash in json.loads(args.checkpoints).items()
+            }
+            with _open_source(args.file or args.url) as stream, ChainValidator(
+                checkpoints
+            ) as validator:
+                import_snapshot(
+                    stream,
+                    chain,
+                    validator,
+                    manifest,
+                    progress=lambda blocks: print(f"Imported {blocks} blocks"),
+                )
+    finally:
+        chain.close()
+    print(f"Done in {time.perf_counter() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
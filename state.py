@@ -0,0 +1,137 @@
+import math
+import threading
+
+TRANSFER_FIELDS = ("sender", "recipient", "amount")
+
+
+def is_valid_amount(amount):
+    """Checks if a value can be the amount of a transfer: a finite positive number."""
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+        return False
+    return amount > 0 and (isinstance(amount, int) or math.isfinite(amount))
+
+
+def is_transfer_like(transaction):
+    """Checks if a transaction has all fields of a transfer, whether or not they are valid."""
+    return isinstance(transaction, dict) and all(
+        field in transaction for field in TRANSFER_FIELDS
+    )
+
+
+def transfer_of(transaction):
+    """
+    Reads a value transfer from a transaction.
+
+    Transactions have no fixed schema; a transaction moves value when it has string "sender" and
+    "recipient" fields and a finite positive numeric "amount" field.
+
+    Args:
+        transaction (dict): A dictionary containing transaction data.
+
+    Returns:
+        A tuple (sender, recipient, amount), or None if the transaction is not a transfer.
+    """
+    if not isinstance(transaction, dict):
+        return None
+    sender = transaction.get("sender")
+    recipient = transaction.get("recipient")
+    amount = transaction.get("amount")
+    if (
+        not isinstance(sender, str)
+        or not isinstance(recipient, str)
+        or not is_valid_amount(amount)
+    ):
+        return None
+    return sender, recipient, amount
+
+
+class StateIndex:
+    """
+    A class representing state derived from the chain: where each transaction is and balance of each address.
+
+    The index is updated block by block: connect_block applies a block appended to the chain and
+    disconnect_block reverts a block removed from it by a reorganization, so the state never has to be
+    rebuilt by walking the chain.
+
+    Attributes:
+        height (int): Height of the last connected block, -1 if no block is connected.
+    """
+
+    def __init__(self):
+        self.height = -1
+        self._locations = {}
+        self._balances = {}
+        self._lock = threading.Lock()
+
+    def connect_block(self, block, height):
+        """
+        Applies a block appended to the chain.
+
+        Args:
+            block (Block): The appended block.
+            height (int): Height of the block.
+        """
+        transactions = block.transactions
+        with self._lock:
+            for position, (tx_id, transaction) in enumerate(
+                zip(block.transaction_ids(), transactions)
+            ):
+                self._locations[tx_id] = (height, position)
+                self._apply(transaction, 1)
+            self.height = height
+
+    def disconnect_block(self, block, height):
+        """
+        Reverts a block removed from the top of the chain.
+
+        Args:
+            block (Block): The removed block.
+            height (int): Height the block had.
+        """
+        transactions = block.transactions
+        with self._lock:
+            for position, (tx_id, transaction) in enumerate(
+                zip(block.transaction_ids(), transactions)
+            ):
+                if self._locations.get(tx_id) == (height, position):
+                    del self._locations[tx_id]
+                self._apply(transaction, -1)
+            self.height = height - 1
+
+    def _apply(self, transaction, direction):
+        transfer = transfer_of(transaction)
+        if transfer is None:
+            return
+        sender, recipient, amount = transfer
+        for address, change in ((sender, -amount), (recipient, amount)):
+            balance = self._balances.get(address, 0) + change * direction
+            if balance:
+                self._balances[address] = balance
+            else:
+                self._balances.pop(address, None)
+
+    def location(self, tx_id):
+        """
+        Finds where a transaction is in the chain.
+
+        Args:
+            tx_id (str): The transaction ID.
+
+        Returns:
+            A tuple (block height, position in block), or None if the transaction is not in the chain.
+        """
+        with self._lock:
+            return self._locations.get(tx_id)
+
+    def balance(self, address):
+        """
+        Returns balance of an address: amounts received minus amounts sent in transactions of the chain.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            A tuple (balance, height of the last block it includes).
+        """
+        with self._lock:
+            return self._balances.get(address, 0), self.height
@@ -0,0 +1,393 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from classes import Block
+
+SEGMENT_FILE = "blocks.dat"
+INDEX_FILE = "blocks.idx"
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+FSYNC_INTERVAL_SECONDS = 1.0
+
+# Segment record: payload length, CRC32 of payload, payload (binary block, or JSON in stores written by older versions).
+RECORD_HEADER = struct.Struct("!II")
+# Index record: raw block hash, offset of segment record, length of payload.
+INDEX_RECORD = struct.Struct("!32sQI")
+
+BLOCK_CACHE_SIZE = 1024
+
+
+def _decode_block(payload):
+    """Decodes a segment record payload, binary or JSON (written by older versions)."""
+    if payload.startswith(b"{"):
+        return Block.from_dict(json.loads(payload))
+    return Block.from_bytes(payload)
+
+
+class BlockStore:
+    """
+    A class representing an append-only on-disk store of serialized blocks.
+
+    Blocks are appended to a segment file as CRC protected records. The index file holds one fixed size
+    record per block in height order, so a block at given height is found by a single index read. Index
+    existing at open is memory-mapped and never parsed as a whole, lookup by hash builds its dictionary
+    lazily on first use.
+
+    Attributes:
+        directory (str): Directory holding the segment and index files.
+        fsync_policy (str): One of "always" (fsync on every append), "interval" (fsync at most once per
+            FSYNC_INTERVAL_SECONDS) or "never" (leave flushing to the operating system).
+    """
+
+    def __init__(self, directory, fsync_policy=FSYNC_INTERVAL):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync_policy}")
+        self.directory = directory
+        self.fsync_policy = fsync_policy
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._segment = open(os.path.join(directory, SEGMENT_FILE), "a+b")
+        self._index = open(os.path.join(directory, INDEX_FILE), "a+b")
+        self._last_fsync = time.monotonic()
+        self._recover()
+        self._map_index()
+
+    def __len__(self):
+        return self._mapped_count + len(self._appended)
+
+    def _recover(self):
+        """
+        Brings segment and index files to a consistent state after an unclean shutdown.
+
+        A partially written index record is cut off, index records pointing to missing or corrupted
+        segment records are dropped, complete segment records missing from the index are indexed again,
+        and a torn record at the end of the segment is truncated.
+        """
+        index_size = os.fstat(self._index.fileno()).st_size
+        index_size -= index_size % INDEX_RECORD.size
+        segment_size = os.fstat(self._segment.fileno()).st_size
+
+        valid_end = 0
+        while index_size:
+            _, offset, length = self._read_index_record(
+                index_size // INDEX_RECORD.size - 1
+            )
+            if self._read_record(offset, segment_size) is not None:
+                valid_end = offset + RECORD_HEADER.size + length
+                break
+            index_size -= INDEX_RECORD.size
+        self._index.truncate(index_size)
+
+        offset = valid_end
+        while True:
+            payload = self._read_record(offset, segment_size)
+            if payload is None:
+                break
+            block_hash = _decode_block(payload).hash
+            self._index.write(
+                INDEX_RECORD.pack(bytes.fromhex(block_hash), offset, len(payload))
+            )
+            offset += RECORD_HEADER.size + len(payload)
+        if offset != segment_size:
+            print(f"Truncating torn block store tail at offset {offset}")
+            self._segment.truncate(offset)
+        self._sync(force=True)
+
+    def _map_index(self):
+        """Memory-maps the current index file."""
+        index_size = os.fstat(self._index.fileno()).st_size
+        self._mapped_count = index_size // INDEX_RECORD.size
+        self._mmap = (
+            mmap.mmap(self._index.fileno(), index_size, access=mmap.ACCESS_READ)
+            if index_size
+            else None
+        )
+        self._appended = []
+        self._hash_index = None
+
+    def _read_index_record(self, height):
+        data = os.pread(
+            self._index.fileno(), INDEX_RECORD.size, height * INDEX_RECORD.size
+        )
+        return INDEX_RECORD.unpack(data)
+
+    def _read_record(self, offset, segment_size):
+        """
+        Reads segment record at given offset.
+
+        Returns:
+            Record payload, or None if the record is incomplete or its checksum does not match.
+        """
+        if offset + RECORD_HEADER.size > segment_size:
+            return None
+        length, checksum = RECORD_HEADER.unpack(
+            os.pread(self._segment.fileno(), RECORD_HEADER.size, offset)
+        )
+        if offset + RECORD_HEADER.size + length > segment_size:
+            return None
+        payload = os.pread(self._segment.fileno(), length, offset + RECORD_HEADER.size)
+        if zlib.crc32(payload) != checksum:
+            return None
+        return payload
+
+    def _entry(self, height):
+        if height < self._mapped_count:
+            start = height * INDEX_RECORD.size
+            return INDEX_RECORD.unpack_from(self._mmap, start)
+        return self._appended[height - self._mapped_count]
+
+    def _sync(self, force=False):
+        self._segment.flush()
+        self._index.flush()
+        now = time.monotonic()
+        if (
+            force
+            or self.fsync_policy == FSYNC_ALWAYS
+            or (
+                self.fsync_policy == FSYNC_INTERVAL
+                and now - self._last_fsync >= FSYNC_INTERVAL_SECONDS
+            )
+        ):
+            os.fsync(self._segment.fileno())
+            os.fsync(self._index.fileno())
+            self._last_fsync = now
+
+    def append(self, block):
+        """
+        Appends a block to the store.
+
+        The block is stored in its cached binary form (Block.to_bytes). The segment record is written
+        before the index record, so a crash between them leaves a record which is indexed again on next open.
+
+        Args:
+            block (Block): The block to store.
+
+        Returns:
+            Height of the stored block.
+        """
+        payload = block.to_bytes()
+        raw_hash = bytes.fromhex(block.hash)
+        with self._lock:
+            self._segment.seek(0, os.SEEK_END)
+            offset = self._segment.tell()
+            self._segment.write(
+                RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+            )
+            entry = (raw_hash, offset, len(payload))
+            self._index.write(INDEX_RECORD.pack(*entry))
+            self._sync()
+            self._appended.append(entry)
+            if self._hash_index is not None:
+                self._hash_index[raw_hash] = len(self) - 1
+            return len(self) - 1
+
+    def read(self, height):
+        """
+        Reads the block stored at given height.
+
+        Args:
+            height (int): Height of the block.
+
+        Returns:
+            A Block object.
+        """
+        with self._lock:
+            _, offset, length = self._entry(height)
+        payload = os.pread(self._segment.fileno(), length, offset + RECORD_HEADER.size)
+        return _decode_block(payload)
+
+    def height_of(self, block_hash):
+        """
+        Finds height of a stored block by its hash.
+
+        Args:
+            block_hash (str): The hash of the block.
+
+        Returns:
+            Height of the block, or None if the block is not stored.
+        """
+        with self._lock:
+            if self._hash_index is None:
+                self._hash_index = {}
+                if self._mmap is not None:
+                    for height, (raw_hash, _, _) in enumerate(
+                        INDEX_RECORD.iter_unpack(self._mmap)
+                    ):
+                        self._hash_index[raw_hash] = height
+                for height, (raw_hash, _, _) in enumerate(
+                    self._appended, self._mapped_count
+                ):
+                    self._hash_index[raw_hash] = height
+        try:
+            return self._hash_index.get(bytes.fromhex(block_hash))
+        except ValueError:
+            return None
+
+    def truncate(self, height):
+        """
+        Drops blocks at given height and above.
+
+        This is the only operation which shortens the files, it is used when the stored chain is replaced
+        or reorganized to another branch.
+
+        Args:
+            height (int): Height of the first block to drop.
+        """
+        with self._lock:
+            if height >= len(self):
+                return
+            _, offset, _ = self._entry(height)
+            hash_index = self._hash_index
+            if hash_index is not None:
+                for dropped in range(height, len(self)):
+                    del hash_index[self._entry(dropped)[0]]
+            if self._mmap is not None:
+                self._mmap.close()
+            self._index.truncate(height * INDEX_RECORD.size)
+            self._segment.truncate(offset)
+            self._sync(force=True)
+            self._map_index()
+            self._hash_index = hash_index
+
+    def close(self):
+        """Flushes and closes store files."""
+        with self._lock:
+            self._sync(force=True)
+            if self._mmap is not None:
+                self._mmap.close()
+            self._segment.close()
+            self._index.close()
+
+
+class StoredChain:
+    """
+    A list-like view of blocks kept in a BlockStore, usable as Blockchain.chain.
+
+    Blocks are deserialized on access and a bounded number of recently used ones is cached.
+
+    Truncation overwrites heights in place, so the chain counts truncations in a generation number, odd
+    while a truncation is in progress, and remembers the truncated heights. A ChainSnapshot records the
+    generation it was taken at and uses truncated_since() to detect blocks replaced after it.
+
+    Attributes:
+        store (BlockStore): The underlying block store.
+        generation (int): Incremented at the start and at the end of every truncation.
+    """
+
+    def __init__(self, store, cache_size=BLOCK_CACHE_SIZE):
+        self.store = store
+        self.generation = 0
+        self._truncations = []
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("Block index out of range")
+        with self._cache_lock:
+            generation = self.generation
+            block = self._cache.get(index)
+            if block is not None:
+                self._cache.move_to_end(index)
+                return block
+        block = self.store.read(index)
+        self._remember(index, block, generation)
+        return block
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __reversed__(self):
+        for index in range(len(self) - 1, -1, -1):
+            yield self[index]
+
+    def _remember(self, index, block, generation=None):
+        with self._cache_lock:
+            # A block read while the chain was being truncated may be a replaced one.
+            if generation is not None and (generation % 2 or generation != self.generation):
+                return
+            self._cache[index] = block
+            self._cache.move_to_end(index)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def append(self, block):
+        """Persists a block at the end of the chain."""
+        index = self.store.append(block)
+        self._remember(index, block)
+
+    def index_of(self, block_hash):
+        """Returns height of the block with given hash, or None if it is not in the chain."""
+        return self.store.height_of(block_hash)
+
+    def close(self):
+        """Closes the underlying block store."""
+        self.store.close()
+
+    def truncate(self, height):
+        """Removes blocks at given height and above."""
+        with self._cache_lock:
+            self.generation += 1
+            self._truncations.append((self.generation, height))
+            self._cache.clear()
+        try:
+            self.store.truncate(height)
+        finally:
+            with self._cache_lock:
+                self.generation += 1
+                self._cache.clear()
+
+    def truncated_since(self, generation):
+        """
+        Finds the lowest height truncated after a given generation.
+
+        Args:
+            generation (int): A generation number read from the chain.
+
+        Returns:
+            The lowest truncated height, or None if the chain was not truncated since.
+        """
+        lowest = None
+        with self._cache_lock:
+            for truncation_generation, height in reversed(self._truncations):
+                if truncation_generation <= generation:
+                    break
+                lowest = height if lowest is None else min(lowest, height)
+        return lowest
+
+
+def open_chain(directory, fsync_policy=FSYNC_INTERVAL, reset=False):
+    """
+    Opens a persistent chain stored in a directory.
+
+    Args:
+        directory (str): Directory holding the block store files.
+        fsync_policy (str): Fsync policy of the block store.
+        reset (bool): A flag (default False) indicating whether stored blocks should be dropped.
+
+    Returns:
+        A StoredChain instance.
+    """
+    chain = StoredChain(BlockStore(directory, fsync_policy))
+    if reset:
+        chain.truncate(0)
+    return chain
@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from classes import Block, Mempool, is_valid_nonce, target_of
+from merkle import MerkleTree
+
+MAX_ISSUED_WORK = 256
+
+
+class BlockTemplate:
+    """
+    A class keeping the candidate for the next block of a blockchain precomputed.
+
+    The template holds the transactions of the candidate as their canonical compact JSON (the form in which
+    blocks keep them, see Block) together with the Merkle tree over their IDs. It is updated incrementally:
+    a transaction accepted to the mempool is appended to the tree, or replaces the lowest priority template
+    transaction when the template is full and it pays more. When a new block becomes the last block of the
+    chain, the next access compares the template with the highest priority mempool transactions and only
+    removes and adds the difference. Each change rehashes O(log n) tree nodes, so a candidate never needs
+    its transactions serialized or hashed again.
+
+    Mining jobs take candidates with candidate(). External miners take work with get_work(): the header
+    prefix of a candidate (see Block.header_prefix) and the target its hash must not exceed; they return
+    nonces with submit_work().
+
+    Attributes:
+        blockchain (Blockchain): The blockchain whose next block is prepared.
+        max_transactions (int): Maximum number of transactions in a candidate.
+    """
+
+    def __init__(self, blockchain, max_transactions):
+        self.blockchain = blockchain
+        self.max_transactions = max_transactions
+        self._tx_ids = []
+        self._encoded = []
+        self._positions = {}
+        self._priorities = {}
+        # Min-heap of (fee, -sequence, tx ID), so the newest of the lowest paying transactions is
+        # replaced first, as in the mempool; entries of removed transactions are skipped lazily.
+        self._replace_heap = []
+        self._sequence = itertools.count()
+        self._tree = MerkleTree([])
+        self._previous_hash = None
+        self._height = None
+        self._difficulty = None
+        self._work = OrderedDict()
+        self._work_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tx_ids)
+
+    def _is_stale(self):
+        return self._previous_hash != self.blockchain.snapshot().last_block.hash
+
+    def _refresh(self):
+        """Moves the template on top of the last block. Must be called with the lock held."""
+        if not self._is_stale():
+            return
+        chain, difficulty = self.blockchain.mining_tip()
+        selected = self.blockchain.mempool.select(self.max_transactions)
+        wanted = {tx_id for tx_id, _ in selected}
+        for tx_id in [tx_id for tx_id in self._tx_ids if tx_id not in wanted]:
+            self._remove(tx_id)
+        for tx_id, transaction in selected:
+            if tx_id not in self._positions:
+                self._append(tx_id, transaction)
+        self._previous_hash = chain.last_block.hash
+        self._height = len(chain)
+        self._difficulty = difficulty
+        self._work.clear()
+
+    def _append(self, tx_id, transaction):
+        self._positions[tx_id] = len(self._tx_ids)
+        self._tx_ids.append(tx_id)
+        self._encoded.append(self._encode(transaction))
+        self._tree.append(tx_id)
+        self._push_priority(tx_id, transaction)
+
+    def _replace(self, index, tx_id, transaction):
+        del self._positions[self._tx_ids[index]]
+        del self._priorities[self._tx_ids[index]]
+        self._positions[tx_id] = index
+        self._tx_ids[index] = tx_id
+        self._encoded[index] = self._encode(transaction)
+        self._tree.update(index, tx_id)
+        self._push_priority(tx_id, transaction)
+
+    def _remove(self, tx_id):
+        # The last transaction takes the place of the removed one, so only two tree paths change.
+        index = self._positions.pop(tx_id)
+        del self._priorities[tx_id]
+        last_id = self._tx_ids.pop()
+        last_encoded = self._encoded.pop()
+        self._tree.pop()
+        if last_id != tx_id:
+            self._positions[last_id] = index
+            self._tx_ids[index] = last_id
+            self._encoded[index] = last_encoded
+            self._tree.update(index, last_id)
+
+    def _push_priority(self, tx_id, transaction):
+        priority = (Mempool._fee(transaction), -next(self._sequence))
+        self._priorities[tx_id] = priority
+        heapq.heappush(self._replace_heap, priority + (tx_id,))
+        if len(self._replace_heap) > 2 * len(self._priorities) + 64:
+            self._replace_heap = [
+                priority + (tx_id,) for tx_id, priority in self._priorities.items()
+            ]
+            heapq.heapify(self._replace_heap)
+
+    def _lowest_priority(self):
+        while self._replace_heap:
+            fee, negative_sequence, tx_id = self._replace_heap[0]
+            if self._priorities.get(tx_id) == (fee, negative_sequence):
+                return self._replace_heap[0]
+            heapq.heappop(self._replace_heap)
+        return None
+
+    @staticmethod
+    def _encode(transaction):
+        """Serializes a transaction as one element of wire.encode_transactions output."""
+        return json.dumps(transaction, sort_keys=True, separators=(",", ":")).encode()
+
+    def invalidate(self):
+        """Makes the next access rebuild the difference between the template and the mempool."""
+        with self._lock:
+            self._previous_hash = None
+
+    def add_transactions(self, transactions):
+        """
+        Updates the template with transactions accepted to the mempool.
+
+        Args:
+            transactions (list): A list of (transaction ID, transaction) tuples.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._is_stale():
+                # The next access rebuilds the difference from the mempool, including these transactions.
+                return
+            for tx_id, transaction in transactions:
+                if tx_id in self._positions:
+                    continue
+                if len(self._tx_ids) < self.max_transactions:
+                    self._append(tx_id, transaction)
+                    continue
+                lowest = self._lowest_priority()
+                if lowest is not None and Mempool._fee(transaction) > lowest[0]:
+                    self._replace(self._positions[lowest[2]], tx_id, transaction)
+
+    def _block(self, encoded, timestamp, merkle_root):
+        return Block.from_transactions_json(
+            b"[" + b",".join(encoded) + b"]",
+            timestamp=timestamp,
+            previous_hash=self._previous_hash,
+            merkle_root=merkle_root,
+            difficulty=self._difficulty,
+        )
+
+    def candidate(self):
+        """
+        Builds a new block on top of the last block from the template.
+
+        Returns:
+            A tuple of the block without proof of work and a list of IDs of its transactions.
+        """
+        with self._lock:
+            self._refresh()
+            block = self._block(self._encoded, time.time(), self._tree.root)
+            return block, list(self._tx_ids)
+
+    def get_work(self):
+        """
+        Issues work for an external miner.
+
+        Every work item has its own timestamp, so miners asking for work concurrently search different
+        header prefixes. The miner searches for a nonce for which SHA-256 of the header prefix followed by
+        the nonce in decimal ASCII digits does not exceed the target (see hash_header); at most
+        MAX_ISSUED_WORK recent work items are kept, and all are dropped when a new block arrives.
+
+        Returns:
+            A dictionary with "work_id", "header_prefix" (hex), "target" (hex), "difficulty",
+            "previous_hash", "height" of the block and number of its "transactions".
+        """
+        with self._lock:
+            self._refresh()
+            work_id = format(next(self._work_ids), "x")
+            timestamp = time.time()
+            # The encoded transactions list is copied, not joined, so issuing work stays cheap.
+            self._work[work_id] = (list(self._encoded), timestamp, self._tree.root)
+            if len(self._work) > MAX_ISSUED_WORK:
+                self._work.popitem(last=False)
+            header = self._block((), timestamp, self._tree.root)
+            return {
+                "work_id": work_id,
+                "header_prefix": header.header_prefix().hex(),
+                "target": target_of(self._difficulty).hex(),
+                "difficulty": self._difficulty,
+                "previous_hash": self._previous_hash,
+                "height": self._height,
+                "transactions": len(self._tx_ids),
+            }
+
+    def submit_work(self, work_id, nonce):
+        """
+        Completes work issued by get_work with a nonce found by an external miner and adds the block.
+
+        Args:
+            work_id (str): ID of the work item.
+            nonce (int): The found nonce.
+
+        Returns:
+            The new block.
+
+        Raises:
+            ValueError: If the work is unknown or stale, because a new block arrived since it was issued.
+            ValueError: If the nonce does not give a hash satisfying the difficulty.
+            ValueError: If the block cannot be added to the blockchain.
+        """
+        if not is_valid_nonce(nonce):
+            raise ValueError("Incorrect nonce")
+        with self._lock:
+            if self._is_stale():
+                raise ValueError("Stale work")
+            work = self._work.get(work_id)
+            if work is None:
+                raise ValueError("Unknown or stale work")
+            block = self._block(*work)
+        block.nonce = nonce
+        block_hash = block.compute_hash()
+        if not block.is_header_valid(block_hash):
+            raise ValueError("Proof of work invalid")
+        block.hash = block_hash
+        # The template built the transactions list from verified mempool transactions, so only the header
+        # is checked; add_block checks the block still extends the chain and is not known yet.
+        self.blockchain.add_block(block)
+        with self._lock:
+            self._work.pop(work_id, None)
+        return block
@@ -5,6 +5,12 @@ from classes import Blockchain
 from main import app
 
 
+@pytest.fixture(autouse=True)
+def fast_difficulty(monkeypatch):
+    # Blocks mined in tests come quickly; a zero interval makes difficulty fall instead of rising.
+    monkeypatch.setattr("classes.TARGET_BLOCK_INTERVAL", 0)
+
+
 @pytest.fixture
 def client():
     with app.test_client() as client:
@@ -26,3 +32,10 @@ def set_blockchain():
 def set_nodes():
     yield
     p2p.nodes = []
+
+
+@pytest.fixture
+def p2p_node():
+    p2p.start_node()
+    yield
+    p2p.stop_node()
@@ -0,0 +1,319 @@
+import time
+
+import pytest
+
+from classes import (
+    INITIAL_DIFFICULTY,
+    MAX_FUTURE_BLOCK_TIME,
+    MAX_RETARGET_FACTOR,
+    MIN_DIFFICULTY,
+    Block,
+    Blockchain,
+    Mempool,
+    compute_transaction_id,
+    retarget,
+)
+
+
+def test_verify_and_add_block():
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    block = miner.mine_block()
+
+    receiver.verify_and_add_block(block.to_dict())
+
+    assert receiver.last_block.hash == block.hash
+
+
+def test_verify_and_add_block_rejects_tampered_transactions():
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    miner.add_new_transaction({"test": "test"})
+    block_data = dict(miner.mine_block().to_dict())
+    block_data["transactions"] = [{"test": "forged"}]
+
+    with pytest.raises(ValueError, match="Block proof invalid"):
+        receiver.verify_and_add_block(block_data)
+
+
+def test_header_prefix_size_does_not_depend_on_transactions():
+    small = Block(transactions=[{"n": 1}], timestamp=1, previous_hash="0")
+    large = Block(transactions=[{"n": n} for n in range(1000)], timestamp=1, previous_hash="0")
+
+    assert len(small.header_prefix()) == len(large.header_prefix())
+
+
+def test_mempool_rejects_duplicates():
+    mempool = Mempool()
+    mempool.add({"test": "test"})
+
+    with pytest.raises(ValueError, match="Duplicate transaction"):
+        mempool.add({"test": "test"})
+    assert len(mempool) == 1
+
+
+def test_mempool_selects_by_fee_then_arrival():
+    mempool = Mempool()
+    for transaction in ({"n": 1}, {"n": 2, "fee": 5}, {"n": 3, "fee": 1}, {"n": 4}):
+        mempool.add(transaction)
+
+    selected = [transaction for _, transaction in mempool.select(3)]
+
+    assert selected == [{"n": 2, "fee": 5}, {"n": 3, "fee": 1}, {"n": 1}]
+
+
+def test_mempool_evicts_lowest_priority_when_full():
+    mempool = Mempool(max_bytes=3 * len('{"fee": 1, "n": 0}'))
+    for n in range(3):
+        mempool.add({"n": n, "fee": 1})
+
+    mempool.add({"n": 9, "fee": 2})
+    with pytest.raises(ValueError, match="Mempool full"):
+        mempool.add({"n": 8, "fee": 0})
+
+    assert [transaction["n"] for transaction in mempool] == [0, 1, 9]
+
+
+def test_mempool_keeps_transactions_when_rejecting_one_which_does_not_fit():
+    mempool = Mempool(max_bytes=2 * len('{"fee": 1, "n": 0}'))
+    mempool.add({"n": 0, "fee": 1})
+    mempool.add({"n": 1, "fee": 3})
+
+    # Fitting the large transaction would evict both, but it pays less than the second one.
+    with pytest.raises(ValueError, match="Mempool full"):
+        mempool.add({"n": 2, "fee": 2, "data": "x" * 20})
+
+    assert [transaction["n"] for transaction in mempool] == [0, 1]
+    mempool.add({"n": 3, "fee": 2})
+    assert [transaction["n"] for transaction in mempool] == [1, 3]
+
+
+def test_mine_block_takes_limited_transactions(monkeypatch):
+    monkeypatch.setattr("classes.MAX_BLOCK_TRANSACTIONS", 2)
+    blockchain = Blockchain()
+    for n in range(3):
+        blockchain.add_new_transaction({"n": n})
+
+    block = blockchain.mine_block()
+
+    assert block.transactions == ({"n": 0}, {"n": 1})
+    assert blockchain.unconfirmed_transactions == [{"n": 2}]
+
+
+def test_verify_and_add_block_removes_transactions_from_mempool():
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    miner.add_new_transaction({"n": 1})
+    receiver.add_new_transaction({"n": 1})
+    receiver.add_new_transaction({"n": 2})
+
+    receiver.verify_and_add_block(miner.mine_block().to_dict())
+
+    assert receiver.unconfirmed_transactions == [{"n": 2}]
+
+
+def mine_branch(blockchain, transactions):
+    blocks = []
+    for transaction in transactions:
+        if transaction is not None:
+            blockchain.add_new_transaction(transaction)
+        blocks.append(blockchain.mine_block())
+    return blocks
+
+
+def test_reorganizes_to_branch_with_more_work():
+    local = Blockchain()
+    remote = Blockchain()
+    mine_branch(local, [{"n": 1}])
+    local.add_new_transaction({"n": 2})
+    branch = mine_branch(remote, [{"n": 2}, None])
+
+    assert local.verify_and_add_block(branch[0].to_dict()) == "side"
+    assert local.get_height(branch[0].hash) is None
+    assert local.verify_and_add_block(branch[1].to_dict()) == "reorganized"
+
+    assert [block.hash for block in local.chain] == [block.hash for block in remote.chain]
+    assert local.unconfirmed_transactions == [{"n": 1}]
+
+
+def test_snapshot_keeps_blocks_disconnected_by_reorganization():
+    local = Blockchain()
+    remote = Blockchain()
+    mined = mine_branch(local, [None])[0]
+    snapshot = local.snapshot()
+
+    for block in mine_branch(remote, [None, None]):
+        local.verify_and_add_block(block.to_dict())
+
+    assert snapshot.last_block.hash == mined.hash
+    assert snapshot.index_of(mined.hash) == 1
+    assert local.get_height(mined.hash) is None
+
+
+def mine_block_with(blockchain, transactions):
+    block = Block(
+        transactions=transactions,
+        timestamp=time.time(),
+        previous_hash=blockchain.last_block.hash,
+        difficulty=blockchain.next_difficulty(),
+    )
+    block.calculate_proof_of_work()
+    return block
+
+
+def test_verify_and_add_block_rejects_out_of_range_timestamps():
+    blockchain = Blockchain()
+    mine_branch(blockchain, [{"n": n} for n in range(3)])
+    early = mine_block_with(blockchain, [])
+    early.timestamp = blockchain.chain[2].timestamp
+    early.calculate_proof_of_work()
+    late = mine_block_with(blockchain, [])
+    late.timestamp = time.time() + MAX_FUTURE_BLOCK_TIME + 60
+    late.calculate_proof_of_work()
+
+    with pytest.raises(ValueError, match="Block timestamp too early"):
+        blockchain.verify_and_add_block(early.to_dict())
+    with pytest.raises(ValueError, match="Block timestamp too far in the future"):
+        blockchain.verify_and_add_block(late.to_dict())
+    assert len(blockchain.chain) == 4
+
+
+def test_verify_and_add_block_bounds_timestamp_after_genesis():
+    blockchain = Blockchain()
+    for timestamp, error in ((-(2**70), "Block timestamp invalid"), (0, "Block timestamp too early")):
+        block = mine_block_with(blockchain, [])
+        block.timestamp = timestamp
+        block.calculate_proof_of_work()
+
+        with pytest.raises(ValueError, match=error):
+            blockchain.verify_and_add_block(block.to_dict())
+    assert len(blockchain.chain) == 1
+
+
+def test_verify_and_add_block_rejects_unencodable_nonce():
+    blockchain = Blockchain()
+    block = mine_block_with(Blockchain(), [])
+    # The nonce is hashed as text, so the string gives the same hash as the mined integer.
+    forged = dict(block.to_dict(), nonce=str(block.nonce))
+
+    with pytest.raises(ValueError, match="Block proof invalid"):
+        blockchain.verify_and_add_block(forged)
+    assert blockchain.verify_and_add_block(block.to_dict()) == "extended"
+
+
+def test_verify_and_add_block_rejects_malformed_transactions():
+    blockchain = Blockchain()
+    block = mine_block_with(Blockchain(), [1, "x"])
+
+    with pytest.raises(ValueError, match="Transaction must be a JSON object"):
+        blockchain.verify_and_add_block(block.to_dict())
+    assert len(blockchain.snapshot()) == len(blockchain.chain) == 1
+
+
+def test_reorganization_skips_malformed_transactions_of_disconnected_blocks():
+    local = Blockchain()
+    # A block accepted without transaction checks, e.g. stored by an older version.
+    local.add_block(mine_block_with(local, [1, {"n": 1}]))
+    remote = Blockchain()
+    branch = mine_branch(remote, [None, None])
+
+    for block in branch:
+        local.verify_and_add_block(block.to_dict())
+
+    assert len(local.chain) == len(local.snapshot()) == 3
+    assert local.last_block.hash == branch[-1].hash
+    assert local.unconfirmed_transactions == [{"n": 1}]
+
+
+def test_orphan_blocks_connect_when_parent_arrives():
+    local = Blockchain()
+    remote = Blockchain()
+    blocks = mine_branch(remote, [None, None, None])
+
+    assert local.verify_and_add_block(blocks[2].to_dict()) == "orphan"
+    assert local.verify_and_add_block(blocks[1].to_dict()) == "orphan"
+    assert local.verify_and_add_block(blocks[0].to_dict()) == "extended"
+
+    assert local.last_block.hash == remote.last_block.hash
+
+
+def test_verify_and_add_block_rejects_known_block():
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    block = miner.mine_block()
+    receiver.verify_and_add_block(block.to_dict())
+
+    with pytest.raises(ValueError, match="Block already known"):
+        receiver.verify_and_add_block(block.to_dict())
+
+
+def test_block_bytes_round_trip_reuses_encoding():
+    blockchain = Blockchain()
+    blockchain.add_new_transaction({"n": 1, "fee": 2})
+    block = blockchain.mine_block()
+
+    decoded = Block.from_bytes(block.to_bytes())
+
+    assert decoded.to_dict() == block.to_dict()
+    assert decoded.to_bytes() is decoded.to_bytes()
+    assert decoded.is_proof_valid(decoded.hash)
+
+
+def test_block_has_no_instance_dict():
+    block = Blockchain().last_block
+
+    assert not hasattr(block, "__dict__")
+
+
+def blocks_at(timestamps, difficulty):
+    return [
+        Block(transactions=[], timestamp=timestamp, previous_hash="0", difficulty=difficulty)
+        for timestamp in timestamps
+    ]
+
+
+def test_retarget_follows_block_interval(monkeypatch):
+    monkeypatch.setattr("classes.TARGET_BLOCK_INTERVAL", 10)
+
+    assert retarget([]) == INITIAL_DIFFICULTY
+    assert retarget(blocks_at([0, 20, 40], 1000)) == 500
+    assert retarget(blocks_at([0, 5, 10], 1000)) == 2000
+    assert retarget(blocks_at([0, 0.1, 0.2], 1000)) == 1000 * MAX_RETARGET_FACTOR
+    assert retarget(blocks_at([0, 1000, 2000], 2)) == MIN_DIFFICULTY
+
+
+def test_mined_blocks_follow_retarget():
+    blockchain = Blockchain()
+    mine_branch(blockchain, [None, None, None])
+
+    for height in range(2, len(blockchain.chain)):
+        recent_blocks = blockchain.chain[1:height]
+        assert blockchain.chain[height].difficulty == retarget(recent_blocks)
+
+
+def test_verify_and_add_block_rejects_wrong_difficulty():
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    block = Block(
+        transactions=[],
+        timestamp=1,
+        previous_hash=miner.last_block.hash,
+        difficulty=MIN_DIFFICULTY,
+    )
+    block.calculate_proof_of_work()
+
+    with pytest.raises(ValueError, match="Block difficulty incorrect"):
+        receiver.verify_and_add_block(block.to_dict())
+
+
+def test_block_caches_parsed_transactions_and_ids():
+    block = Block.from_bytes(mine_branch(Blockchain(), [{"n": 1}])[0].to_bytes())
+
+    assert block.transactions is block.transactions
+    assert block.transaction_ids() is block.transaction_ids()
+    with pytest.raises(AttributeError):
+        block.transactions.append({"n": 2})
+
+    block.transactions = [{"n": 2}]
+    assert block.transactions == ({"n": 2},)
+    assert block.transaction_ids() == (compute_transaction_id({"n": 2}),)
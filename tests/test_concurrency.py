@@ -0,0 +1,68 @@
+import threading
+
+from classes import Blockchain
+
+
+def test_concurrent_ingestion_mining_and_reads_lose_no_transactions():
+    blockchain = Blockchain()
+    receiver = Blockchain(chain=list(blockchain.chain))
+    writers, transactions_per_writer = 8, 200
+    stop_reading = threading.Event()
+    errors = []
+
+    def ingest(writer):
+        for n in range(transactions_per_writer):
+            blockchain.add_new_transaction({"writer": writer, "n": n})
+
+    def mine():
+        for _ in range(20):
+            block = blockchain.mine_block()
+            receiver.verify_and_add_block(block.to_dict())
+
+    def read():
+        while not stop_reading.is_set():
+            chain = blockchain.snapshot()
+            previous_hash = None
+            for block in chain:
+                if previous_hash is not None and block.previous_hash != previous_hash:
+                    errors.append("broken snapshot")
+                previous_hash = block.hash
+
+    threads = [threading.Thread(target=ingest, args=(w,)) for w in range(writers)]
+    threads += [threading.Thread(target=mine)]
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads + readers:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop_reading.set()
+    for thread in readers:
+        thread.join()
+
+    confirmed = [tx for block in blockchain.chain for tx in block.transactions]
+    pending = blockchain.unconfirmed_transactions
+    all_transactions = confirmed + pending
+    assert not errors
+    assert len(all_transactions) == writers * transactions_per_writer
+    assert len({(tx["writer"], tx["n"]) for tx in all_transactions}) == len(
+        all_transactions
+    )
+    assert receiver.last_block.hash == blockchain.last_block.hash
+
+
+def test_concurrent_miners_keep_chain_linked():
+    blockchain = Blockchain()
+
+    threads = [
+        threading.Thread(target=lambda: [blockchain.mine_block() for _ in range(5)])
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    chain = blockchain.snapshot()
+    assert len(chain) == 21
+    for previous, block in zip(chain, chain[1:]):
+        assert block.previous_hash == previous.hash
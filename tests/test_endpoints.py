@@ -1,7 +1,14 @@
 import json
-from unittest.mock import patch
+from hashlib import sha256
+from unittest.mock import Mock, patch
 
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+import p2p
+from classes import compute_transaction_id, hash_header
+from merkle import verify_proof
 from p2p import blockchain, nodes
+from signatures import sign_transaction
 
 
 def test_new_transaction(client, set_blockchain):
@@ -25,7 +32,7 @@ def test_mine_block(
 
 def test_get_chain(client, set_blockchain):
     response = client.get("/chain")
-    chain_data = [blockchain.last_block.__dict__]
+    chain_data = [blockchain.last_block.to_dict()]
 
     assert json.loads(response.data.decode("utf-8")) == {
         "length": len(chain_data),
@@ -62,3 +69,194 @@ def test_populate_new_node(mock_populate_node, client, set_blockchain):
         ["127.0.0.1"],
         blockchain.to_dict(),
     ]
+
+
+def test_get_merkle_proof(client, set_blockchain):
+    p2p.blockchain.add_new_transaction({"test": "test"})
+    p2p.blockchain.add_new_transaction({"test": "other"})
+    block = p2p.blockchain.mine_block()
+    tx_id = compute_transaction_id({"test": "other"})
+    response = client.get(f"/merkle_proof?block_hash={block.hash}&tx_id={tx_id}")
+    data = json.loads(response.data.decode("utf-8"))
+
+    assert data["index"] == 1
+    assert verify_proof(tx_id, data["proof"], block.merkle_root)
+
+
+def test_get_chain_page(client, set_blockchain):
+    p2p.blockchain.mine_block()
+    p2p.blockchain.mine_block()
+    response = client.get("/chain?from_height=1&limit=1")
+
+    assert json.loads(response.data.decode("utf-8")) == {
+        "length": 3,
+        "chain": [p2p.blockchain.chain[1].to_dict()],
+    }
+
+
+def test_get_chain_ndjson(client, set_blockchain):
+    p2p.blockchain.mine_block()
+    response = client.get("/chain?format=ndjson")
+    lines = response.data.decode("utf-8").splitlines()
+
+    assert [json.loads(line) for line in lines] == [
+        block.to_dict() for block in p2p.blockchain.chain
+    ]
+
+
+def test_get_chain_streamed_json(client, set_blockchain):
+    p2p.blockchain.mine_block()
+    response = client.get("/chain?stream=true")
+
+    assert json.loads(response.data.decode("utf-8")) == {
+        "length": 2,
+        "chain": [block.to_dict() for block in p2p.blockchain.chain],
+    }
+
+
+def test_get_chain_not_modified(client, set_blockchain):
+    etag = client.get("/chain").headers["ETag"]
+
+    assert client.get("/chain", headers={"If-None-Match": etag}).status_code == 304
+    p2p.blockchain.mine_block()
+    assert client.get("/chain", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_get_peer_stats(client):
+    response = client.get("/peer_stats")
+
+    assert response.status_code == 200
+    assert isinstance(json.loads(response.data.decode("utf-8")), dict)
+
+
+def test_new_transactions_json_array(client, set_blockchain):
+    transactions = [{"test": 1}, {"test": 1}, "not an object", {"test": 2}]
+    response = client.post("/transactions", json=transactions)
+    data = json.loads(response.data.decode("utf-8"))
+
+    assert data["accepted"] == 2
+    assert [result["status"] for result in data["results"]] == [
+        "accepted",
+        "rejected",
+        "rejected",
+        "accepted",
+    ]
+    assert data["results"][1]["error"] == "Duplicate transaction"
+    assert p2p.blockchain.unconfirmed_transactions == [{"test": 1}, {"test": 2}]
+
+
+def test_new_transactions_ndjson(client, set_blockchain):
+    body = '{"test": 1}\n{broken\n{"test": 2}\n'
+    response = client.post(
+        "/transactions", data=body, content_type="application/x-ndjson"
+    )
+    data = json.loads(response.data.decode("utf-8"))
+
+    assert [result["status"] for result in data["results"]] == [
+        "accepted",
+        "rejected",
+        "accepted",
+    ]
+    assert p2p.blockchain.unconfirmed_transactions == [{"test": 1}, {"test": 2}]
+
+
+def test_get_transaction(client, set_blockchain):
+    p2p.blockchain.add_new_transaction({"test": "confirmed"})
+    block = p2p.blockchain.mine_block()
+    p2p.blockchain.add_new_transaction({"test": "unconfirmed"})
+
+    confirmed = client.get(f"/transaction?tx_id={compute_transaction_id({'test': 'confirmed'})}")
+    unconfirmed = client.get(f"/transaction?tx_id={compute_transaction_id({'test': 'unconfirmed'})}")
+    missing = client.get(f"/transaction?tx_id={'0' * 64}")
+
+    assert confirmed.get_json()["block_hash"] == block.hash
+    assert confirmed.get_json()["confirmations"] == 1
+    assert unconfirmed.get_json()["status"] == "unconfirmed"
+    assert missing.status_code == 404
+
+
+def test_get_balance(client, set_blockchain):
+    p2p.blockchain.add_new_transaction(
+        sign_transaction({"recipient": "b", "amount": 3}, Ed25519PrivateKey.generate())
+    )
+    p2p.blockchain.mine_block()
+
+    response = client.get("/balance?address=b")
+
+    assert response.get_json() == {"address": "b", "balance": 3, "height": 1}
+
+
+def test_get_metrics(client, set_blockchain):
+    p2p.blockchain.add_new_transaction({"n": 1})
+    client.get("/chain")
+
+    response = client.get("/metrics")
+    text = response.text
+
+    assert response.mimetype == "text/plain"
+    assert f"blockchain_chain_height {len(p2p.blockchain.snapshot()) - 1}" in text
+    assert "blockchain_mempool_transactions 1" in text
+    assert 'blockchain_http_request_seconds_count{method="GET",route="/chain",status="200"}' in text
+
+
+def test_get_profile_is_disabled_by_default(client):
+    response = client.get("/profile?seconds=0.01")
+
+    assert response.status_code == 404
+
+
+def test_get_profile_rejects_long_duration(client, monkeypatch):
+    monkeypatch.setattr("metrics.PROFILE_ENABLED", True)
+    response = client.get("/profile?seconds=3600")
+
+    assert response.status_code == 400
+
+
+@patch("main.announce_new_block")
+def test_getwork_and_submitwork(mock_announce_new_block, client, set_blockchain):
+    p2p.blockchain.add_new_transaction({"n": 1})
+    work = client.get("/getwork").get_json()
+    prefix_state = sha256(bytes.fromhex(work["header_prefix"]))
+    nonce = 0
+    while hash_header(prefix_state, nonce) > bytes.fromhex(work["target"]):
+        nonce += 1
+
+    response = client.post("/submitwork", json={"work_id": work["work_id"], "nonce": nonce})
+    stale = client.post("/submitwork", json={"work_id": work["work_id"], "nonce": nonce})
+
+    assert response.get_json() == {"hash": p2p.blockchain.last_block.hash, "height": 1}
+    mock_announce_new_block.assert_called_once_with(p2p.blockchain.last_block)
+    assert p2p.blockchain.last_block.transactions == ({"n": 1},)
+    assert stale.status_code == 400
+
+
+def test_get_headers_validates_limit(client, set_blockchain):
+    locator = [p2p.blockchain.last_block.hash]
+    p2p.blockchain.mine_block()
+
+    assert len(client.post("/headers", json={"locator": locator, "limit": 5}).get_json()) == 1
+    assert client.post("/headers", json={"locator": locator, "limit": 0}).get_json() == []
+    for limit in (-1, "10", 1.5, True):
+        response = client.post("/headers", json={"locator": locator, "limit": limit})
+        assert response.status_code == 400
+    assert client.post("/headers", json=["x"]).status_code == 400
+
+
+def test_get_blocks_validates_hashes(client, set_blockchain):
+    block = p2p.blockchain.mine_block()
+
+    assert client.post("/blocks", json={"hashes": [block.hash]}).get_json() == [block.to_dict()]
+    for body in ([block.hash], {"hashes": [1]}, {"hashes": block.hash}):
+        assert client.post("/blocks", json=body).status_code == 400
+    assert client.post("/blocks", data="x", content_type="text/plain").status_code == 400
+
+
+@patch("p2p.requests.post")
+def test_register_reports_bad_peer_responses(mock_post, client, set_blockchain, set_nodes):
+    mock_post.return_value = Mock(status_code=200, content=b"not json")
+    assert client.post("/register", json={"node_http_address": "http://peer"}).status_code == 502
+
+    summary = json.dumps([[], {"unconfirmed_transactions": []}]).encode()
+    mock_post.return_value = Mock(status_code=200, content=summary, json=lambda: [{"hash": "00"}])
+    assert client.post("/register", json={"node_http_address": "http://peer"}).status_code == 502
+    assert client.post("/register", json=["http://peer"]).status_code == 400
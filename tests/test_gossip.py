@@ -0,0 +1,157 @@
+import p2p
+from classes import Block, Blockchain
+from gossip import GossipRelay, SeenCache
+from wire import (INV_BLOCK, INV_TRANSACTION, MSG_ADD_BLOCK, MSG_GET_DATA,
+                  MSG_INV, FrameDecoder, decode_inventory, encode_inventory,
+                  encode_message)
+
+
+class RecordingBroadcaster:
+    def __init__(self):
+        self.sent = []
+
+    def broadcast(self, nodes, msg, description="message"):
+        ((msg_type, payload),) = FrameDecoder().feed(msg)
+        self.sent.append((list(nodes), msg_type, payload))
+
+
+SELF = {"host": "127.0.0.1", "port": 9000}
+PEERS = [{"host": "127.0.0.1", "port": 9001 + i} for i in range(20)]
+HASH = "ab" * 32
+
+
+def test_seen_cache_evicts_least_recently_seen():
+    cache = SeenCache(max_size=2)
+
+    assert cache.add("a")
+    assert cache.add("b")
+    assert not cache.add("a")
+    cache.add("c")
+
+    assert "a" in cache and "c" in cache and "b" not in cache
+
+
+def test_relay_announces_to_random_subset_without_source():
+    broadcaster = RecordingBroadcaster()
+    relay = GossipRelay(broadcaster, fanout=5)
+
+    relay.relay(SELF, PEERS, INV_BLOCK, [HASH], exclude=[PEERS[0]])
+
+    ((targets, msg_type, payload),) = broadcaster.sent
+    assert msg_type == MSG_INV
+    assert len(targets) == 5 and PEERS[0] not in targets
+    assert decode_inventory(payload) == (SELF, [(INV_BLOCK, HASH)])
+    assert (INV_BLOCK, HASH) in relay.seen
+
+
+def test_request_missing_skips_seen_known_and_requested_items():
+    broadcaster = RecordingBroadcaster()
+    relay = GossipRelay(broadcaster)
+    known = "cd" * 32
+    seen = "ef" * 32
+    relay.seen.add((INV_TRANSACTION, seen))
+    items = [(INV_BLOCK, HASH), (INV_BLOCK, known), (INV_TRANSACTION, seen)]
+
+    def is_known(kind, item_hash):
+        return item_hash == known
+
+    wanted = relay.request_missing(SELF, PEERS[0], items, is_known)
+    again = relay.request_missing(SELF, PEERS[1], items, is_known)
+
+    assert wanted == [(INV_BLOCK, HASH)]
+    assert again == []
+    ((targets, msg_type, payload),) = broadcaster.sent
+    assert targets == [PEERS[0]] and msg_type == MSG_GET_DATA
+    assert decode_inventory(payload) == (SELF, wanted)
+    assert relay.received(INV_BLOCK, HASH) == PEERS[0]
+    assert relay.received(INV_BLOCK, HASH) is None
+
+
+def test_node_fetches_announced_block_and_relays_it(monkeypatch, set_blockchain, set_nodes):
+    broadcaster = RecordingBroadcaster()
+    monkeypatch.setattr(p2p, "gossip", GossipRelay(broadcaster))
+    monkeypatch.setattr(p2p, "broadcaster", broadcaster)
+    monkeypatch.setattr(p2p, "host", SELF["host"])
+    monkeypatch.setattr(p2p, "port", SELF["port"])
+    p2p.blockchain = Blockchain()
+    p2p.nodes = list(PEERS[:3])
+    block = Blockchain(chain=list(p2p.blockchain.chain)).mine_block()
+
+    p2p.handle_message(MSG_INV, encode_inventory(PEERS[0], [(INV_BLOCK, block.hash)]))
+    p2p.handle_message(MSG_INV, encode_inventory(PEERS[1], [(INV_BLOCK, block.hash)]))
+    p2p.handle_message(MSG_ADD_BLOCK, block.to_bytes())
+
+    request, announcement = broadcaster.sent
+    assert request[:2] == ([PEERS[0]], MSG_GET_DATA)
+    assert p2p.blockchain.last_block.hash == block.hash
+    assert announcement[1] == MSG_INV
+    assert sorted(node["port"] for node in announcement[0]) == [9002, 9003]
+
+    p2p.handle_message(MSG_GET_DATA, encode_inventory(PEERS[2], [(INV_BLOCK, block.hash)]))
+
+    assert broadcaster.sent[-1] == ([PEERS[2]], MSG_ADD_BLOCK, block.to_bytes())
+
+
+def test_new_transactions_are_fetched_from_announcing_node(monkeypatch, set_blockchain, set_nodes):
+    broadcaster = RecordingBroadcaster()
+    monkeypatch.setattr(p2p, "gossip", GossipRelay(broadcaster))
+    monkeypatch.setattr(p2p, "broadcaster", broadcaster)
+    monkeypatch.setattr(p2p, "host", SELF["host"])
+    monkeypatch.setattr(p2p, "port", SELF["port"])
+    sender = Blockchain()
+    tx_id = sender.add_new_transaction({"n": 1})
+    p2p.blockchain = Blockchain()
+    p2p.nodes = list(PEERS[:2])
+
+    p2p.handle_message(MSG_INV, encode_inventory(PEERS[0], [(INV_TRANSACTION, tx_id)]))
+    p2p.blockchain, receiver = sender, p2p.blockchain
+    p2p.handle_message(MSG_GET_DATA, encode_inventory(PEERS[0], [(INV_TRANSACTION, tx_id)]))
+    p2p.blockchain = receiver
+    _, msg_type, payload = broadcaster.sent[-1]
+    p2p.handle_message(msg_type, payload)
+
+    assert p2p.blockchain.unconfirmed_transactions == [{"n": 1}]
+    targets, msg_type, payload = broadcaster.sent[-1]
+    assert targets == [PEERS[1]] and msg_type == MSG_INV
+    assert decode_inventory(payload)[1] == [(INV_TRANSACTION, tx_id)]
+
+
+def test_transactions_of_accepted_block_are_not_requested(monkeypatch, set_blockchain, set_nodes):
+    broadcaster = RecordingBroadcaster()
+    monkeypatch.setattr(p2p, "gossip", GossipRelay(broadcaster))
+    monkeypatch.setattr(p2p, "broadcaster", broadcaster)
+    p2p.blockchain = Blockchain()
+    p2p.nodes = []
+    miner = Blockchain(chain=list(p2p.blockchain.chain))
+    tx_id = miner.add_new_transaction({"n": 1})
+    block = miner.mine_block()
+
+    p2p.handle_message(MSG_ADD_BLOCK, block.to_bytes())
+    p2p.handle_message(MSG_INV, encode_inventory(PEERS[0], [(INV_TRANSACTION, tx_id)]))
+
+    assert broadcaster.sent == []
+
+
+def test_forged_block_body_does_not_mark_announced_hash_seen(monkeypatch, set_blockchain, set_nodes):
+    broadcaster = RecordingBroadcaster()
+    monkeypatch.setattr(p2p, "gossip", GossipRelay(broadcaster))
+    monkeypatch.setattr(p2p, "broadcaster", broadcaster)
+    monkeypatch.setattr(p2p, "host", SELF["host"])
+    monkeypatch.setattr(p2p, "port", SELF["port"])
+    p2p.blockchain = Blockchain()
+    p2p.nodes = []
+    miner = Blockchain(chain=list(p2p.blockchain.chain))
+    miner.add_new_transaction({"n": 1})
+    block = miner.mine_block()
+    forged = Block.from_dict(dict(block.to_dict(), transactions=[{"n": "forged"}]))
+
+    p2p.handle_message(MSG_INV, encode_inventory(PEERS[0], [(INV_BLOCK, block.hash)]))
+    p2p.handle_message(MSG_ADD_BLOCK, forged.to_bytes())
+    p2p.handle_message(MSG_INV, encode_inventory(PEERS[1], [(INV_BLOCK, block.hash)]))
+
+    assert [(targets, msg_type) for targets, msg_type, _ in broadcaster.sent] == [
+        ([PEERS[0]], MSG_GET_DATA),
+        ([PEERS[1]], MSG_GET_DATA),
+    ]
+    p2p.handle_message(MSG_ADD_BLOCK, block.to_bytes())
+    assert p2p.blockchain.last_block.hash == block.hash
@@ -0,0 +1,49 @@
+import pytest
+
+from merkle import EMPTY_ROOT, MerkleTree, verify_proof
+
+LEAVES = [f"{n:064x}" for n in range(7)]
+
+
+def test_empty_tree_root():
+    assert MerkleTree([]).root == EMPTY_ROOT
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_every_leaf_proof_is_valid(size):
+    tree = MerkleTree(LEAVES[:size])
+
+    for index, leaf in enumerate(LEAVES[:size]):
+        assert verify_proof(leaf, tree.proof(index), tree.root)
+
+
+def test_proof_rejects_other_leaf():
+    tree = MerkleTree(LEAVES)
+
+    assert not verify_proof(LEAVES[1], tree.proof(0), tree.root)
+
+
+def test_incremental_updates_match_rebuilt_tree():
+    leaves = []
+    tree = MerkleTree([])
+    operations = [("append", n) for n in range(9)] + [
+        ("update", 3),
+        ("pop", None),
+        ("update", 0),
+        ("pop", None),
+        ("pop", None),
+        ("append", 20),
+    ] + [("pop", None)] * 7
+
+    for operation, n in operations:
+        if operation == "append":
+            leaves.append(f"{n:064x}")
+            tree.append(leaves[-1])
+        elif operation == "update":
+            leaves[n] = f"{100 + n:064x}"
+            tree.update(n, leaves[n])
+        else:
+            assert tree.pop() == leaves.pop()
+
+        assert tree.levels == MerkleTree(leaves).levels
+    assert tree.root == EMPTY_ROOT
@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+import metrics
+from classes import Blockchain
+from metrics import Counter, Gauge, Histogram, Registry, SamplingProfiler
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    counter = registry.register(Counter("test_total", "A counter.", ("peer",)))
+    gauge = registry.register(Gauge("test_size", "A gauge."))
+    counter.inc(2, peer='a"b')
+    gauge.set(5)
+
+    assert registry.render() == (
+        "# HELP test_total A counter.\n"
+        "# TYPE test_total counter\n"
+        'test_total{peer="a\\"b"} 2\n'
+        "# HELP test_size A gauge.\n"
+        "# TYPE test_size gauge\n"
+        "test_size 5\n"
+    )
+
+
+def test_histogram_counts_cumulative_buckets():
+    histogram = Histogram("test_seconds", "A histogram.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    lines = histogram.render().splitlines()[2:]
+
+    assert lines == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        "test_seconds_sum 2.65",
+        "test_seconds_count 4",
+    ]
+
+
+def test_metric_rejects_wrong_labels():
+    with pytest.raises(ValueError):
+        Counter("test_total", "A counter.", ("peer",)).inc(error="x")
+
+
+def test_mining_and_verification_are_measured():
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    hashes = metrics.MINING_HASHES.value()
+    verified = metrics.BLOCK_VERIFICATION_SECONDS.count(result="extended")
+
+    block = miner.mine_block()
+    receiver.verify_and_add_block(block.to_dict())
+    with pytest.raises(ValueError):
+        receiver.verify_and_add_block(block.to_dict())
+
+    assert metrics.MINING_HASHES.value() > hashes
+    assert metrics.BLOCK_VERIFICATION_SECONDS.count(result="extended") == verified + 1
+    assert metrics.BLOCK_VERIFICATION_SECONDS.count(result="known") >= 1
+
+
+def test_sampling_profiler_collects_stacks():
+    stop = threading.Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_loop, name="busy", daemon=True)
+    thread.start()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    while "busy_loop" not in profiler.collapsed():
+        stop.wait(0.01)
+    profiler.stop()
+    stop.set()
+    thread.join()
+
+    assert any(
+        line.startswith("busy;") and "test_metrics.py:busy_loop" in line
+        for line in profiler.collapsed().splitlines()
+    )
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from classes import Block, Blockchain, target_of
+from mining import MinerService, NonceSearcher, find_nonce_parallel
+
+
+def test_parallel_nonce_matches_serial():
+    serial_block = Block(transactions=[{"test": "test"}], timestamp=1, previous_hash="0")
+    parallel_block = Block(transactions=[{"test": "test"}], timestamp=1, previous_hash="0")
+    serial_block.calculate_proof_of_work()
+
+    nonce = find_nonce_parallel(parallel_block, workers=2, chunk_size=16)
+
+    assert nonce == serial_block.nonce
+    parallel_block.nonce = nonce
+    assert bytes.fromhex(parallel_block.compute_hash()) <= target_of(parallel_block.difficulty)
+
+
+def test_nonce_searcher_reuses_worker_processes():
+    searcher = NonceSearcher(workers=2)
+    try:
+        nonces = []
+        for timestamp in range(3):
+            block = Block(transactions=[], timestamp=timestamp, previous_hash="0")
+            nonces.append(searcher.find_nonce(block, chunk_size=16))
+            if timestamp == 0:
+                executor = searcher._executor
+
+        assert searcher._executor is executor
+        for timestamp, nonce in enumerate(nonces):
+            block = Block(transactions=[], timestamp=timestamp, previous_hash="0")
+            block.calculate_proof_of_work()
+            assert nonce == block.nonce
+    finally:
+        searcher.close()
+
+
+def test_calculate_proof_of_work_with_workers():
+    block = Block(transactions=[], timestamp=2, previous_hash="0")
+    block.calculate_proof_of_work(workers=2)
+    received_block = Block.from_dict(block.to_dict(), include_hash=False)
+
+    assert received_block.is_proof_valid(block.hash)
+
+
+def test_mine_block_restarts_on_new_tip(monkeypatch):
+    blockchain = Blockchain()
+    competitor = Blockchain(chain=list(blockchain.chain))
+    blockchain.add_new_transaction({"n": 1})
+    blockchain.add_new_transaction({"n": 2})
+    competitor.add_new_transaction({"n": 1})
+    competing_block = competitor.mine_block()
+    job_started = threading.Event()
+    competing_block_added = threading.Event()
+    original_select = blockchain.mempool.select
+
+    def select(max_count):
+        if not job_started.is_set():
+            job_started.set()
+            competing_block_added.wait()
+        return original_select(max_count)
+
+    monkeypatch.setattr(blockchain.mempool, "select", select)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(blockchain.mine_block()))
+    thread.start()
+    job_started.wait()
+    blockchain.verify_and_add_block(competing_block.to_dict())
+    competing_block_added.set()
+    thread.join()
+
+    mined = result[0]
+    assert mined.previous_hash == competing_block.hash
+    assert mined.transactions == ({"n": 2},)
+    assert blockchain.mining_stats()["jobs_stale"] == 1
+
+
+def test_miner_service_stops_and_reports_stats():
+    blockchain = Blockchain()
+    mined = []
+    miner = MinerService(blockchain, mined.append)
+    blockchain.add_new_transaction({"n": 1})
+
+    miner.start()
+    deadline = time.monotonic() + 5
+    while not mined and time.monotonic() < deadline:
+        time.sleep(0.01)
+    miner.stop()
+
+    stats = miner.stats()
+    assert mined[0].transactions == ({"n": 1},)
+    assert stats["blocks_mined"] == 1
+    assert not stats["running"]
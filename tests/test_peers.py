@@ -0,0 +1,104 @@
+import socket
+import time
+from unittest.mock import Mock
+
+import pytest
+
+import p2p
+from classes import Blockchain
+from peers import Broadcaster, PeerManager
+from wire import MSG_ADD_BLOCK, encode_block, encode_message
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_blocks_are_handled_in_order_over_one_connection(p2p_node, set_blockchain):
+    miner = Blockchain(chain=list(p2p.blockchain.chain))
+    blocks = [miner.mine_block() for _ in range(3)]
+    peer_manager = PeerManager()
+    node = {"host": p2p.host, "port": p2p.port}
+
+    for block in blocks:
+        peer_manager.send(node, encode_message(MSG_ADD_BLOCK, encode_block(block.to_dict())))
+
+    assert wait_for(lambda: p2p.blockchain.last_block.hash == blocks[-1].hash)
+    peer_manager.close_all()
+
+
+def test_unreachable_peer_is_backed_off():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        node = {"host": "127.0.0.1", "port": s.getsockname()[1]}
+    peer_manager = PeerManager()
+
+    with pytest.raises(ConnectionRefusedError):
+        peer_manager.send(node, b"message")
+    with pytest.raises(ConnectionError, match="waiting before reconnecting"):
+        peer_manager.send(node, b"message")
+
+
+def test_broadcast_does_not_wait_for_slow_peer():
+    slow = {"host": "127.0.0.1", "port": 1}
+    fast = {"host": "127.0.0.1", "port": 2}
+    delivered = []
+
+    def send(node, msg):
+        if node is slow:
+            time.sleep(0.5)
+        delivered.append(node["port"])
+
+    peer_manager = Mock(send=Mock(side_effect=send))
+    broadcaster = Broadcaster(peer_manager, workers=2)
+
+    start = time.monotonic()
+    broadcaster.broadcast([slow, fast], b"message")
+
+    assert time.monotonic() - start < 0.1
+    assert wait_for(lambda: delivered == [2, 1])
+    stats = broadcaster.stats()
+    assert stats["127.0.0.1:1"]["sent"] == 1
+    assert stats["127.0.0.1:1"]["last_latency"] >= 0.5
+    assert stats["127.0.0.1:2"]["last_latency"] < 0.5
+
+
+def test_broadcast_records_errors():
+    node = {"host": "127.0.0.1", "port": 1}
+    peer_manager = Mock(send=Mock(side_effect=ConnectionRefusedError()))
+    broadcaster = Broadcaster(peer_manager, workers=1)
+
+    broadcaster.broadcast([node], b"message")
+
+    assert wait_for(lambda: broadcaster.stats().get("127.0.0.1:1", {}).get("errors"))
+    assert broadcaster.stats()["127.0.0.1:1"]["last_error"] == "ConnectionRefusedError"
+
+
+def test_broadcaster_restarts_workers_after_close():
+    node = {"host": "127.0.0.1", "port": 1}
+    delivered = []
+    peer_manager = Mock(send=Mock(side_effect=lambda node, msg: delivered.append(msg)))
+    broadcaster = Broadcaster(peer_manager, workers=1)
+
+    broadcaster.broadcast([node], b"first")
+    assert wait_for(lambda: delivered == [b"first"])
+    broadcaster.close()
+    broadcaster.broadcast([node], b"second")
+
+    assert wait_for(lambda: delivered == [b"first", b"second"])
+    broadcaster.close()
+
+
+def test_stop_node_closes_worker_pools(monkeypatch, set_blockchain):
+    monkeypatch.setattr(p2p, "broadcaster", Mock())
+    monkeypatch.setattr(p2p.blockchain, "signature_verifier", Mock())
+
+    p2p.stop_node()
+
+    p2p.broadcaster.close.assert_called_once_with()
+    p2p.blockchain.signature_verifier.close.assert_called_once_with()
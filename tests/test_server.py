@@ -0,0 +1,57 @@
+import socket
+import threading
+import time
+
+from server import P2PServer
+from wire import MSG_ADD_NODE, encode_message
+
+
+def test_server_handles_many_connections_and_stops():
+    received = []
+    lock = threading.Lock()
+
+    def handler(msg_type, payload):
+        with lock:
+            received.append((msg_type, payload))
+
+    server = P2PServer(handler, "127.0.0.1")
+    host, port = server.start()
+    clients = [socket.create_connection((host, port)) for _ in range(50)]
+    for i, client in enumerate(clients):
+        client.sendall(encode_message(MSG_ADD_NODE, b"%d" % i) * 2)
+
+    deadline = time.monotonic() + 5
+    while len(received) < 100 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    server.stop()
+
+    assert len(received) == 100
+    for client in clients:
+        assert client.recv(1) == b""
+        client.close()
+
+
+def test_failing_message_does_not_drop_connection():
+    received = []
+
+    def handler(msg_type, payload):
+        if payload == b"bad":
+            raise KeyError(payload)
+        received.append(payload)
+
+    server = P2PServer(handler, "127.0.0.1")
+    host, port = server.start()
+    client = socket.create_connection((host, port))
+    client.sendall(
+        encode_message(MSG_ADD_NODE, b"bad") + encode_message(MSG_ADD_NODE, b"first")
+    )
+    deadline = time.monotonic() + 5
+    while not received and time.monotonic() < deadline:
+        time.sleep(0.01)
+    client.sendall(encode_message(MSG_ADD_NODE, b"second"))
+    while len(received) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    server.stop()
+    client.close()
+
+    assert received == [b"first", b"second"]
@@ -0,0 +1,88 @@
+import pytest
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+import signatures
+from classes import Blockchain, compute_transaction_id
+from signatures import SignatureVerifier, sign_transaction
+
+
+@pytest.fixture
+def key():
+    return Ed25519PrivateKey.generate()
+
+
+def test_add_new_transaction_checks_signatures(key):
+    blockchain = Blockchain()
+    signed = sign_transaction({"recipient": "b", "amount": 1}, key)
+    forged = dict(signed, amount=100)
+
+    blockchain.add_new_transaction(signed)
+    blockchain.add_new_transaction({"data": "unsigned"})
+    with pytest.raises(ValueError, match="Invalid transaction signature"):
+        blockchain.add_new_transaction(forged)
+    with pytest.raises(ValueError, match="Missing transaction signature"):
+        blockchain.add_new_transaction({"sender": "a", "recipient": "b", "amount": 1})
+
+
+def test_add_new_transactions_reports_ids_of_rejected_signatures(key):
+    blockchain = Blockchain()
+    signed = sign_transaction({"recipient": "b", "amount": 1}, key)
+    forged = dict(signed, amount=100)
+
+    results = blockchain.add_new_transactions([forged, signed])
+
+    assert results == [
+        {
+            "tx_id": compute_transaction_id(forged),
+            "status": "rejected",
+            "error": "Invalid transaction signature",
+        },
+        {"tx_id": compute_transaction_id(signed), "status": "accepted"},
+    ]
+    assert blockchain.unconfirmed_transactions == [signed]
+
+
+def test_batch_verification_on_worker_pool(key):
+    transactions = [
+        sign_transaction({"recipient": "b", "amount": n}, key) for n in range(5)
+    ]
+    transactions[3]["amount"] = 100
+    verifier = SignatureVerifier(workers=2, batch_size=2)
+    try:
+        errors = verifier.verify(
+            transactions, [compute_transaction_id(t) for t in transactions]
+        )
+    finally:
+        verifier.close()
+
+    assert errors == [None, None, None, "Invalid transaction signature", None]
+
+
+def test_transaction_verified_in_mempool_is_not_verified_again_in_block(
+    key, monkeypatch
+):
+    calls = []
+    verify_signature = signatures.verify_signature
+    monkeypatch.setattr(
+        "signatures.verify_signature",
+        lambda transaction: calls.append(transaction) or verify_signature(transaction),
+    )
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    transaction = sign_transaction({"recipient": "b", "amount": 1}, key)
+    miner.mempool.add(transaction)
+    receiver.add_new_transaction(transaction)
+
+    receiver.verify_and_add_block(miner.mine_block().to_dict())
+
+    assert calls == [transaction]
+
+
+def test_verify_and_add_block_rejects_forged_transaction(key):
+    miner = Blockchain()
+    receiver = Blockchain(chain=list(miner.chain))
+    signed = sign_transaction({"recipient": "b", "amount": 1}, key)
+    miner.mempool.add(dict(signed, amount=100))
+
+    with pytest.raises(ValueError, match="Invalid transaction signature"):
+        receiver.verify_and_add_block(miner.mine_block().to_dict())
@@ -0,0 +1,139 @@
+import io
+import json
+import os
+
+import pytest
+
+import p2p
+from classes import Block, Blockchain
+from snapshot import (CHUNK_HEADER, SNAPSHOT_MAGIC, SnapshotProducer,
+                      export_snapshot_file, import_snapshot, manifest_path,
+                      read_snapshot, write_snapshot)
+from storage import open_chain
+
+
+@pytest.fixture
+def mined():
+    blockchain = Blockchain()
+    for n in range(7):
+        blockchain.add_new_transaction({"n": n})
+        blockchain.mine_block()
+    return blockchain
+
+
+def export(blockchain, chunk_blocks=3):
+    output = io.BytesIO()
+    manifest = write_snapshot(blockchain.snapshot(), output, chunk_blocks)
+    return output.getvalue(), manifest
+
+
+def test_snapshot_round_trip_in_chunks(mined):
+    data, manifest = export(mined)
+
+    imported = import_snapshot(io.BytesIO(data), manifest=manifest)
+
+    assert [chunk["blocks"] for chunk in manifest["chunks"]] == [3, 3, 2]
+    assert manifest["tip_hash"] == mined.last_block.hash
+    assert [block.to_dict() for block in imported.chain] == [
+        block.to_dict() for block in mined.chain
+    ]
+
+
+def test_snapshot_imports_into_stored_chain(mined, tmp_path):
+    data, _ = export(mined)
+    progress = []
+
+    imported = import_snapshot(
+        io.BytesIO(data), open_chain(str(tmp_path)), progress=progress.append
+    )
+    imported.chain.close()
+    reopened = Blockchain(chain=open_chain(str(tmp_path)))
+
+    assert progress == [3, 6, 8]
+    assert reopened.last_block.hash == mined.last_block.hash
+
+
+def test_snapshot_rejects_corrupted_chunk(mined):
+    data, _ = export(mined)
+    corrupted = bytearray(data)
+    corrupted[len(SNAPSHOT_MAGIC) + CHUNK_HEADER.size + 5] ^= 0xFF
+
+    with pytest.raises(ValueError, match="chunk hash mismatch at height 0"):
+        import_snapshot(io.BytesIO(bytes(corrupted)))
+
+
+def test_snapshot_rejects_truncated_stream(mined):
+    data, _ = export(mined)
+
+    with pytest.raises(ValueError, match="Snapshot truncated"):
+        list(read_snapshot(io.BytesIO(data[:-CHUNK_HEADER.size])))
+
+
+def test_snapshot_rejects_chunk_not_in_manifest(mined):
+    _, manifest = export(mined)
+    other_data, _ = export(mined, chunk_blocks=4)
+
+    with pytest.raises(ValueError, match="does not match manifest"):
+        import_snapshot(io.BytesIO(other_data), manifest=manifest)
+
+
+def test_snapshot_rejects_wrong_difficulty_in_later_chunk(mined):
+    blocks = list(mined.chain)
+    forged = Block(
+        transactions=[],
+        timestamp=blocks[-1].timestamp + 1,
+        previous_hash=blocks[-1].hash,
+        difficulty=blocks[-1].difficulty * 2,
+    )
+    forged.calculate_proof_of_work()
+    output = io.BytesIO()
+    write_snapshot(blocks + [forged], output, chunk_blocks=3)
+
+    with pytest.raises(ValueError, match="Block difficulty incorrect at height 8"):
+        import_snapshot(io.BytesIO(output.getvalue()))
+
+
+def test_snapshot_endpoints(client, set_blockchain, monkeypatch, tmp_path, mined):
+    producer = SnapshotProducer(str(tmp_path / "chain.snapshot"), chunk_blocks=2)
+    monkeypatch.setattr(p2p, "snapshot_producer", producer)
+    p2p.blockchain = mined
+
+    assert client.get("/snapshot").status_code == 404
+    assert client.post("/snapshot").status_code == 202
+    producer.join()
+    status = client.get("/snapshot/status").get_json()
+    manifest = client.get("/snapshot/manifest").get_json()
+    response = client.get("/snapshot")
+
+    assert status["running"] is False and status["blocks_written"] == 8
+    assert status["last_snapshot"]["tip_hash"] == mined.last_block.hash
+    imported = import_snapshot(io.BytesIO(response.data), manifest=manifest)
+    assert imported.last_block.hash == mined.last_block.hash
+
+
+def test_export_replaces_snapshot_and_manifest_together(tmp_path, mined):
+    path = str(tmp_path / "chain.snapshot")
+    export_snapshot_file(list(mined.chain)[:4], path, chunk_blocks=2)
+    manifest = export_snapshot_file(mined.snapshot(), path, chunk_blocks=2)
+
+    with open(manifest_path(path)) as manifest_file:
+        assert json.load(manifest_file) == manifest
+    with open(path, "rb") as snapshot_file:
+        imported = import_snapshot(snapshot_file, manifest=manifest)
+    assert imported.last_block.hash == mined.last_block.hash
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["chain.snapshot", "chain.snapshot.json", "chain.snapshot.current", os.readlink(path + ".current")]
+    )
+
+
+def test_snapshot_producer_records_any_failure(tmp_path):
+    producer = SnapshotProducer(str(tmp_path / "chain.snapshot"))
+
+    producer.start([None])
+    producer.join()
+
+    status = producer.status()
+    assert status["running"] is False
+    assert status["error"].startswith("AttributeError")
+    assert status["last_snapshot"] is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from classes import Block, Blockchain, compute_transaction_id
+from signatures import requires_signature, sign_transaction
+from state import transfer_of
+
+KEYS = {name: Ed25519PrivateKey.generate() for name in ("alice", "bob", "carol")}
+
+
+def address(name):
+    return sign_transaction({}, KEYS[name])["sender"]
+
+
+def transfer(sender, recipient, amount):
+    return sign_transaction({"recipient": address(recipient), "amount": amount}, KEYS[sender])
+
+
+def test_index_tracks_blocks_mined_after_first_use():
+    blockchain = Blockchain()
+    blockchain.add_new_transaction(transfer("alice", "bob", 5))
+    blockchain.mine_block()
+    assert blockchain.get_balance(address("bob")) == (5, 1)
+
+    blockchain.add_new_transaction({"note": "not a transfer"})
+    blockchain.add_new_transaction(transfer("bob", "carol", 2))
+    blockchain.mine_block()
+
+    assert blockchain.get_balance(address("bob")) == (3, 2)
+    assert blockchain.get_balance(address("alice")) == (-5, 2)
+    block, height, position, transaction = blockchain.find_transaction(
+        compute_transaction_id(transfer("bob", "carol", 2))
+    )
+    assert (block.hash, height, position) == (blockchain.last_block.hash, 2, 1)
+    assert transaction == transfer("bob", "carol", 2)
+
+
+def test_reorganization_rolls_state_back_and_forward():
+    local = Blockchain()
+    remote = Blockchain()
+    local.add_new_transaction(transfer("alice", "bob", 5))
+    local.mine_block()
+    local.state()  # built before the reorganization, so it has to be rolled back
+    remote.add_new_transaction(transfer("alice", "carol", 7))
+    remote.mine_block()
+    remote.mine_block()
+
+    for block in remote.chain[1:]:
+        local.verify_and_add_block(block.to_dict())
+
+    assert local.get_balance(address("bob")) == (0, 2)
+    assert local.get_balance(address("carol")) == (7, 2)
+    assert local.find_transaction(compute_transaction_id(transfer("alice", "bob", 5))) is None
+
+
+@pytest.mark.parametrize("amount", [-100, 0, float("nan"), float("inf"), True, "5"])
+def test_invalid_amounts_are_not_transfers(amount):
+    transaction = transfer("alice", "bob", amount)
+
+    assert transfer_of(transaction) is None
+    assert requires_signature(transaction)
+    with pytest.raises(ValueError, match="Invalid transfer"):
+        Blockchain().add_new_transaction(transaction)
+    results = Blockchain().add_new_transactions([transaction])
+    assert results[0]["status"] == "rejected"
+
+
+def test_large_integer_amount_is_a_transfer():
+    assert transfer_of(transfer("alice", "bob", 10**400))[2] == 10**400
+
+
+def test_confirmed_transfer_cannot_be_replayed():
+    blockchain = Blockchain()
+    payment = transfer("alice", "bob", 5)
+    blockchain.add_new_transaction(payment)
+    blockchain.mine_block()
+
+    with pytest.raises(ValueError, match="already in the chain"):
+        blockchain.add_new_transaction(payment)
+    assert blockchain.add_new_transactions([payment])[0]["status"] == "rejected"
+    assert blockchain.unconfirmed_transactions == []
+
+    replay = Block(
+        [payment],
+        timestamp=time.time(),
+        previous_hash=blockchain.last_block.hash,
+        difficulty=blockchain.next_difficulty(),
+    )
+    replay.calculate_proof_of_work()
+    with pytest.raises(ValueError, match="already in the chain"):
+        blockchain.verify_and_add_block(replay.to_dict())
+    assert blockchain.get_balance(address("bob")) == (5, 1)
+
+
+def test_branch_may_confirm_transfer_of_disconnected_block():
+    local = Blockchain()
+    remote = Blockchain()
+    payment = transfer("alice", "bob", 5)
+    local.add_new_transaction(payment)
+    local.mine_block()
+    remote.mine_block()
+    remote.add_new_transaction(payment)
+    remote.mine_block()
+
+    for block in remote.chain[1:]:
+        local.verify_and_add_block(block.to_dict())
+
+    assert local.last_block.hash == remote.last_block.hash
+    assert local.get_balance(address("bob")) == (5, 2)
@@ -0,0 +1,100 @@
+import json
+import os
+import zlib
+
+import pytest
+
+from classes import Blockchain, StaleSnapshotError
+from storage import (INDEX_FILE, RECORD_HEADER, SEGMENT_FILE, BlockStore,
+                     open_chain)
+
+
+def mine_blocks(directory, count):
+    blockchain = Blockchain(chain=open_chain(str(directory)))
+    for n in range(count):
+        blockchain.add_new_transaction({"test": n})
+        blockchain.mine_block()
+    blockchain.chain.store.close()
+    return blockchain
+
+
+def test_chain_survives_restart(tmp_path):
+    mined = mine_blocks(tmp_path, 3)
+
+    restarted = Blockchain(chain=open_chain(str(tmp_path)))
+
+    assert len(restarted.chain) == 4
+    assert restarted.last_block.hash == mined.last_block.hash
+    assert restarted.get_block(mined.chain[1].hash).nonce == mined.chain[1].nonce
+
+
+def test_torn_segment_tail_is_truncated(tmp_path):
+    mine_blocks(tmp_path, 2)
+    segment_path = os.path.join(tmp_path, SEGMENT_FILE)
+    with open(segment_path, "ab") as segment:
+        segment.write(b"\x00\x00\x01\x00partial")
+
+    store = BlockStore(str(tmp_path))
+
+    assert len(store) == 3
+    assert store.read(2).previous_hash == store.read(1).hash
+
+
+def test_unindexed_records_are_recovered(tmp_path):
+    mine_blocks(tmp_path, 2)
+    index_path = os.path.join(tmp_path, INDEX_FILE)
+    with open(index_path, "r+b") as index:
+        index.truncate(os.path.getsize(index_path) - 10)
+
+    store = BlockStore(str(tmp_path))
+
+    assert len(store) == 3
+    assert store.height_of(store.read(2).hash) == 2
+
+
+def test_stored_chain_reorganizes_to_competing_branch(tmp_path):
+    local = Blockchain(chain=open_chain(str(tmp_path)))
+    disconnected = local.mine_block()
+    local.get_height(disconnected.hash)  # builds the lazy hash index kept across truncation
+    remote = Blockchain()
+    for _ in range(2):
+        local.verify_and_add_block(remote.mine_block().to_dict())
+    local.chain.store.close()
+
+    restarted = Blockchain(chain=open_chain(str(tmp_path)))
+
+    assert [block.hash for block in restarted.chain] == [
+        block.hash for block in remote.chain
+    ]
+    assert local.get_height(disconnected.hash) is None
+    assert local.get_height(remote.last_block.hash) == 2
+
+
+def test_reads_json_records_of_older_stores(tmp_path):
+    genesis = Blockchain().last_block
+    payload = json.dumps(genesis.to_dict(), sort_keys=True).encode()
+    with open(os.path.join(tmp_path, SEGMENT_FILE), "wb") as segment:
+        segment.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+
+    restarted = Blockchain(chain=open_chain(str(tmp_path)))
+
+    assert restarted.last_block.to_dict() == genesis.to_dict()
+
+
+def test_snapshot_of_stored_chain_detects_blocks_replaced_by_reorganization(tmp_path):
+    local = Blockchain(chain=open_chain(str(tmp_path)))
+    mined = local.mine_block()
+    snapshot = local.snapshot()
+    remote = Blockchain()
+    for _ in range(2):
+        local.verify_and_add_block(remote.mine_block().to_dict())
+
+    assert snapshot[0].hash == local.chain[0].hash
+    with pytest.raises(StaleSnapshotError):
+        snapshot[1]
+    with pytest.raises(StaleSnapshotError):
+        list(snapshot)
+    assert snapshot.index_of(local.chain[1].hash) is None
+    assert local.snapshot()[1].hash == remote.chain[1].hash
+    assert mined.hash != remote.chain[1].hash
+    local.chain.store.close()
@@ -0,0 +1,92 @@
+from unittest.mock import Mock, patch
+
+import pytest
+
+import p2p
+from classes import Blockchain
+from p2p import sync_blockchain
+
+
+@pytest.fixture
+def peer_requests(client):
+    def post(url, json):
+        response = client.post(url.removeprefix("http://peer"), json=json)
+        return Mock(status_code=response.status_code, json=response.get_json)
+
+    with patch("p2p.requests.post", side_effect=post) as mock_post:
+        yield mock_post
+
+
+def test_sync_downloads_whole_chain(peer_requests, set_blockchain):
+    for i in range(3):
+        p2p.blockchain.add_new_transaction({"test": i})
+        p2p.blockchain.mine_block()
+    local_blockchain = Blockchain()
+
+    added = sync_blockchain(local_blockchain, "http://peer")
+
+    assert added == 3
+    assert [block.hash for block in local_blockchain.chain] == [
+        block.hash for block in p2p.blockchain.chain
+    ]
+
+
+def test_sync_downloads_only_missing_blocks(peer_requests, set_blockchain):
+    p2p.blockchain.mine_block()
+    local_blockchain = Blockchain(chain=list(p2p.blockchain.chain))
+    p2p.blockchain.mine_block()
+    p2p.blockchain.mine_block()
+
+    added = sync_blockchain(local_blockchain, "http://peer")
+
+    assert added == 2
+    assert local_blockchain.last_block.hash == p2p.blockchain.last_block.hash
+    blocks_requests = [
+        call for call in peer_requests.call_args_list if call.args[0].endswith("/blocks")
+    ]
+    assert blocks_requests[0].kwargs["json"]["hashes"] == [
+        block.hash for block in p2p.blockchain.chain[2:]
+    ]
+
+
+def test_sync_reorganizes_diverged_node(peer_requests, set_blockchain):
+    for i in range(3):
+        p2p.blockchain.add_new_transaction({"remote": i})
+        p2p.blockchain.mine_block()
+    local_blockchain = Blockchain()
+    local_blockchain.add_new_transaction({"local": 0})
+    local_blockchain.mine_block()
+
+    sync_blockchain(local_blockchain, "http://peer")
+
+    assert local_blockchain.last_block.hash == p2p.blockchain.last_block.hash
+    assert local_blockchain.unconfirmed_transactions == [{"local": 0}]
+
+
+def test_sync_continues_competing_branch_across_header_batches(
+    peer_requests, set_blockchain, monkeypatch
+):
+    monkeypatch.setattr("p2p.HEADERS_BATCH_SIZE", 2)
+    for _ in range(4):
+        p2p.blockchain.mine_block()
+    local_blockchain = Blockchain()
+    for _ in range(3):
+        local_blockchain.mine_block()
+
+    added = sync_blockchain(local_blockchain, "http://peer")
+
+    assert added == 4
+    assert local_blockchain.last_block.hash == p2p.blockchain.last_block.hash
+
+
+def test_sync_rejects_chain_not_matching_checkpoint(
+    peer_requests, set_blockchain, monkeypatch
+):
+    p2p.blockchain.mine_block()
+    monkeypatch.setattr("p2p.CHECKPOINTS", {1: "0" * 64})
+    local_blockchain = Blockchain()
+
+    with pytest.raises(ValueError, match="Checkpoint mismatch at height 1"):
+        sync_blockchain(local_blockchain, "http://peer")
+
+    assert len(local_blockchain.chain) == 1
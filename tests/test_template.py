@@ -0,0 +1,112 @@
+from hashlib import sha256
+
+import pytest
+
+from classes import Blockchain, compute_transaction_id, hash_header
+from merkle import MerkleTree
+from template import BlockTemplate
+
+
+def find_nonce(work):
+    prefix_state = sha256(bytes.fromhex(work["header_prefix"]))
+    target = bytes.fromhex(work["target"])
+    nonce = 0
+    while hash_header(prefix_state, nonce) > target:
+        nonce += 1
+    return nonce
+
+
+def assert_consistent(block, tx_ids):
+    assert list(block.transaction_ids()) == tx_ids
+    assert block.merkle_root == MerkleTree(tx_ids).root
+
+
+def test_candidate_follows_transactions_and_blocks():
+    blockchain = Blockchain()
+    template = blockchain.block_template()
+    for n in range(5):
+        blockchain.add_new_transaction({"n": n})
+    blockchain.add_new_transactions([{"n": n} for n in range(5, 8)])
+
+    block, tx_ids = template.candidate()
+    assert_consistent(block, tx_ids)
+    assert len(tx_ids) == 8
+
+    other = Blockchain(chain=list(blockchain.chain))
+    for n in (1, 6):
+        other.add_new_transaction({"n": n})
+    blockchain.verify_and_add_block(other.mine_block().to_dict())
+    blockchain.add_new_transaction({"n": 8})
+
+    block, tx_ids = template.candidate()
+    assert_consistent(block, tx_ids)
+    assert block.previous_hash == blockchain.last_block.hash
+    assert block.difficulty == blockchain.next_difficulty()
+    assert sorted(transaction["n"] for transaction in block.transactions) == [0, 2, 3, 4, 5, 7, 8]
+
+
+def test_full_template_replaces_lowest_fee_transaction():
+    blockchain = Blockchain()
+    template = BlockTemplate(blockchain, max_transactions=3)
+    template.candidate()
+    for transaction in ({"n": 0, "fee": 2}, {"n": 1}, {"n": 2, "fee": 1}, {"n": 3}):
+        tx_id = blockchain.mempool.add(transaction)
+        template.add_transactions([(tx_id, transaction)])
+    transaction = {"n": 4, "fee": 3}
+    template.add_transactions([(compute_transaction_id(transaction), transaction)])
+
+    block, tx_ids = template.candidate()
+
+    assert_consistent(block, tx_ids)
+    assert sorted(transaction["n"] for transaction in block.transactions) == [0, 2, 4]
+
+
+def test_submit_work_adds_block():
+    blockchain = Blockchain()
+    template = blockchain.block_template()
+    blockchain.add_new_transaction({"n": 1})
+    work = template.get_work()
+
+    block = template.submit_work(work["work_id"], find_nonce(work))
+
+    assert blockchain.last_block is block
+    assert block.transactions == ({"n": 1},)
+    assert block.is_proof_valid(block.hash)
+    assert work["height"] == blockchain.get_height(block.hash) == 1
+    assert blockchain.unconfirmed_transactions == []
+
+
+def test_submit_work_rejects_invalid_nonce_and_stale_work():
+    blockchain = Blockchain()
+    template = blockchain.block_template()
+    work = template.get_work()
+    nonce = find_nonce(work)
+    prefix_state = sha256(bytes.fromhex(work["header_prefix"]))
+    invalid_nonce = next(
+        n for n in range(nonce + 1, nonce + 10_000)
+        if hash_header(prefix_state, n) > bytes.fromhex(work["target"])
+    )
+
+    with pytest.raises(ValueError, match="Proof of work invalid"):
+        template.submit_work(work["work_id"], invalid_nonce)
+
+    blockchain.mine_block()
+    with pytest.raises(ValueError, match="Stale work"):
+        template.submit_work(work["work_id"], nonce)
+
+
+def test_submit_work_rejects_nonce_outside_encodable_range():
+    blockchain = Blockchain()
+    template = blockchain.block_template()
+    work = template.get_work()
+    prefix_state = sha256(bytes.fromhex(work["header_prefix"]))
+    # A nonce past 64 bits may still give a hash below the target, but no block could encode it.
+    large_nonce = next(
+        n for n in range(2**64, 2**64 + 100_000)
+        if hash_header(prefix_state, n) <= bytes.fromhex(work["target"])
+    )
+
+    for nonce in (large_nonce, True, -1):
+        with pytest.raises(ValueError, match="Incorrect nonce"):
+            template.submit_work(work["work_id"], nonce)
+    assert len(blockchain.chain) == 1
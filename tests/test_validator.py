@@ -0,0 +1,96 @@
+import pytest
+
+from classes import Block, Blockchain
+from validator import ChainValidator
+
+
+@pytest.fixture
+def mined_chain():
+    blockchain = Blockchain()
+    for n in range(6):
+        blockchain.add_new_transaction({"n": n})
+        blockchain.mine_block()
+    return [Block.from_dict(dict(block.to_dict())) for block in blockchain.chain]
+
+
+def test_validates_chain_in_parallel(mined_chain):
+    progress = []
+    with ChainValidator(
+        workers=2, chunk_size=2, progress=lambda *args: progress.append(args)
+    ) as validator:
+        validator.validate(mined_chain)
+
+    assert progress == [(2, 7), (4, 7), (6, 7), (7, 7)]
+
+
+def test_rejects_tampered_block(mined_chain):
+    mined_chain[4].transactions = [{"n": "forged"}]
+
+    with pytest.raises(ValueError, match="Block proof invalid at height 4"):
+        with ChainValidator(workers=2, chunk_size=2) as validator:
+            validator.validate(mined_chain)
+
+
+def test_rejects_wrong_difficulty(mined_chain):
+    mined_chain[5].difficulty += 1
+
+    with pytest.raises(ValueError, match="Block difficulty incorrect at height 5"):
+        ChainValidator(workers=1).validate(mined_chain)
+
+
+def test_rejects_timestamp_not_above_median(mined_chain):
+    mined_chain[5].timestamp = mined_chain[3].timestamp
+    mined_chain[5].calculate_proof_of_work()
+    mined_chain[6].previous_hash = mined_chain[5].hash
+    mined_chain[6].calculate_proof_of_work()
+
+    with pytest.raises(ValueError, match="Block timestamp too early at height 5"):
+        ChainValidator(workers=1).validate(mined_chain)
+
+
+def test_rejects_broken_link(mined_chain):
+    mined_chain[3].previous_hash = mined_chain[1].hash
+
+    with pytest.raises(ValueError, match="Previous hash incorrect at height 3"):
+        ChainValidator(workers=1).validate(mined_chain)
+
+
+def test_checkpoint_still_checks_bodies_of_older_blocks(mined_chain):
+    validator = ChainValidator(checkpoints={3: mined_chain[3].hash}, workers=1)
+    validator.validate(mined_chain)
+
+    mined_chain[2].transactions = [{"forged": True}]
+    with pytest.raises(ValueError, match="Merkle root incorrect at height 2"):
+        validator.validate(mined_chain)
+
+
+def test_checkpoint_still_checks_hashes_of_older_blocks(mined_chain):
+    mined_chain[1].nonce += 1
+    validator = ChainValidator(checkpoints={3: mined_chain[3].hash}, workers=1)
+
+    with pytest.raises(ValueError, match="Block hash incorrect at height 1"):
+        validator.validate(mined_chain)
+
+
+def test_rejects_checkpoint_mismatch(mined_chain):
+    validator = ChainValidator(checkpoints={3: mined_chain[2].hash}, workers=1)
+
+    with pytest.raises(ValueError, match="Checkpoint mismatch at height 3"):
+        validator.validate(mined_chain)
+
+
+def test_blockchain_from_dict_validates_chain():
+    blockchain = Blockchain()
+    blockchain.mine_block()
+    blockchain_dict = blockchain.to_dict()
+    blockchain_dict["chain"][1]["nonce"] += 1
+
+    with pytest.raises(ValueError, match="Block proof invalid at height 1"):
+        Blockchain.from_dict(blockchain_dict)
+
+
+def test_rejects_forged_genesis_body(mined_chain):
+    mined_chain[0].transactions = [{"forged": True}]
+
+    with pytest.raises(ValueError, match="Merkle root incorrect at height 0"):
+        ChainValidator(workers=1).validate(mined_chain)
@@ -0,0 +1,87 @@
+import socket
+import threading
+
+import pytest
+
+from classes import Blockchain
+from wire import (INV_BLOCK, INV_TRANSACTION, MSG_ADD_BLOCK, FrameDecoder,
+                  decode_block, decode_get_blocks, decode_inventory,
+                  decode_node, encode_block, encode_get_blocks,
+                  encode_inventory, encode_message, encode_node, read_message)
+
+
+def test_block_round_trip():
+    blockchain = Blockchain()
+    for i in range(200):
+        blockchain.add_new_transaction({"test": "x" * 20, "n": i})
+    block = blockchain.mine_block()
+
+    assert decode_block(encode_block(block.to_dict())) == block.to_dict()
+
+
+def test_genesis_block_round_trip():
+    genesis = Blockchain().chain[0]
+
+    assert decode_block(encode_block(genesis.to_dict())) == genesis.to_dict()
+
+
+def test_node_round_trip():
+    node = {"host": "127.0.0.1", "port": 5000}
+
+    assert decode_node(encode_node(node)) == node
+
+
+def test_get_blocks_round_trip():
+    blockchain = Blockchain()
+    for _ in range(3):
+        blockchain.mine_block()
+    node = {"host": "127.0.0.1", "port": 5001}
+    locator = blockchain.block_locator()
+
+    assert decode_get_blocks(encode_get_blocks(node, locator)) == (node, locator)
+
+
+def test_read_message_handles_large_payload():
+    payload = bytes(range(256)) * 4096
+    left, right = socket.socketpair()
+
+    def send():
+        left.sendall(encode_message(MSG_ADD_BLOCK, payload[:10]))
+        left.sendall(encode_message(MSG_ADD_BLOCK, payload))
+        left.shutdown(socket.SHUT_WR)
+
+    with left, right:
+        sender = threading.Thread(target=send)
+        sender.start()
+
+        assert read_message(right) == (MSG_ADD_BLOCK, payload[:10])
+        assert read_message(right) == (MSG_ADD_BLOCK, payload)
+        assert read_message(right) is None
+        sender.join()
+
+
+def test_frame_decoder_handles_partial_data():
+    frames = encode_message(MSG_ADD_BLOCK, b"first") + encode_message(
+        MSG_ADD_BLOCK, b"second"
+    )
+    decoder = FrameDecoder()
+
+    messages = []
+    for i in range(len(frames)):
+        messages.extend(decoder.feed(frames[i : i + 1]))
+
+    assert messages == [(MSG_ADD_BLOCK, b"first"), (MSG_ADD_BLOCK, b"second")]
+
+
+def test_decode_rejects_truncated_block():
+    payload = encode_block(Blockchain().chain[0].to_dict())
+
+    with pytest.raises(ValueError):
+        decode_block(payload[:-1])
+
+
+def test_inventory_round_trip():
+    node = {"host": "127.0.0.1", "port": 5000}
+    items = [(INV_BLOCK, "ab" * 32), (INV_TRANSACTION, "cd" * 32)]
+
+    assert decode_inventory(encode_inventory(node, items)) == (node, items)
@@ -0,0 +1,224 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from classes import RETARGET_WINDOW, Block, check_timestamp, retarget, validate_transaction
+from signatures import requires_signature, verify_signature
+
+VALIDATION_WORKERS = int(os.environ.get("VALIDATION_WORKERS", os.cpu_count() or 1))
+VALIDATION_CHUNK_SIZE = 200
+
+
+def _find_invalid_block(heights, blocks, trusted_height=-1):
+    """
+    Checks proofs of work, well-formedness of transactions and transaction signatures of blocks.
+
+    Args:
+        heights (list): Heights of the blocks, used to report the invalid one.
+        blocks (list): A list of Blocks.
+        trusted_height (int): Height of the highest matched checkpoint; hashes of blocks up to it are not
+            compared with the difficulty target.
+
+    Returns:
+        A message describing the first invalid block, or None if all blocks are valid.
+    """
+    for height, block in zip(heights, blocks):
+        if height is not None and height <= trusted_height:
+            # The checkpoint vouches for the header chain, but the block must still match its hash
+            # and its transactions the Merkle root, or a forged body could ride on a genuine header.
+            if not block.has_encodable_fields() or block.hash != block.compute_hash():
+                return f"Block hash incorrect at height {height}"
+            if block.merkle_root != block.build_merkle_tree().root:
+                return f"Merkle root incorrect at height {height}"
+        elif not block.is_proof_valid(block.hash):
+            return f"Block proof invalid at height {height}"
+        for transaction in block.transactions:
+            try:
+                validate_transaction(transaction)
+            except ValueError as e:
+                return f"{e} at height {height}"
+            if requires_signature(transaction):
+                error = verify_signature(transaction)
+                if error is not None:
+                    return f"{error} at height {height}"
+    return None
+
+
+class ChainValidator:
+    """
+    A class validating chains received from untrusted peers.
+
+    Validation runs in two steps. Links between blocks and trusted checkpoints are checked in one cheap
+    pass, so a broken chain is rejected before any hashing. Proofs of work (block hash and Merkle root of
+    transactions) and transaction signatures are then verified in chunks on a pool of processes. Headers up
+    to the highest checkpoint are trusted: once the checkpoint hash matches, their hashes are not compared
+    with the difficulty target, but block bodies are still checked against the headers.
+
+    The process pool is started on first use and kept until close(), so a validator can check many
+    batches of a synchronisation cheaply.
+
+    Attributes:
+        checkpoints (dict): A dictionary mapping heights to trusted block hashes.
+        workers (int): Number of processes verifying proofs; 1 verifies in the calling process.
+        chunk_size (int): Maximum number of blocks verified by a worker in one task.
+        progress (Callable): Optional function called with numbers of verified and all blocks after each chunk.
+    """
+
+    def __init__(
+        self,
+        checkpoints=None,
+        workers=VALIDATION_WORKERS,
+        chunk_size=VALIDATION_CHUNK_SIZE,
+        progress=None,
+    ):
+        self.checkpoints = checkpoints or {}
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stops the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def validate(self, blocks, start_height=0, previous_hash=None, recent_blocks=None):
+        """
+        Validates consecutive blocks.
+
+        Args:
+            blocks (list): A list of Blocks in chain order.
+            start_height (int): Height of the first block, or None if it is not known and checkpoints cannot be checked.
+            previous_hash (str): Hash of the block preceding the first one, or None if blocks start with the genesis block.
+            recent_blocks (list): Blocks preceding the first one, see check_links.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the first block is not the genesis block or does not link to previous_hash.
+            ValueError: If blocks do not link to each other.
+            ValueError: If a block does not match a checkpoint.
+            ValueError: If the proof of work or a transaction signature of a block is invalid.
+        """
+        if not blocks:
+            return
+        trusted_height = self.check_links(
+            blocks, start_height, previous_hash, recent_blocks
+        )
+        start_height = start_height or 0
+        if previous_hash is None:
+            # The genesis block is matched by hash and has no proof of work, only its body is checked.
+            trusted_height = max(trusted_height, start_height)
+        self.check_proofs(
+            blocks, range(start_height, start_height + len(blocks)), trusted_height
+        )
+
+    def check_links(self, blocks, start_height=0, previous_hash=None, recent_blocks=None):
+        """
+        Checks links between blocks and checkpoints in one pass, without hashing.
+
+        Blocks may be headers only (see Block.from_header_dict).
+
+        Args:
+            blocks (list): A list of Blocks in chain order.
+            start_height (int): Height of the first block, or None if it is not known.
+            previous_hash (str): Hash of the block preceding the first one, or None if blocks start with the genesis block.
+            recent_blocks (list): Up to RETARGET_WINDOW blocks preceding the first one, oldest first and without
+                the genesis block, used to check difficulties of blocks continuing a chain. When it is None and
+                previous_hash is given, difficulties are not checked.
+
+        Returns:
+            Height of the highest checkpoint among the blocks, -1 if there is none, to be passed to
+            check_proofs.
+
+        Raises:
+            ValueError: If the first block is not the genesis block or does not link to previous_hash.
+            ValueError: If blocks do not link to each other.
+            ValueError: If a block does not match a checkpoint.
+            ValueError: If a block difficulty does not follow from the blocks before it.
+            ValueError: If a block timestamp is not above the median of the blocks before it or is too far in
+                the future (see check_timestamp).
+        """
+        # Difficulties can only be recomputed when the blocks before each one are known; timestamps of blocks
+        # continuing a chain without them are checked against the preceding blocks of the batch only.
+        check_difficulty = recent_blocks is not None
+        first_checked = 0
+        if previous_hash is None:
+            genesis = Block.genesis()
+            if blocks[0].hash != genesis.hash:
+                raise ValueError("Genesis block incorrect")
+            previous_hash = genesis.previous_hash
+            check_difficulty = True
+            recent_blocks = None
+            first_checked = 1
+        window = deque(recent_blocks or (), maxlen=RETARGET_WINDOW)
+        trusted_height = -1
+        now = time.time()
+        for offset, block in enumerate(blocks):
+            height = (start_height or 0) + offset
+            if block.previous_hash != previous_hash:
+                raise ValueError(f"Previous hash incorrect at height {height}")
+            if offset >= first_checked:
+                if check_difficulty and block.difficulty != retarget(list(window)):
+                    raise ValueError(f"Block difficulty incorrect at height {height}")
+                try:
+                    check_timestamp(block, window, now)
+                except ValueError as e:
+                    raise ValueError(f"{e} at height {height}") from None
+                window.append(block)
+            checkpoint = (
+                self.checkpoints.get(height) if start_height is not None else None
+            )
+            if checkpoint is not None:
+                if block.hash != checkpoint:
+                    raise ValueError(f"Checkpoint mismatch at height {height}")
+                trusted_height = height
+            previous_hash = block.hash
+        return trusted_height
+
+    def check_proofs(self, blocks, heights, trusted_height=-1):
+        """
+        Verifies proofs of work and transaction signatures of blocks on the process pool.
+
+        Args:
+            blocks (list): A list of Blocks.
+            heights (Sequence): Heights of the blocks, or None for unknown ones, used in error messages.
+            trusted_height (int): Height of the highest matched checkpoint (see check_links).
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If the proof of work or a transaction signature of a block is invalid.
+        """
+        heights = list(heights)
+        total = len(blocks)
+        # Small batches are still split between all workers.
+        size = max(1, min(self.chunk_size, -(-total // self.workers)))
+        chunks = [
+            (heights[start : start + size], blocks[start : start + size], trusted_height)
+            for start in range(0, total, size)
+        ]
+        if self.workers <= 1 or len(chunks) <= 1:
+            results = (_find_invalid_block(*chunk) for chunk in chunks)
+        else:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            results = self._executor.map(_find_invalid_block, *zip(*chunks))
+
+        verified = 0
+        for (_, chunk, _), error in zip(chunks, results):
+            if error is not None:
+                raise ValueError(error)
+            verified += len(chunk)
+            if self.progress is not None:
+                self.progress(verified, total)
@@ -0,0 +1,457 @@
+import json
+import struct
+
+PROTOCOL_VERSION = 2
+MAX_PAYLOAD_SIZE = 32 * 1024 * 1024
+
+MSG_ADD_NODE = 1
+MSG_ADD_BLOCK = 2
+MSG_GET_BLOCKS = 3
+MSG_INV = 4
+MSG_GET_DATA = 5
+MSG_ADD_TRANSACTIONS = 6
+MESSAGE_NAMES = {
+    MSG_ADD_NODE: "add_node",
+    MSG_ADD_BLOCK: "add_block",
+    MSG_GET_BLOCKS: "get_blocks",
+    MSG_INV: "inv",
+    MSG_GET_DATA: "get_data",
+    MSG_ADD_TRANSACTIONS: "add_transactions",
+}
+
+# Kinds of inventory items announced with MSG_INV and requested with MSG_GET_DATA.
+INV_BLOCK = 0
+INV_TRANSACTION = 1
+MAX_INVENTORY_ITEMS = 65535
+
+# Frame header: payload length, protocol version, message type.
+FRAME_HEADER = struct.Struct("!IBB")
+
+_HASH_DIGEST = 0
+_HASH_TEXT = 1
+_HASH_NONE = 2
+_TIMESTAMP_INT = 0
+_TIMESTAMP_FLOAT = 1
+
+_U8 = struct.Struct("!B")
+_U16 = struct.Struct("!H")
+_U32 = struct.Struct("!I")
+_U64 = struct.Struct("!Q")
+_I64 = struct.Struct("!q")
+_F64 = struct.Struct("!d")
+
+
+def encode_message(msg_type, payload):
+    """
+    Wraps a payload into a frame.
+
+    Args:
+        msg_type (int): Type of the message, one of MSG_* constants.
+        payload (bytes): Encoded message body.
+
+    Returns:
+        The frame as bytes.
+
+    Raises:
+        ValueError: If the payload exceeds MAX_PAYLOAD_SIZE.
+    """
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise ValueError("Message payload too large")
+    return FRAME_HEADER.pack(len(payload), PROTOCOL_VERSION, msg_type) + payload
+
+
+def _parse_frame_header(header):
+    length, version, msg_type = FRAME_HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version: {version}")
+    if length > MAX_PAYLOAD_SIZE:
+        raise ValueError("Message payload too large")
+    return length, msg_type
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_message(sock):
+    """
+    Reads one frame from a socket, handling partial reads.
+
+    Args:
+        sock (socket): A socket object representing a connection.
+
+    Returns:
+        A tuple (message type, payload), or None if the connection was closed before a new frame started.
+
+    Raises:
+        ValueError: If the connection was closed in the middle of a frame or the frame header is invalid.
+    """
+    header = _recv_exact(sock, FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        raise ValueError("Connection closed in the middle of a frame header")
+    length, msg_type = _parse_frame_header(header)
+    payload = _recv_exact(sock, length)
+    if len(payload) < length:
+        raise ValueError("Connection closed in the middle of a frame")
+    return msg_type, payload
+
+
+class FrameDecoder:
+    """
+    An incremental decoder of frames from a byte stream, for readers which receive data in arbitrary pieces.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    @property
+    def pending(self):
+        """Number of buffered bytes not forming a complete frame yet."""
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Adds received data and returns messages completed by it.
+
+        Args:
+            data (bytes): Received data.
+
+        Returns:
+            A list of (message type, payload) tuples.
+
+        Raises:
+            ValueError: If a frame header is invalid.
+        """
+        self._buffer += data
+        messages = []
+        while len(self._buffer) >= FRAME_HEADER.size:
+            length, msg_type = _parse_frame_header(
+                bytes(self._buffer[: FRAME_HEADER.size])
+            )
+            end = FRAME_HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            messages.append((msg_type, bytes(self._buffer[FRAME_HEADER.size : end])))
+            del self._buffer[:end]
+        return messages
+
+
+class _Reader:
+    """Reads encoded fields from a payload, turning truncated data into ValueError."""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def take(self, size):
+        if self.offset + size > len(self.data):
+            raise ValueError("Truncated message payload")
+        chunk = self.data[self.offset : self.offset + size]
+        self.offset += size
+        return chunk
+
+    def unpack(self, fmt):
+        return fmt.unpack(self.take(fmt.size))[0]
+
+    def finish(self):
+        if self.offset != len(self.data):
+            raise ValueError("Unexpected data after message payload")
+
+
+def _pack_hash(value):
+    if value is None:
+        return _U8.pack(_HASH_NONE)
+    if len(value) == 64:
+        try:
+            return _U8.pack(_HASH_DIGEST) + bytes.fromhex(value)
+        except ValueError:
+            pass
+    encoded = value.encode()
+    return _U8.pack(_HASH_TEXT) + _U8.pack(len(encoded)) + encoded
+
+
+def _unpack_hash(reader):
+    tag = reader.unpack(_U8)
+    if tag == _HASH_DIGEST:
+        return reader.take(32).hex()
+    if tag == _HASH_TEXT:
+        return reader.take(reader.unpack(_U8)).decode()
+    if tag == _HASH_NONE:
+        return None
+    raise ValueError("Invalid hash field")
+
+
+def _pack_timestamp(value):
+    if isinstance(value, int):
+        return _U8.pack(_TIMESTAMP_INT) + _I64.pack(value)
+    return _U8.pack(_TIMESTAMP_FLOAT) + _F64.pack(value)
+
+
+def _unpack_timestamp(reader):
+    tag = reader.unpack(_U8)
+    if tag == _TIMESTAMP_INT:
+        return reader.unpack(_I64)
+    if tag == _TIMESTAMP_FLOAT:
+        return reader.unpack(_F64)
+    raise ValueError("Invalid timestamp field")
+
+
+def encode_transactions(transactions):
+    """
+    Serializes transactions to their canonical compact JSON array form, as used in block encoding.
+
+    Args:
+        transactions (list): A list of transactions.
+
+    Returns:
+        The JSON array as bytes.
+    """
+    return json.dumps(transactions, sort_keys=True, separators=(",", ":")).encode()
+
+
+def pack_block(
+    hash, previous_hash, merkle_root, timestamp, nonce, difficulty, transactions_json
+):
+    """
+    Encodes block fields in binary form, taking transactions already serialized with encode_transactions.
+
+    Returns:
+        The encoded block as bytes.
+    """
+    return b"".join(
+        (
+            _pack_hash(hash),
+            _pack_hash(previous_hash),
+            _pack_hash(merkle_root),
+            _pack_timestamp(timestamp),
+            _U64.pack(nonce),
+            _U64.pack(difficulty),
+            _U32.pack(len(transactions_json)),
+            transactions_json,
+        )
+    )
+
+
+def unpack_block(payload):
+    """
+    Decodes a block encoded with pack_block without parsing its transactions.
+
+    Args:
+        payload (bytes): The encoded block.
+
+    Returns:
+        A tuple (hash, previous hash, Merkle root, timestamp, nonce, difficulty, transactions JSON array as bytes).
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    reader = _Reader(payload)
+    fields = (
+        _unpack_hash(reader),
+        _unpack_hash(reader),
+        _unpack_hash(reader),
+        _unpack_timestamp(reader),
+        reader.unpack(_U64),
+        reader.unpack(_U64),
+        reader.take(reader.unpack(_U32)),
+    )
+    reader.finish()
+    return fields
+
+
+def encode_block(block_data):
+    """
+    Encodes block data in binary form.
+
+    Hashes are stored as raw 32 byte digests and numbers as fixed size fields. Transactions, which have
+    no fixed schema, are stored as one length prefixed compact JSON array, so encoding them is a single
+    call into the C JSON encoder.
+
+    Args:
+        block_data (dict): A dictionary containing block data.
+
+    Returns:
+        The encoded block as bytes.
+    """
+    return pack_block(
+        block_data["hash"],
+        block_data["previous_hash"],
+        block_data["merkle_root"],
+        block_data["timestamp"],
+        block_data["nonce"],
+        block_data["difficulty"],
+        encode_transactions(block_data["transactions"]),
+    )
+
+
+def decode_block(payload):
+    """
+    Decodes block data encoded with encode_block.
+
+    Args:
+        payload (bytes): The encoded block.
+
+    Returns:
+        A dictionary containing block data.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    *header, transactions_json = unpack_block(payload)
+    block_data = dict(
+        zip(
+            ("hash", "previous_hash", "merkle_root", "timestamp", "nonce", "difficulty"),
+            header,
+        )
+    )
+    transactions = json.loads(transactions_json)
+    if not isinstance(transactions, list):
+        raise ValueError("Invalid transactions field")
+    block_data["transactions"] = transactions
+    return block_data
+
+
+def encode_node(node):
+    """
+    Encodes a node record (host and port) in binary form.
+
+    Args:
+        node (dict): A dictionary with host and port of a node.
+
+    Returns:
+        The encoded node as bytes.
+    """
+    host = node["host"].encode()
+    return _U8.pack(len(host)) + host + _U16.pack(int(node["port"]))
+
+
+def decode_node(payload):
+    """
+    Decodes a node record encoded with encode_node.
+
+    Args:
+        payload (bytes): The encoded node.
+
+    Returns:
+        A dictionary with host and port of a node.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    reader = _Reader(payload)
+    host = reader.take(reader.unpack(_U8)).decode()
+    port = reader.unpack(_U16)
+    reader.finish()
+    return {"host": host, "port": port}
+
+
+def encode_get_blocks(node, locator):
+    """
+    Encodes a request for blocks following a block locator.
+
+    Args:
+        node (dict): A dictionary with host and port of the requesting node, to which blocks are sent.
+        locator (list): A block locator of the requesting node.
+
+    Returns:
+        The encoded request as bytes.
+    """
+    return b"".join(
+        [encode_node(node), _U16.pack(len(locator))]
+        + [_pack_hash(block_hash) for block_hash in locator]
+    )
+
+
+def decode_get_blocks(payload):
+    """
+    Decodes a request for blocks encoded with encode_get_blocks.
+
+    Args:
+        payload (bytes): The encoded request.
+
+    Returns:
+        A tuple (node dictionary, block locator).
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    reader = _Reader(payload)
+    host = reader.take(reader.unpack(_U8)).decode()
+    node = {"host": host, "port": reader.unpack(_U16)}
+    locator = [_unpack_hash(reader) for _ in range(reader.unpack(_U16))]
+    reader.finish()
+    return node, locator
+
+
+def encode_inventory(node, items):
+    """
+    Encodes an inventory: items announced by a node (MSG_INV) or requested from it (MSG_GET_DATA).
+
+    Args:
+        node (dict): A dictionary with host and port of the sending node, to which replies are sent.
+        items (list): A list of at most MAX_INVENTORY_ITEMS tuples (INV_* kind, hash or transaction ID).
+
+    Returns:
+        The encoded inventory as bytes.
+
+    Raises:
+        ValueError: If there are too many items.
+    """
+    if len(items) > MAX_INVENTORY_ITEMS:
+        raise ValueError("Too many inventory items")
+    return b"".join(
+        [encode_node(node), _U16.pack(len(items))]
+        + [_U8.pack(kind) + _pack_hash(item_hash) for kind, item_hash in items]
+    )
+
+
+def decode_inventory(payload):
+    """
+    Decodes an inventory encoded with encode_inventory.
+
+    Args:
+        payload (bytes): The encoded inventory.
+
+    Returns:
+        A tuple (node dictionary, list of (kind, hash) tuples).
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    reader = _Reader(payload)
+    host = reader.take(reader.unpack(_U8)).decode()
+    node = {"host": host, "port": reader.unpack(_U16)}
+    items = [
+        (reader.unpack(_U8), _unpack_hash(reader)) for _ in range(reader.unpack(_U16))
+    ]
+    reader.finish()
+    return node, items
+
+
+def decode_transactions(payload):
+    """
+    Decodes transactions encoded with encode_transactions (MSG_ADD_TRANSACTIONS).
+
+    Args:
+        payload (bytes): The JSON array.
+
+    Returns:
+        A list of transactions.
+
+    Raises:
+        ValueError: If the payload is not a JSON array.
+    """
+    transactions = json.loads(payload)
+    if not isinstance(transactions, list):
+        raise ValueError("Transactions payload is not an array")
+    return transactions